@@ -0,0 +1,69 @@
+# Benchmark: the notebooks' missing values handling (run lengths through groupby-transform, "drop" markers and
+# interpolate, one stock at a time) compared to "clean_nan_runs" on the whole universe at once, on a synthetic
+# daily multipliers table the size of the S&P 500's full history.
+# Run with the "src" directory on the python path (e.g. PYTHONPATH=src) so "utils" can be imported.
+import time
+import numpy as np
+import pandas as pd
+from utils.nan_cleaning import clean_nan_runs
+
+NUM_OF_STOCKS = 500
+NUM_OF_DAYS = 2700          # ~ 11 years of trading days
+VALUE_COLUMNS = ['market_cap', 'enterprise_val', 'pe_ratio', 'pb_ratio', 'trailing_peg_1_y']
+NUM_OF_GAPS_PER_STOCK = 20  # per column, 1-10 days long
+NUM_OF_REPEATS = 3
+
+
+def create_universe() -> pd.DataFrame:
+    rng = np.random.default_rng(711)
+    frame = pd.DataFrame({'id': np.arange(NUM_OF_STOCKS * NUM_OF_DAYS),
+                          'date': np.tile(pd.bdate_range('2012-01-02', periods=NUM_OF_DAYS), NUM_OF_STOCKS),
+                          'stock_id': np.repeat(np.arange(1, NUM_OF_STOCKS + 1), NUM_OF_DAYS)})
+    for column in VALUE_COLUMNS:
+        values = rng.random(len(frame))
+        gap_starts = rng.integers(0, len(frame), NUM_OF_STOCKS * NUM_OF_GAPS_PER_STOCK)
+        gap_lengths = rng.integers(1, 11, len(gap_starts))
+        for gap_start, gap_length in zip(gap_starts, gap_lengths):
+            values[gap_start:gap_start + gap_length] = np.nan
+        frame[column] = values
+    return frame
+
+
+# the notebooks' cells, for a single stock's frame
+def clean_stock_like_notebooks(stock_frame: pd.DataFrame) -> pd.DataFrame:
+    mask = stock_frame.isna()
+    df_na_sizes = (mask.ne(mask.shift()).cumsum()
+                   .where(mask)
+                   .apply(lambda c: c.groupby(c).transform('size')))
+    df_without_consec_nan = stock_frame.mask(df_na_sizes.ge(6), 'drop')
+    df_filtered = df_without_consec_nan[(df_without_consec_nan.iloc[:, 3:] != 'drop').all(axis=1)]
+    df_filtered = df_filtered.astype({column: float for column in VALUE_COLUMNS})
+    df_filtered.iloc[:, 3:] = df_filtered.iloc[:, 3:].interpolate(axis=0, limit_area='inside', limit=5)
+    return df_filtered
+
+
+def clean_universe_like_notebooks(frame: pd.DataFrame) -> pd.DataFrame:
+    return pd.concat([clean_stock_like_notebooks(stock_frame.reset_index(drop=True))
+                      for _, stock_frame in frame.groupby('stock_id')], ignore_index=True)
+
+
+def measure(clean_function, frame: pd.DataFrame) -> tuple[float, pd.DataFrame]:
+    best_time = float('inf')
+    for _ in range(NUM_OF_REPEATS):
+        start_time = time.perf_counter()
+        result = clean_function(frame)
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return best_time, result
+
+
+if __name__ == '__main__':
+    universe = create_universe()
+    print(f"{NUM_OF_STOCKS} stocks x {NUM_OF_DAYS} days, {int(universe[VALUE_COLUMNS].isna().sum().sum())} missing values")
+
+    old_time, old_result = measure(clean_universe_like_notebooks, universe)
+    new_time, new_result = measure(lambda frame: clean_nan_runs(frame, VALUE_COLUMNS), universe)
+
+    pd.testing.assert_frame_equal(old_result, new_result)
+    print(f"rows kept: {len(new_result)}, missing values left: {int(new_result[VALUE_COLUMNS].isna().sum().sum())}")
+    print(f"notebook cells per stock: {old_time:.2f} seconds")
+    print(f"clean_nan_runs:           {new_time:.2f} seconds ({old_time / new_time:.0f}x faster)")
@@ -0,0 +1,63 @@
+# Benchmark: parse time and peak memory of the old SimpleNamespace object_hook parsing compared to
+# TiingoApi's typed decoders, on synthetic payloads the size of a full tiingo history of one stock.
+# Run with the "src" directory on the python path (e.g. PYTHONPATH=src) so "utils" can be imported.
+import json
+import time
+import tracemalloc
+from types import SimpleNamespace
+import numpy as np
+from utils.tiingo_api import decode_end_of_day_prices, decode_daily_multipliers, decode_fundamentals, loads, orjson
+
+NUM_OF_DAYS = 2700          # ~ 11 years of trading days
+NUM_OF_STATEMENTS = 50      # quarterly + annual statements
+NUM_OF_DATA_CODES = 20      # per statement section
+NUM_OF_REPEATS = 5
+
+
+def create_payloads() -> dict[str, tuple]:
+    rng = np.random.default_rng(711)
+    prices = [{"date": "2012-01-01T00:00:00.000Z", "close": rng.random(), "high": rng.random(), "low": rng.random(),
+               "open": rng.random(), "volume": int(rng.integers(1e6)), "adjClose": rng.random(),
+               "adjHigh": rng.random(), "adjLow": rng.random(), "adjOpen": rng.random(),
+               "adjVolume": int(rng.integers(1e6)), "divCash": 0.0, "splitFactor": 1.0} for _ in range(NUM_OF_DAYS)]
+    multipliers = [{"date": "2012-01-01T00:00:00.000Z", "marketCap": rng.random() * 1e9,
+                    "enterpriseVal": rng.random() * 1e9, "peRatio": rng.random(), "pbRatio": rng.random(),
+                    "trailingPEG1Y": rng.random()} for _ in range(NUM_OF_DAYS)]
+    fundamentals = [{"date": "2012-03-31", "year": 2012, "quarter": 1, "statementData": {
+        statement_name: [{"dataCode": f"code{i}", "value": rng.random()} for i in range(NUM_OF_DATA_CODES)]
+        for statement_name in ['balanceSheet', 'cashFlow', 'incomeStatement', 'overview']}}
+        for _ in range(NUM_OF_STATEMENTS)]
+
+    return {'end of day prices': (json.dumps(prices).encode(), decode_end_of_day_prices),
+            'daily multipliers': (json.dumps(multipliers).encode(), decode_daily_multipliers),
+            'fundamentals': (json.dumps(fundamentals).encode(), decode_fundamentals)}
+
+
+# returns (best parse time in ms, peak memory while parsing in MB, memory held by the parsed result in MB)
+def measure(parse_function, body: bytes) -> tuple[float, float, float]:
+    best_time = min(timeit_once(parse_function, body) for _ in range(NUM_OF_REPEATS))
+
+    tracemalloc.start()
+    result = parse_function(body)
+    retained_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return best_time * 1000, peak_memory / 1024 ** 2, retained_memory / 1024 ** 2
+
+
+def timeit_once(parse_function, body: bytes) -> float:
+    start_time = time.perf_counter()
+    parse_function(body)
+    return time.perf_counter() - start_time
+
+
+if __name__ == '__main__':
+    print(f"orjson available: {orjson is not None}")
+    for payload_name, (body, decoder) in create_payloads().items():
+        old_results = measure(lambda b: json.loads(b, object_hook=lambda d: SimpleNamespace(**d)), body)
+        new_results = measure(lambda b: decoder(loads(b)), body)
+        print(f"{payload_name} ({len(body) / 1024 ** 2:.1f} MB):")
+        for title, (parse_time, peak_memory, retained_memory) in [("SimpleNamespace", old_results),
+                                                                   ("typed decoder  ", new_results)]:
+            print(f"    {title} {parse_time:.1f} ms, {peak_memory:.1f} MB peak, {retained_memory:.1f} MB retained")
@@ -0,0 +1,66 @@
+# Micro-benchmark: per-request latency of a fresh connection per request (plain "requests.get")
+# compared to TiingoApi's pooled keep-alive session, both against a local mock of tiingo's http server.
+# Run with the "src" directory on the python path (e.g. PYTHONPATH=src) so "utils" can be imported.
+# Note: the mock server speaks plain http, so the measured gain is the TCP handshake only -
+# against api.tiingo.com every new connection also pays a TLS handshake, so the real gain is larger.
+import json
+import statistics
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from utils.tiingo_api import TiingoApi
+
+NUM_OF_REQUESTS = 500
+RESPONSE_BODY = json.dumps([{"date": "2023-01-03T00:00:00.000Z", "close": 125.07}]).encode()
+
+
+class MockTiingoHandler(BaseHTTPRequestHandler):
+    # http/1.1 allows the client to keep the connection open between requests
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, so nagle's algorithm would delay every kept-alive response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(RESPONSE_BODY)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure_latencies(get_function, url: str) -> list[float]:
+    latencies = []
+    for _ in range(NUM_OF_REQUESTS):
+        start_time = time.perf_counter()
+        get_function(url).json()
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    return latencies
+
+
+def print_latencies(title: str, latencies: list[float]) -> None:
+    latencies = sorted(latencies)
+    print(f"{title}: mean {statistics.mean(latencies):.3f} ms, "
+          f"median {statistics.median(latencies):.3f} ms, p95 {latencies[int(len(latencies) * 0.95)]:.3f} ms")
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockTiingoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    url = f"{base_url}/daily/AAPL/prices"
+
+    # "Connection: close" reproduces the old behaviour - every request opened its own connection
+    new_connection_latencies = measure_latencies(
+        lambda request_url: requests.get(request_url, headers={'Connection': 'close'}), url)
+
+    with TiingoApi(base_url=base_url) as t_api:
+        pooled_session_latencies = measure_latencies(t_api._get, url)
+
+    server.shutdown()
+
+    print_latencies("new connection per request", new_connection_latencies)
+    print_latencies("pooled keep-alive session ", pooled_session_latencies)
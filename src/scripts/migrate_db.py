@@ -0,0 +1,181 @@
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+import sys
+from pathlib import Path
+
+src_dir = Path(__file__).parent.parent.absolute().__str__() # get parent of parent
+sys.path.append(src_dir)
+
+import logging
+import time
+import sqlalchemy as sqlalch
+from utils import models
+from utils.database import get_db, engine
+from utils.bulk_writer import get_natural_key_columns
+from utils.custom_log_formatter import CustomFormatter
+
+# This script brings a database created by an earlier version of "models.py" up to date
+# (natural key unique indexes, composite lookup indexes, DATE columns).
+# It can be run more than once - every step checks what was already done
+
+TABLES_WITH_NATURAL_KEY = [
+    models.StocksByID,
+    models.EndOfDayPrices,
+    models.FullDailyMultipliers,
+    models.PFreeCashFlowMultiplier,
+    models.GrahamNumber,
+    models.QuarterlyBalanceSheetData,
+    models.QuarterlyCashFlow,
+    models.QuarterlyIncomeStatement,
+    models.QuarterlyOverview,
+]
+
+TABLES_WITH_DATE_COLUMN = [
+    models.EndOfDayPrices,
+    models.FullDailyMultipliers,
+    models.PFreeCashFlowMultiplier,
+    models.QuarterlyBalanceSheetData,
+    models.QuarterlyCashFlow,
+    models.QuarterlyIncomeStatement,
+    models.QuarterlyOverview,
+]
+
+NUM_OF_TIMING_REPEATS = 20
+
+# the per-stock lookups the populate/update scripts run over and over, timed before and after the migration
+LOOKUP_QUERIES = {
+    'latest end of day date': "SELECT MAX(date) FROM end_of_day_prices WHERE stock_id = :stock_id",
+    'latest daily multipliers date': "SELECT MAX(date) FROM full_daily_multipliers WHERE stock_id = :stock_id",
+    'latest balance sheet date': "SELECT MAX(date) FROM quarterly_balance_sheet_data WHERE stock_id = :stock_id",
+    'close price range': "SELECT date, close_price FROM end_of_day_prices "
+                         "WHERE stock_id = :stock_id AND date >= '2018-01-01' AND date < '2019-01-01'",
+    'annual free cash flow': "SELECT freeCashFlow FROM quarterly_cash_flow_data "
+                             "WHERE stock_id = :stock_id AND year = 2018 AND quarter = 0",
+    'latest p/fcf quarter': "SELECT year, quarter FROM p_free_cash_flow_multiplier WHERE stock_id = :stock_id "
+                            "ORDER BY year DESC, quarter DESC LIMIT 1",
+}
+
+
+# this function removes rows that were written more than once (same natural key), keeping the first inserted row.
+# Rows with a missing key value are left as they are - the undated p/fcf rows are deleted by "delete_undated_pfcf_rows"
+def deduplicate_table(table: models) -> int:
+    db = get_db()
+    table_name = table.__tablename__
+    key_columns = get_natural_key_columns(table)
+
+    not_null_condition = ' AND '.join(f"{column} IS NOT NULL" for column in key_columns)
+    # the inner query is wrapped in a derived table, since MySQL doesn't allow deleting from a table
+    # that is selected in the same statement's subquery
+    delete_duplicates = sqlalch.text(
+        f"DELETE FROM {table_name} WHERE {not_null_condition} AND id NOT IN "
+        f"(SELECT id FROM (SELECT MIN(id) AS id FROM {table_name} GROUP BY {', '.join(key_columns)}) AS rows_to_keep)")
+    num_of_deleted_rows = db.execute(delete_duplicates).rowcount
+    db.commit()
+
+    return num_of_deleted_rows
+
+
+# this function deletes the p/fcf rows written without a date by the earlier updater. Their date can't be recovered
+# (only the quarter was kept), and they'd stay next to the dated rows of the same quarters with a missing date.
+# "populate_db.py"'s "populate_pfree_cash_flow" re-calculates the ratios of every date
+def delete_undated_pfcf_rows() -> int:
+    db = get_db()
+    table = models.PFreeCashFlowMultiplier
+    num_of_deleted_rows = db.query(table).filter(table.date.is_(None)).delete(synchronize_session=False)
+    db.commit()
+
+    return num_of_deleted_rows
+
+
+# this function creates the indexes defined in "models.py" (unique natural keys and composite lookup indexes)
+# that don't exist in the db yet
+def create_missing_indexes(table: models) -> list[str]:
+    existing_index_names = {index['name'] for index in sqlalch.inspect(engine).get_indexes(table.__tablename__)}
+
+    created_index_names = []
+    for index in table.__table__.indexes:
+        if index.name not in existing_index_names:
+            index.create(bind=engine)
+            created_index_names.append(index.name)
+
+    return created_index_names
+
+
+# this function converts the "date" columns from strings to native DATE columns, in place.
+# Older rows may hold full tiingo timestamps ("2012-01-03T00:00:00.000Z"), they are cut to the date part first.
+# SQLite has no column types to alter (SQLAlchemy stores DATE values as "YYYY-MM-DD" text), so there only
+# the values are normalized
+def convert_date_columns() -> None:
+    db = get_db()
+    dialect_name = db.get_bind().dialect.name
+    for table in TABLES_WITH_DATE_COLUMN:
+        start_time = time.perf_counter()
+        table_name = table.__tablename__
+        date_column = next(column for column in sqlalch.inspect(engine).get_columns(table_name) if column['name'] == 'date')
+
+        substring_function = 'LEFT(date, 10)' if dialect_name == 'mysql' else 'substr(date, 1, 10)'
+        num_of_fixed_rows = db.execute(sqlalch.text(
+            f"UPDATE {table_name} SET date = {substring_function} WHERE LENGTH(date) > 10")).rowcount
+        db.commit()
+
+        converted = False
+        if dialect_name == 'mysql' and not isinstance(date_column['type'], sqlalch.Date):
+            db.execute(sqlalch.text(f"ALTER TABLE {table_name} MODIFY date DATE"))
+            db.commit()
+            converted = True
+
+        logging.info(f"{table_name}: {num_of_fixed_rows} timestamps cut to dates, "
+                     f"column {'converted to DATE' if converted else 'left as it is'} "
+                     f"({time.perf_counter() - start_time:.2f} seconds)")
+
+
+# returns the average time (in ms) of every lookup query, for a stock that exists in the db
+def time_lookup_queries() -> dict[str, float]:
+    db = get_db()
+    stock_id = db.execute(sqlalch.text("SELECT MIN(stock_id) FROM end_of_day_prices")).scalar()
+
+    lookup_times = {}
+    for query_name, query in LOOKUP_QUERIES.items():
+        statement = sqlalch.text(query)
+        start_time = time.perf_counter()
+        for _ in range(NUM_OF_TIMING_REPEATS):
+            db.execute(statement, {'stock_id': stock_id}).fetchall()
+        lookup_times[query_name] = (time.perf_counter() - start_time) / NUM_OF_TIMING_REPEATS * 1000
+
+    db.commit()
+    return lookup_times
+
+
+def add_natural_key_constraints() -> None:
+    for table in TABLES_WITH_NATURAL_KEY:
+        start_time = time.perf_counter()
+        num_of_deleted_rows = deduplicate_table(table)
+        created_index_names = create_missing_indexes(table)
+        logging.info(f"{table.__tablename__}: {num_of_deleted_rows} duplicate rows deleted, "
+                     f"indexes created: {created_index_names or 'none'} ({time.perf_counter() - start_time:.2f} seconds)")
+
+
+if __name__ == '__main__':
+    # initialize logger
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    logging.root.handlers[0].setFormatter(CustomFormatter())
+
+    lookup_times_before = time_lookup_queries()
+
+    logging.info("Converting date columns to DATE...")
+    convert_date_columns()
+
+    logging.info("Deleting the p/fcf rows without a date...")
+    num_of_undated_rows = delete_undated_pfcf_rows()
+    logging.info(f"{models.PFreeCashFlowMultiplier.__tablename__}: {num_of_undated_rows} rows without a date deleted"
+                 f"{', run populate_pfree_cash_flow to re-calculate them' if num_of_undated_rows else ''}")
+
+    logging.info("Removing duplicate rows and adding the natural key and lookup indexes...")
+    add_natural_key_constraints()
+
+    lookup_times_after = time_lookup_queries()
+    for query_name in LOOKUP_QUERIES:
+        logging.info(f"{query_name}: {lookup_times_before[query_name]:.2f} ms before, "
+                     f"{lookup_times_after[query_name]:.2f} ms after")
+    print("process finished")
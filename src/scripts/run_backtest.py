@@ -0,0 +1,72 @@
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+import sys
+from pathlib import Path
+
+src_dir = Path(__file__).parent.parent.absolute().__str__() # get parent of parent
+sys.path.append(src_dir)
+
+import argparse
+import logging
+from datetime import date
+from utils.database import get_db
+from utils import models
+from utils.walk_forward_backtest import WalkForwardBacktest, BacktestConfig, ROLLING_MODE, EXPANDING_MODE
+from utils.custom_log_formatter import CustomFormatter
+
+DEFAULT_OUTPUT_DIR = 'backtest_results'
+
+
+def parse_args() -> argparse.Namespace:
+    defaults = BacktestConfig()
+    parser = argparse.ArgumentParser(prog='run-backtest',
+                                     description="Walk-forward backtest of the random forest signal over the stocks "
+                                                 "of the \"model_features\" table")
+    parser.add_argument('tickers', nargs='*', metavar='ticker', help="stocks to backtest (default: all)")
+    parser.add_argument('--mode', choices=[EXPANDING_MODE, ROLLING_MODE], default=defaults.mode)
+    parser.add_argument('--start-date', type=date.fromisoformat, default=defaults.start_date)
+    parser.add_argument('--train-days', type=int, default=defaults.train_days,
+                        help="length of the first training period (and of every period in rolling mode)")
+    parser.add_argument('--test-days', type=int, default=defaults.test_days, help="days between retrains")
+    parser.add_argument('--label-threshold', type=float, default=defaults.label_threshold)
+    parser.add_argument('--model-threshold', type=float, default=defaults.model_threshold)
+    parser.add_argument('--workers', type=int, default=None, help="number of processes (default: number of cores)")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help="directory the stock / portfolio equity curves and the summary are written to (as csv)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # initialize logger
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    logging.root.handlers[0].setFormatter(CustomFormatter())
+
+    args = parse_args()
+    db = get_db()
+    ticker_name_to_id_dict = {stock.stock_name: stock.id for stock in db.query(models.StocksByID).all()}
+    db.commit()
+    unknown_tickers = [ticker for ticker in args.tickers if ticker not in ticker_name_to_id_dict]
+    if unknown_tickers:
+        sys.exit(f"unknown tickers: {', '.join(unknown_tickers)}")
+
+    config = BacktestConfig(mode=args.mode, start_date=args.start_date, train_days=args.train_days,
+                            test_days=args.test_days, label_threshold=args.label_threshold,
+                            model_threshold=args.model_threshold)
+    stock_ids = [ticker_name_to_id_dict[ticker] for ticker in args.tickers] or None
+    result = WalkForwardBacktest(config, num_of_workers=args.workers).run(stock_ids)
+
+    ticker_id_to_name_dict = {ticker_id: name for name, ticker_id in ticker_name_to_id_dict.items()}
+    result.stock_summary.insert(1, 'ticker', result.stock_summary['stock_id'].map(ticker_id_to_name_dict))
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    result.stock_curves.to_csv(output_dir / 'stock_curves.csv', index=False)
+    result.portfolio_curve.to_csv(output_dir / 'portfolio_curve.csv', index=False)
+    result.stock_summary.to_csv(output_dir / 'stock_summary.csv', index=False)
+
+    print(result.stock_summary.to_string(index=False))
+    if len(result.portfolio_curve) > 0:
+        print(f"portfolio: {int(result.portfolio_curve['num_of_trades'].iloc[-1])} trades, "
+              f"mean profit per trade {result.portfolio_curve['mean_profit_perc'].iloc[-1]:.3f}%")
+    print(f"results written to {output_dir.absolute()}")
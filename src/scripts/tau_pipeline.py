@@ -0,0 +1,421 @@
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+import sys
+from pathlib import Path
+
+src_dir = Path(__file__).parent.parent.absolute().__str__() # get parent of parent
+sys.path.append(src_dir)
+
+import argparse
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+import sqlalchemy as sqlalch
+from utils.database import get_db
+from utils import models
+from utils.tiingo_api import TiingoApi, iter_records
+from utils.tiingo_response_cache import TiingoResponseCache
+from utils.tiingo_concurrent_fetcher import ConcurrentTiingoFetcher
+from utils.tiingo_to_rows import create_quarterly_row, create_end_of_day_prices_row, create_daily_multipliers_row
+from utils.bulk_writer import BulkWriter, frame_to_rows
+from utils.freshness_index import FreshnessIndex
+from utils.progress_ledger import ProgressLedger
+from utils.parquet_store import ParquetStore, EXPORT_TABLES
+from utils.graham_number_calculation import CalcGrahamNumber
+from utils.model_features import ModelFeatureBuilder
+from utils.pfcf_ratio_calculation import CalcPFCFMultiplier
+from utils.custom_log_formatter import CustomFormatter
+from utils.snp500_tickers import fetch_snp500_tickers
+
+# tiingo endpoints the stages are filled from - stages of the same source are fetched together, once per ticker
+PRICES_SOURCE = 'prices'
+STATEMENTS_SOURCE = 'statements'
+DAILY_MULTIPLIERS_SOURCE = 'daily_multipliers'
+
+DEFAULT_NUM_OF_DERIVED_WORKERS = 4
+
+
+@dataclass
+class Stage:
+    name: str
+    # the table the stage writes, None for stages that don't write to the db
+    table: models
+    dependencies: list[str]
+    # the tiingo source of the stage's data, None for stages calculated from other tables
+    source: str | None = None
+
+    # the stage's name in the progress ledger - the table it writes
+    @property
+    def ledger_stage(self) -> str:
+        return self.table.__tablename__ if self.table is not None else self.name
+
+
+# the pipeline's stages as a DAG - every stage lists the stages its input comes from
+STAGES = {stage.name: stage for stage in [
+    Stage('stocks', models.StocksByID, []),
+    Stage('prices', models.EndOfDayPrices, ['stocks'], PRICES_SOURCE),
+    Stage('balance_sheet', models.QuarterlyBalanceSheetData, ['stocks'], STATEMENTS_SOURCE),
+    Stage('cash_flow', models.QuarterlyCashFlow, ['stocks'], STATEMENTS_SOURCE),
+    Stage('income_statement', models.QuarterlyIncomeStatement, ['stocks'], STATEMENTS_SOURCE),
+    Stage('overview', models.QuarterlyOverview, ['stocks'], STATEMENTS_SOURCE),
+    Stage('daily_multipliers', models.FullDailyMultipliers, ['stocks'], DAILY_MULTIPLIERS_SOURCE),
+    Stage('graham', models.GrahamNumber, ['balance_sheet', 'overview', 'income_statement']),
+    Stage('pfcf', models.PFreeCashFlowMultiplier, ['prices', 'balance_sheet', 'cash_flow']),
+    Stage('features', models.ModelFeatures, ['prices', 'daily_multipliers', 'pfcf', 'graham', 'overview']),
+    # per stock parquet files of the tables the model notebooks read (see utils/parquet_store.py)
+    Stage('export', None, ['prices', 'daily_multipliers', 'overview', 'graham', 'pfcf', 'features']),
+]}
+
+# the export needs pyarrow and writes outside of the db, so it runs only when asked for
+DEFAULT_STAGE_NAMES = [stage_name for stage_name in STAGES if stage_name != 'export']
+
+
+@dataclass
+class StageStats:
+    num_of_tickers: int = 0
+    num_of_rows: int = 0
+    work_time: float = 0.0
+    failed_tickers: list[str] = field(default_factory=list)
+
+
+# This class runs the stages of the DAG: the stock list first, then every tiingo source in its own thread
+# (independent stages run concurrently), while the calculated stages (graham, pfcf) start per ticker
+# as soon as all of that ticker's inputs were written - not after the whole universe is done.
+# Every table is filled incrementally from its latest date per stock (so the same run populates an empty db
+# and updates an existing one), "full" re-fetches and re-calculates everything.
+# A ticker's rows of a stage are committed together with its progress ledger row - "resume" skips the tickers
+# the ledger has as done, so an interrupted run continues from the remaining tickers only
+class TauPipeline:
+
+    def __init__(self, stage_names: list[str] = None, full: bool = False, resume: bool = False,
+                 num_of_derived_workers: int = DEFAULT_NUM_OF_DERIVED_WORKERS) -> None:
+        super().__init__()
+
+        # responses are cached on disk, set the "TIINGO_CACHE_OFFLINE" environment variable to 1 to serve from the cache only
+        self.t_api = TiingoApi(cache=TiingoResponseCache(offline=os.getenv('TIINGO_CACHE_OFFLINE') == '1'))
+        self.fetcher = ConcurrentTiingoFetcher()
+        self.graham_number_calc = CalcGrahamNumber()
+        self.pfcf_mult_calc = CalcPFCFMultiplier()
+
+        self.stages = [STAGES[stage_name] for stage_name in (stage_names or DEFAULT_STAGE_NAMES)]
+        self.stage_names = {stage.name for stage in self.stages}
+        self.full = full
+        self.resume = resume
+        self.num_of_derived_workers = num_of_derived_workers
+        self.ledger = ProgressLedger()
+        self.parquet_store = ParquetStore() if 'export' in self.stage_names else None
+        self.feature_builder: ModelFeatureBuilder | None = None
+        self.feature_start_dates: dict[int, date] = {}
+        # per stage, {ticker id: number of rows} of the tickers an interrupted run already completed
+        self.completed_tickers: dict[str, dict[int, int]] = {}
+
+        self.lock = threading.Lock()
+        self.stats = {stage.name: StageStats() for stage in self.stages}
+        # per stage, the tickers whose rows were written (True if any row was new)
+        self.done_tickers: dict[str, dict[int, bool]] = {stage.name: {} for stage in self.stages}
+        self.submitted: set[tuple[str, int]] = set()
+        self.futures: list[Future] = []
+        self.derived_executor: ThreadPoolExecutor | None = None
+
+        self.ticker_name_to_id_dict: dict[str, int] = {}
+        self.ticker_id_to_name_dict: dict[int, str] = {}
+        self.latest_db_dates: dict[str, dict[int, date]] = {}
+
+    def run(self) -> None:
+        start_time = time.perf_counter()
+        if 'stocks' in self.stage_names:
+            self.run_stocks_stage()
+
+        db = get_db()
+        self.ticker_name_to_id_dict = {stock.stock_name: stock.id for stock in db.query(models.StocksByID).all()}
+        self.ticker_id_to_name_dict = {ticker_id: name for name, ticker_id in self.ticker_name_to_id_dict.items()}
+        db.commit()
+
+        ticker_stages = [stage for stage in self.stages if stage.name != 'stocks']
+        if self.resume:
+            self.completed_tickers = {stage.name: self.ledger.load_completed(stage.ledger_stage)
+                                      for stage in ticker_stages}
+        else:
+            self.ledger.reset([stage.ledger_stage for stage in ticker_stages])
+            self.completed_tickers = {stage.name: {} for stage in ticker_stages}
+
+        # latest date per stock of every table, one GROUP BY query per table
+        freshness_index = FreshnessIndex()
+        for stage in self.stages:
+            if hasattr(stage.table, 'date'):
+                self.latest_db_dates[stage.name] = {} if self.full else freshness_index.get_latest_dates(stage.table)
+        if 'features' in self.stage_names:
+            self.feature_builder = ModelFeatureBuilder(freshness_index)
+            # features are re-calculated from each stock's first unlabelled date
+            self.feature_start_dates = {} if self.full else self.feature_builder.get_update_start_dates()
+
+        sources = {stage.source for stage in self.stages if stage.source is not None}
+        with ThreadPoolExecutor(max_workers=self.num_of_derived_workers) as derived_executor:
+            self.derived_executor = derived_executor
+
+            # calculated stages whose inputs aren't part of this run can start right away for all tickers
+            for ticker_id in self.ticker_id_to_name_dict:
+                self.submit_ready_derived_stages(ticker_id)
+
+            source_threads = [threading.Thread(target=self.run_source, args=(source,), name=f'source-{source}')
+                              for source in sorted(sources)]
+            for source_thread in source_threads:
+                source_thread.start()
+            for source_thread in source_threads:
+                source_thread.join()
+
+            # derived tasks may still be submitted by the last finished tickers - wait until none are left
+            while True:
+                with self.lock:
+                    pending_futures = [future for future in self.futures if not future.done()]
+                if not pending_futures:
+                    break
+                for future in pending_futures:
+                    future.exception()
+
+        self.log_summary(time.perf_counter() - start_time)
+
+    # the stock list is the root of the DAG - filled from wikipedia's S&P 500 list when the table is empty
+    def run_stocks_stage(self) -> None:
+        db = get_db()
+        if db.query(models.StocksByID).count() > 0:
+            return
+
+        start_time = time.perf_counter()
+        snp500_tickers_lst = fetch_snp500_tickers()
+        db.bulk_save_objects([models.StocksByID(ticker_name) for ticker_name in snp500_tickers_lst])
+        db.commit()
+
+        self.stats['stocks'].num_of_rows = len(snp500_tickers_lst)
+        self.stats['stocks'].work_time = time.perf_counter() - start_time
+
+    def get_fetch_start_date(self, stage_names: list[str], ticker_id: int) -> date | None:
+        latest_dates = [self.latest_db_dates[stage_name].get(ticker_id) for stage_name in stage_names]
+        if None in latest_dates:
+            return None
+        return min(latest_dates)
+
+    # fetches the new data of a ticker from one tiingo source, from the day after its latest date in our db
+    def fetch_source_data(self, ticker_name: str, source: str, stage_names: list[str]):
+        start_date = self.get_fetch_start_date(stage_names, self.ticker_name_to_id_dict[ticker_name])
+        if source == PRICES_SOURCE:
+            if start_date is None:
+                return self.t_api.get_end_of_day_prices_by_date(ticker_name)
+            return self.t_api.get_end_of_day_prices_by_date(ticker_name, start_date_str=start_date + timedelta(days=1))
+
+        if source == DAILY_MULTIPLIERS_SOURCE:
+            if start_date is None:
+                return self.t_api.get_daily_multipliers(ticker_name)
+            return self.t_api.get_daily_multipliers(ticker_name, start_date_str=start_date + timedelta(days=1))
+
+        # statements are filtered by date per table, a quarter's statement is dated on the quarter's last day
+        if start_date is None:
+            return self.t_api.get_all_daily_fundamentals_data(ticker_name)
+        return self.t_api.get_last_update_quarterly_fundamentals(ticker_name, start_date_str=start_date)
+
+    @staticmethod
+    def create_rows(stage: Stage, ticker_id: int, source_data) -> list[dict]:
+        if stage.source == PRICES_SOURCE:
+            return [create_end_of_day_prices_row(ticker_id, item) for item in iter_records(source_data)]
+        if stage.source == DAILY_MULTIPLIERS_SOURCE:
+            return [create_daily_multipliers_row(ticker_id, item) for item in iter_records(source_data)]
+        return [create_quarterly_row(ticker_id, item, stage.table) for item in source_data]
+
+    # this function fetches all tickers from one tiingo source and writes every stage of that source.
+    # All of a ticker's rows (and ledger rows) are committed at once, before its downstream stages are started
+    def run_source(self, source: str) -> None:
+        source_stages = [stage for stage in self.stages if stage.source == source]
+        stage_names = [stage.name for stage in source_stages]
+        writers = {stage.name: BulkWriter(stage.table, commit_per_batch=False) for stage in source_stages}
+
+        # tickers an interrupted run completed aren't fetched again
+        tickers_to_fetch = []
+        for ticker_name, ticker_id in self.ticker_name_to_id_dict.items():
+            if all(ticker_id in self.completed_tickers[stage_name] for stage_name in stage_names):
+                for stage_name in stage_names:
+                    self.mark_done(stage_name, ticker_id, self.completed_tickers[stage_name][ticker_id], 0.0)
+            else:
+                tickers_to_fetch.append(ticker_name)
+
+        fetched_tickers = set()
+        results = self.fetcher.fetch_all(tickers_to_fetch, self.fetch_source_data, source, stage_names)
+        for ticker_name, source_data in results:
+            ticker_id = self.ticker_name_to_id_dict[ticker_name]
+            fetched_tickers.add(ticker_name)
+
+            num_of_rows_by_stage, work_time_by_stage = {}, {}
+            try:
+                for stage in source_stages:
+                    start_time = time.perf_counter()
+                    latest_db_date = self.latest_db_dates[stage.name].get(ticker_id)
+                    rows = [row for row in self.create_rows(stage, ticker_id, source_data)
+                            if latest_db_date is None or row['date'] > latest_db_date]
+                    writers[stage.name].add_many(rows)
+                    writers[stage.name].flush()
+                    work_time_by_stage[stage.name] = time.perf_counter() - start_time
+                    num_of_rows_by_stage[stage.name] = len(rows)
+                    self.ledger.record(stage.ledger_stage, ticker_id, len(rows), work_time_by_stage[stage.name])
+                get_db().commit()
+            except Exception:
+                get_db().rollback()
+                logging.exception(f"writing {source} of {ticker_name} failed")
+                fetched_tickers.discard(ticker_name)
+                continue
+
+            for stage in source_stages:
+                self.mark_done(stage.name, ticker_id, num_of_rows_by_stage[stage.name], work_time_by_stage[stage.name])
+
+        for stage in source_stages:
+            writers[stage.name].close()
+            self.stats[stage.name].failed_tickers = sorted(set(tickers_to_fetch) - fetched_tickers)
+
+    # runs a derived stage (graham / pfcf calculation, parquet export) for a single ticker
+    def run_derived_stage(self, stage: Stage, ticker_id: int) -> None:
+        start_time = time.perf_counter()
+        try:
+            if stage.name == 'export':
+                num_of_rows = sum(self.parquet_store.export_stock(table, ticker_id) for table in EXPORT_TABLES)
+            elif stage.name == 'features':
+                frame = self.feature_builder.build_features([ticker_id], self.feature_start_dates)
+                self.feature_builder.replace_features([ticker_id], self.feature_start_dates, frame)
+                num_of_rows = len(frame)
+            else:
+                if stage.name == 'graham':
+                    frame = self.graham_number_calc.graham_number_frame([ticker_id])
+                else:
+                    frame = self.pfcf_mult_calc.pfcf_ratio_frame([ticker_id], self.get_new_price_dates(ticker_id))
+
+                writer = BulkWriter(stage.table, commit_per_batch=False)
+                writer.add_many(frame_to_rows(frame))
+                writer.flush()
+                num_of_rows = len(frame)
+
+            self.ledger.record(stage.ledger_stage, ticker_id, num_of_rows, time.perf_counter() - start_time)
+            get_db().commit()
+        except Exception:
+            get_db().rollback()
+            logging.exception(f"{stage.name} of {self.ticker_id_to_name_dict[ticker_id]} failed")
+            with self.lock:
+                self.stats[stage.name].failed_tickers.append(self.ticker_id_to_name_dict[ticker_id])
+            return
+
+        self.mark_done(stage.name, ticker_id, num_of_rows, time.perf_counter() - start_time)
+
+    # the ticker's price dates which don't have a p/fcf ratio yet
+    def get_new_price_dates(self, ticker_id: int) -> list[date]:
+        db = get_db()
+        query = sqlalch.select([models.EndOfDayPrices.date]).filter(models.EndOfDayPrices.stock_id == ticker_id)
+        latest_pfcf_date = self.latest_db_dates['pfcf'].get(ticker_id)
+        if latest_pfcf_date is not None:
+            query = query.filter(models.EndOfDayPrices.date > latest_pfcf_date)
+        return [price_date for price_date, in db.execute(query)]
+
+    def mark_done(self, stage_name: str, ticker_id: int, num_of_rows: int, work_time: float) -> None:
+        with self.lock:
+            self.done_tickers[stage_name][ticker_id] = num_of_rows > 0
+            stats = self.stats[stage_name]
+            stats.num_of_tickers += 1
+            stats.num_of_rows += num_of_rows
+            stats.work_time += work_time
+
+        self.submit_ready_derived_stages(ticker_id)
+
+    # starts every derived stage of the ticker whose inputs are all done - stages outside of this run count as done.
+    # A derived stage is skipped when none of its inputs had new rows for the ticker
+    def submit_ready_derived_stages(self, ticker_id: int) -> None:
+        has_skipped_stage = False
+        for stage in self.stages:
+            if stage.source is not None or stage.name == 'stocks':
+                continue
+
+            with self.lock:
+                if (stage.name, ticker_id) in self.submitted:
+                    continue
+                input_stages = [name for name in stage.dependencies if name in self.stage_names]
+                if any(ticker_id not in self.done_tickers[name] for name in input_stages):
+                    continue
+                self.submitted.add((stage.name, ticker_id))
+
+                if ticker_id in self.completed_tickers[stage.name]:
+                    self.done_tickers[stage.name][ticker_id] = self.completed_tickers[stage.name][ticker_id] > 0
+                    has_skipped_stage = True
+                    continue
+
+                has_new_input = len(input_stages) < len(stage.dependencies) or \
+                    any(self.done_tickers[name][ticker_id] for name in input_stages)
+                if has_new_input or self.full:
+                    self.futures.append(self.derived_executor.submit(self.run_derived_stage, stage, ticker_id))
+                else:
+                    self.done_tickers[stage.name][ticker_id] = False
+                    has_skipped_stage = True
+
+        # stages downstream of a skipped (or already completed) stage may be ready now
+        if has_skipped_stage:
+            self.submit_ready_derived_stages(ticker_id)
+
+    def log_summary(self, total_time: float) -> None:
+        for stage in self.stages:
+            stats = self.stats[stage.name]
+            logging.info(f"{stage.name}: {stats.num_of_rows} rows for {stats.num_of_tickers} tickers "
+                         f"({stats.work_time:.2f} seconds of work)"
+                         + (f", failed: {stats.failed_tickers}" if stats.failed_tickers else ""))
+        logging.info(f"pipeline finished in {total_time:.2f} seconds, tiingo payloads received - "
+                     f"{self.t_api.describe_transfer_stats()}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='tau-pipeline',
+                                     description="Populates / updates the stock database - runs the stages "
+                                                 "(and the stages they depend on) as a DAG")
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        help=f"stages to run - {', '.join(STAGES.keys())} (default: all but export). "
+                             f"Stages left out are read from the db as they are")
+    parser.add_argument('--with-dependencies', action='store_true',
+                        help="also run the stages the given stages depend on")
+    parser.add_argument('--full', action='store_true',
+                        help="re-fetch and re-calculate everything instead of only the dates after the db's latest")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted run - skip the tickers whose stages were already completed")
+    parser.add_argument('--derived-workers', type=int, default=DEFAULT_NUM_OF_DERIVED_WORKERS,
+                        help="number of threads calculating the graham / pfcf stages")
+    args = parser.parse_args()
+
+    # validated here, since argparse rejects an empty list of positional choices
+    unknown_stages = [stage_name for stage_name in args.stages if stage_name not in STAGES]
+    if unknown_stages:
+        parser.error(f"unknown stages: {', '.join(unknown_stages)} (choose from {', '.join(STAGES.keys())})")
+    return args
+
+
+# the given stages and everything they depend on, in the DAG's order
+def add_dependencies(stage_names: list[str]) -> list[str]:
+    required = set()
+    stack = list(stage_names)
+    while stack:
+        stage_name = stack.pop()
+        if stage_name not in required:
+            required.add(stage_name)
+            stack.extend(STAGES[stage_name].dependencies)
+    return [stage_name for stage_name in STAGES if stage_name in required]
+
+
+if __name__ == '__main__':
+    # initialize logger
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    logging.root.handlers[0].setFormatter(CustomFormatter())
+
+    args = parse_args()
+    stage_names = args.stages or DEFAULT_STAGE_NAMES
+    if args.with_dependencies:
+        stage_names = add_dependencies(stage_names)
+
+    pipeline = TauPipeline(stage_names, full=args.full, resume=args.resume, num_of_derived_workers=args.derived_workers)
+    pipeline.run()
+
+    # close the connections to tiingo once the run ends
+    pipeline.t_api.close()
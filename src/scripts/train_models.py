@@ -0,0 +1,64 @@
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+import sys
+from pathlib import Path
+
+src_dir = Path(__file__).parent.parent.absolute().__str__() # get parent of parent
+sys.path.append(src_dir)
+
+import argparse
+import logging
+from datetime import date
+from utils.database import get_db
+from utils import models
+from utils.model_training import ModelTrainer, TrainingConfig
+from utils.series_cache import SeriesCache
+from utils.custom_log_formatter import CustomFormatter
+
+SUMMARY_COLUMNS = ['stock_id', 'ticker', 'num_of_train_rows', 'num_of_test_rows', 'accuracy', 'roc_auc', 'num_of_trades',
+                   'profit_perc_mean']
+
+
+def parse_args() -> argparse.Namespace:
+    defaults = TrainingConfig()
+    parser = argparse.ArgumentParser(prog='train-models',
+                                     description="Trains the random forest for many stocks from the \"model_features\" "
+                                                 "table and writes the models and their metrics to the model registry")
+    parser.add_argument('tickers', nargs='*', metavar='ticker', help="stocks to train (default: all)")
+    parser.add_argument('--pooled', action='store_true',
+                        help="train a single model on all the stocks' rows instead of a model per stock")
+    parser.add_argument('--label-threshold', type=float, default=defaults.label_threshold)
+    parser.add_argument('--model-threshold', type=float, default=defaults.model_threshold)
+    parser.add_argument('--after-date', type=date.fromisoformat, default=defaults.after_date)
+    parser.add_argument('--train-until', type=date.fromisoformat, default=defaults.train_until)
+    parser.add_argument('--test-until', type=date.fromisoformat, default=defaults.test_until)
+    parser.add_argument('--workers', type=int, default=None, help="number of processes (default: number of cores)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # initialize logger
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    logging.root.handlers[0].setFormatter(CustomFormatter())
+
+    args = parse_args()
+    db = get_db()
+    ticker_name_to_id_dict = {stock.stock_name: stock.id for stock in db.query(models.StocksByID).all()}
+    db.commit()
+    unknown_tickers = [ticker for ticker in args.tickers if ticker not in ticker_name_to_id_dict]
+    if unknown_tickers:
+        sys.exit(f"unknown tickers: {', '.join(unknown_tickers)}")
+
+    config = TrainingConfig(label_threshold=args.label_threshold, model_threshold=args.model_threshold,
+                            after_date=args.after_date, train_until=args.train_until, test_until=args.test_until)
+    # the features are read through the series cache (see "utils/series_cache.py")
+    trainer = ModelTrainer(config, num_of_workers=args.workers, series_cache=SeriesCache())
+    stock_ids = [ticker_name_to_id_dict[ticker] for ticker in args.tickers] or None
+    entries = trainer.train_pooled(stock_ids) if args.pooled else trainer.train_per_stock(stock_ids)
+
+    if len(entries) > 0:
+        ticker_id_to_name_dict = {ticker_id: name for name, ticker_id in ticker_name_to_id_dict.items()}
+        entries['ticker'] = entries['stock_id'].map(ticker_id_to_name_dict).fillna('pooled')
+        print(entries[SUMMARY_COLUMNS].sort_values('stock_id').to_string(index=False))
+    print(f"models registered in {trainer.registry.model_dir.absolute()}")
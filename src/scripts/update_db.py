@@ -8,35 +8,59 @@ src_dir = Path(__file__).parent.parent.absolute().__str__() # get parent of pare
 print(src_dir)
 sys.path.append(src_dir)
 
+from contextlib import ExitStack
 from dataclasses import dataclass
 import logging
-import numpy as np
+import time
 import pandas as pd
 import sqlalchemy as sqlalch
 from sqlalchemy import func
 from utils.database import get_db
 from utils import models
 # from utils import pfcf_ratio_calculation
-from utils.tiingo_api import TiingoApi
-from datetime import timedelta
-from datetime import datetime
+from utils.tiingo_api import TiingoApi, Fundamental, iter_records
+from utils.tiingo_concurrent_fetcher import ConcurrentTiingoFetcher
+from utils.tiingo_to_rows import QUARTERLY_TABLES_STATEMENTS, create_quarterly_row, create_end_of_day_prices_row, \
+    create_daily_multipliers_row
+from utils.bulk_writer import BulkWriter, frame_to_rows
+from utils.freshness_index import FreshnessIndex, YearAndQuarter
+from utils.model_features import ModelFeatureBuilder
+from utils.daily_signals import DailySignalGenerator
+from utils.series_cache import SeriesCache
+from utils.graham_number_calculation import CalcGrahamNumber, ANNUAL_QUARTER, QUARTERS
+from datetime import date, datetime, timedelta
 
 
+# the tables filled with data fetched from tiingo, in the order they're updated
+TIINGO_TABLES = [models.EndOfDayPrices, models.FullDailyMultipliers, *QUARTERLY_TABLES_STATEMENTS.keys()]
+
+
+# everything fetched from tiingo for one ticker in a daily update (None - nothing new)
 @dataclass
-class YearAndQuarter:
-    year: int
-    quarter: int
+class TickerUpdate:
+    last_daily_date: str | None = None
+    end_of_day_prices: pd.DataFrame | None = None
+    daily_multipliers: pd.DataFrame | None = None
+    fundamentals: list[Fundamental] | None = None
+
 
 class UpdateDB:
-    t_api = TiingoApi()
 
-    def get_table_latest_year_and_quarter(self, ticker: int, table: models) -> YearAndQuarter:
-        db = get_db()
-        latest_year_and_quarter_lst = sqlalch.select(table.year, table.quarter). \
-            filter(table.stock_id == ticker).order_by(table.year.desc(), table.quarter.desc())
-        latest_year_and_quarter_res = db.execute(latest_year_and_quarter_lst).first()
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.t_api = TiingoApi()
+        self.fetcher = ConcurrentTiingoFetcher()
 
-        return latest_year_and_quarter_res
+        # latest date / quarter of every stock in every table, loaded once per table and shared by all updaters
+        self.freshness_index = FreshnessIndex()
+        # the daily inputs of the model features, kept in memory when the same instance updates again
+        self.series_cache = SeriesCache()
+        # when the latest tiingo data was written to the db - the start of the daily signals' latency
+        self.data_arrived_at = None
+
+    def get_table_latest_year_and_quarter(self, ticker: int, table: models) -> YearAndQuarter | None:
+        return self.freshness_index.get_latest_year_and_quarter(ticker, table)
 
     def create_ticker_to_id_dictionary_from_db(self) -> dict[str, int]:
         db = get_db()
@@ -48,558 +72,313 @@ class UpdateDB:
 
         return dict1
 
-    def update_end_of_day_prices_table(self) -> None:
-        db = get_db()
-
-        # create a dict, in order to have a for loop for all tickers
-        stock_name_and_id_dict = self.create_ticker_to_id_dictionary_from_db()
-        keys = list(stock_name_and_id_dict.keys())
-        for ticker_name in keys:
-            ticker_id = stock_name_and_id_dict[ticker_name]
-
-            # get last date in our database
-            last_date_in_table = sqlalch.select([func.max(models.EndOfDayPrices.date)]). \
-                filter(models.EndOfDayPrices.stock_id == ticker_id)
-            last_date_in_table_res = db.execute(last_date_in_table).first()[0]
-
-            # compare between our last_date_in_table and tiingo_last_date + action for "not the same date" or "the same date"
-            last_tiingo_update_date = self.t_api.get_last_update_date_daily(ticker_name)
-
-            if last_tiingo_update_date:
-
-                if last_tiingo_update_date > last_date_in_table_res:
-                    # adding 1 day to our db last updated date
-                    increment_start_date = (
-                                datetime.strptime(last_date_in_table_res, "%Y-%m-%d") + timedelta(days=1)).date()
-                    end_of_day_list = self.t_api.get_end_of_day_prices_by_date(ticker_name,
-                                                                               start_date_str=increment_start_date)
-                    # for is used just in case more than 1 date needs to be updated
-                    for end_of_day_item in end_of_day_list:
-                        model = models.EndOfDayPrices(stock_id=ticker_id, date=end_of_day_item.date[:10],
-                                                      close_price=end_of_day_item.close)
-                        db.add(model)
-                    db.commit()
-                    print(f"end of day for {ticker_name} updated successfully")
-
-                else:
-                    print(f"Nothing has changed with {ticker_name}")
-
+    # tiingo dates are strings ("2022-03-31" or "2022-03-31T00:00:00.000Z"), our db dates are DATE values.
+    # A stock with no rows in our db (None) is always behind tiingo
+    @staticmethod
+    def is_tiingo_date_newer(last_tiingo_update_date: str | None, latest_db_date: date | None) -> bool:
+        if not last_tiingo_update_date:
+            return False
+        return latest_db_date is None or date.fromisoformat(last_tiingo_update_date[:10]) > latest_db_date
+
+    # this function fetches everything new of a ticker that the given tables need, with as few requests as possible:
+    # the daily meta data (shared by "end of day prices" and "daily multipliers") and the recent statements
+    # (shared by the four quarterly tables) are requested once, prices and multipliers only when tiingo has a newer date.
+    # Each of these (up to four) requests takes its own rate limiter token and is retried on its own by the TiingoApi
+    def fetch_ticker_update(self, ticker_name: str, latest_db_dates: dict[models, dict[str, date]],
+                            tables: list[models]) -> TickerUpdate:
+        ticker_update = TickerUpdate()
+
+        if models.EndOfDayPrices in tables or models.FullDailyMultipliers in tables:
+            ticker_update.last_daily_date = self.t_api.get_last_update_date_daily(ticker_name)
+
+            if models.EndOfDayPrices in tables:
+                latest_db_date = latest_db_dates[models.EndOfDayPrices][ticker_name]
+                if self.is_tiingo_date_newer(ticker_update.last_daily_date, latest_db_date):
+                    if latest_db_date is None:
+                        ticker_update.end_of_day_prices = self.t_api.get_end_of_day_prices_by_date(ticker_name)
+                    else:
+                        # adding 1 day to our db last updated date
+                        ticker_update.end_of_day_prices = self.t_api.get_end_of_day_prices_by_date(
+                            ticker_name, start_date_str=latest_db_date + timedelta(days=1))
+
+            if models.FullDailyMultipliers in tables:
+                latest_db_date = latest_db_dates[models.FullDailyMultipliers][ticker_name]
+                if self.is_tiingo_date_newer(ticker_update.last_daily_date, latest_db_date):
+                    if latest_db_date is None:
+                        ticker_update.daily_multipliers = self.t_api.get_daily_multipliers(ticker_name)
+                    else:
+                        # only the dates after our db's last one, instead of the complete history
+                        ticker_update.daily_multipliers = self.t_api.get_daily_multipliers(
+                            ticker_name, start_date_str=latest_db_date + timedelta(days=1))
+
+        quarterly_tables = [table for table in tables if table in QUARTERLY_TABLES_STATEMENTS]
+        if quarterly_tables:
+            # statements from the oldest of the tables' latest dates cover all of them
+            # (tiingo's default window when a table has nothing for this ticker yet)
+            quarterly_db_dates = [latest_db_dates[table][ticker_name] for table in quarterly_tables]
+            if None in quarterly_db_dates:
+                ticker_update.fundamentals = self.t_api.get_last_update_quarterly_fundamentals(ticker_name)
             else:
-                print(f"No new data was found for {ticker_name}")
-
-    def update_balance_sheet_table(self) -> None:
-        db = get_db()
+                ticker_update.fundamentals = self.t_api.get_last_update_quarterly_fundamentals(
+                    ticker_name, start_date_str=min(quarterly_db_dates))
+
+        return ticker_update
+
+    # this function builds the rows of a table from a ticker's fetched data, keeping only dates newer than our db
+    @staticmethod
+    def create_new_rows(ticker_id: int, ticker_update: TickerUpdate, table: models, latest_db_date: date | None) -> list[dict]:
+        if table is models.EndOfDayPrices and ticker_update.end_of_day_prices is not None:
+            rows = [create_end_of_day_prices_row(ticker_id, item) for item in iter_records(ticker_update.end_of_day_prices)]
+        elif table is models.FullDailyMultipliers and ticker_update.daily_multipliers is not None:
+            rows = [create_daily_multipliers_row(ticker_id, item) for item in iter_records(ticker_update.daily_multipliers)]
+        elif table in QUARTERLY_TABLES_STATEMENTS and ticker_update.fundamentals is not None:
+            rows = [create_quarterly_row(ticker_id, item, table) for item in ticker_update.fundamentals]
+        else:
+            return []
+
+        return [row for row in rows if latest_db_date is None or row['date'] > latest_db_date]
+
+    # this function retrieves the latest date existing in a db table per stock (None for stocks without rows)
+    def get_latest_db_dates(self, stock_name_and_id_dict: dict[str, int], table: models) -> dict[str, date]:
+        latest_dates = self.freshness_index.get_latest_dates(table)
+        return {ticker_name: latest_dates.get(ticker_id) for ticker_name, ticker_id in stock_name_and_id_dict.items()}
+
+    # this function updates the tables filled from tiingo (end of day prices, daily multipliers and the four quarterly
+    # tables) in one pass over the tickers - every ticker's data is fetched once and routed to all the given tables.
+    # Returns the tickers whose fetch failed (after the retries), they're left for the next update
+    def update_tables(self, tables: list[models] = None) -> list[str]:
+        tables = tables if tables is not None else TIINGO_TABLES
+        start_time = time.perf_counter()
 
         # create a dict, in order to have a for loop for all tickers
         stock_name_and_id_dict = self.create_ticker_to_id_dictionary_from_db()
-        keys = list(stock_name_and_id_dict.keys())
-        for ticker_name in keys:
-            ticker_id = stock_name_and_id_dict[ticker_name]
-
-            # retrieve the latest date existing in our db "balance sheet" table per stock
-            latest_db_date = sqlalch.select([func.max(models.QuarterlyBalanceSheetData.date)]). \
-                filter(models.QuarterlyBalanceSheetData.stock_id == ticker_id)
-            latest_db_date_res = db.execute(latest_db_date).first()[0]
-
-            # compare between our last_date_in_table and tiingo_last_date + action for "not the same date" or "the same date"
-            last_tiingo_update_date = self.t_api.get_last_update_quarterly_fundamentals_date(ticker_name)
-
-            if last_tiingo_update_date:
-                if last_tiingo_update_date > latest_db_date_res:
-                    fundamentals_lst = self.t_api.get_last_update_quarterly_fundamentals(ticker_name)
-                    for fundamental_item in fundamentals_lst:
-                        if fundamental_item.date == last_tiingo_update_date:
-                            # create a dictionary from array
-                            dict1 = {}
-
-                            # if there is no balance sheet then dictionary will be empty and rows with None values will be created
-                            if hasattr(fundamental_item.statementData, 'balanceSheet'):
-                                for key_value in fundamental_item.statementData.balanceSheet:
-                                    dict1[key_value.dataCode] = key_value.value
-
-                            new_obj = models.QuarterlyBalanceSheetData(
-                                year=fundamental_item.year,
-                                stock_id=ticker_id,
-                                date=fundamental_item.date,
-                                quarter=fundamental_item.quarter,
-                                debtCurrent=dict1.get("debtCurrent"),
-                                taxAssets=dict1.get("taxAssets"),
-                                investmentsCurrent=dict1.get("investmentsCurrent"),
-                                totalAssets=dict1.get("totalAssets"),
-                                acctPay=dict1.get("acctPay"),
-                                accoci=dict1.get("accoci"),
-                                totalLiabilities=dict1.get("totalLiabilities"),
-                                acctRec=dict1.get("acctRec"),
-                                intangibles=dict1.get("intangibles"),
-                                ppeq=dict1.get("ppeq"),
-                                deferredRev=dict1.get("deferredRev"),
-                                cashAndEq=dict1.get("cashAndEq"),
-                                assetsNonCurrent=dict1.get("assetsNonCurrent"),
-                                taxLiabilities=dict1.get("taxLiabilities"),
-                                investments=dict1.get("investments"),
-                                equity=dict1.get("equity"),
-                                retainedEarnings=dict1.get("retainedEarnings"),
-                                deposits=dict1.get("deposits"),
-                                assetsCurrent=dict1.get("assetsCurrent"),
-                                investmentsNonCurrent=dict1.get("investmentsNonCurrent"),
-                                debt=dict1.get("debt"),
-                                debtNonCurrent=dict1.get("debtNonCurrent"),
-                                liabilitiesNonCurrent=dict1.get("liabilitiesNonCurrent"),
-                                liabilitiesCurrent=dict1.get("liabilitiesCurrent"),
-                                sharesBasic=dict1.get("sharesBasic")
-                            )
-                            db.add(new_obj)
-
-                    db.commit()
-
-                    print(f"quarterly balance sheet for {ticker_name} updated successfully")
 
-                else:
-                    print(f"No new quarterly balance sheet data was found for {ticker_name}")
-            else:
-                print(f"No new data was found for {ticker_name}")
+        # retrieve the latest date existing in our db tables per stock, then compare it to tiingo's last date
+        # while fetching all tickers in parallel
+        latest_db_dates = {table: self.get_latest_db_dates(stock_name_and_id_dict, table) for table in tables}
+        self.t_api.reset_transfer_stats()
+
+        failed_tickers = []
+        # the writers are closed like a single "with BulkWriter(...)" block - on an error the pending rows are dropped
+        # and rolled back. The tables' freshness entries are invalidated either way, after their writer is closed
+        with ExitStack() as writers_stack:
+            writers = {}
+            for table in tables:
+                writers_stack.callback(self.freshness_index.invalidate, table)
+                writers[table] = writers_stack.enter_context(BulkWriter(table))
+
+            # per table, the number of new rows and of the tickers they belong to
+            num_of_rows = {table: 0 for table in tables}
+            num_of_updated_tickers = {table: 0 for table in tables}
+            results = self.fetcher.fetch_all(stock_name_and_id_dict.keys(), self.fetch_ticker_update, latest_db_dates,
+                                             tables, failed_tickers=failed_tickers)
+            for ticker_name, ticker_update in results:
+                ticker_id = stock_name_and_id_dict[ticker_name]
+
+                for table in tables:
+                    table_description = table.__tablename__.replace('_', ' ')
+                    rows = self.create_new_rows(ticker_id, ticker_update, table, latest_db_dates[table][ticker_name])
+                    if rows:
+                        writers[table].add_many(rows)
+                        num_of_rows[table] += len(rows)
+                        num_of_updated_tickers[table] += 1
+                        logging.debug(f"{table_description} for {ticker_name} updated successfully ({len(rows)} rows)")
+                    else:
+                        logging.debug(f"No new {table_description} was found for {ticker_name}")
+        self.data_arrived_at = datetime.now()
 
-    def update_cash_flow_table(self) -> None:
-        db = get_db()
+        for table in tables:
+            logging.info(f"{table.__tablename__}: {num_of_rows[table]} new rows of {num_of_updated_tickers[table]} tickers")
 
-        # create a dict, in order to have a for loop for all tickers
-        stock_name_and_id_dict = self.create_ticker_to_id_dictionary_from_db()
-        keys = list(stock_name_and_id_dict.keys())
-        for ticker_name in keys:
-            ticker_id = stock_name_and_id_dict[ticker_name]
-
-            # retrieve the latest date existing in our db "cash flow" table per stock
-            latest_db_date = sqlalch.select([func.max(models.QuarterlyCashFlow.date)]). \
-                filter(models.QuarterlyCashFlow.stock_id == ticker_id)
-            latest_db_date_res = db.execute(latest_db_date).first()[0]
-
-            # compare between our last_date_in_table and tiingo_last_date + action for "not the same date" or "the same date"
-            last_tiingo_update_date = self.t_api.get_last_update_quarterly_fundamentals_date(ticker_name)
-
-            if last_tiingo_update_date:
-                if last_tiingo_update_date > latest_db_date_res:
-                    fundamentals_lst = self.t_api.get_last_update_quarterly_fundamentals(ticker_name)
-                    for fundamental_item in fundamentals_lst:
-                        if fundamental_item.date == last_tiingo_update_date:
-                            # create a dictionary from array
-                            dict1 = {}
-
-                            # if there is no cash floe report then dictionary will be empty and rows with None values will be created
-                            if hasattr(fundamental_item.statementData, 'cashFlow'):
-                                for key_value in fundamental_item.statementData.cashFlow:
-                                    dict1[key_value.dataCode] = key_value.value
-
-                            new_obj = models.QuarterlyCashFlow(
-                                year=fundamental_item.year,
-                                stock_id=ticker_id,
-                                date=fundamental_item.date,
-                                quarter=fundamental_item.quarter,
-                                ncfi=dict1.get("ncfi"),
-                                capex=dict1.get("capex"),
-                                ncfx=dict1.get("ncfx"),
-                                ncff=dict1.get("ncff"),
-                                sbcomp=dict1.get("sbcomp"),
-                                ncf=dict1.get("ncf"),
-                                payDiv=dict1.get("payDiv"),
-                                businessAcqDisposals=dict1.get("businessAcqDisposals"),
-                                issrepayDebt=dict1.get("issrepayDebt"),
-                                issrepayEquity=dict1.get("issrepayEquity"),
-                                investmentsAcqDisposals=dict1.get("investmentsAcqDisposals"),
-                                freeCashFlow=dict1.get("freeCashFlow"),
-                                ncfo=dict1.get("ncfo"),
-                                depamor=dict1.get("depamor")
-                            )
-                            db.add(new_obj)
-
-                    db.commit()
-
-                    print(f"quarterly cash flow for {ticker_name} updated successfully")
+        logging.info(f"{len(tables)} tables updated for {len(stock_name_and_id_dict)} tickers with "
+                     f"{self.t_api.get_num_of_requests()} tiingo requests ({time.perf_counter() - start_time:.2f} seconds)")
+        logging.info(f"tiingo payloads received - {self.t_api.describe_transfer_stats()}")
+        if failed_tickers:
+            logging.error(f"fetching failed for {len(failed_tickers)} tickers, they weren't updated: "
+                          f"{', '.join(sorted(failed_tickers))}")
+        return sorted(failed_tickers)
 
-                else:
-                    print(f"No new quarterly cash flow data was found for {ticker_name}")
-            else:
-                print(f"No new data was found for {ticker_name}")
+    def update_end_of_day_prices_table(self) -> list[str]:
+        return self.update_tables([models.EndOfDayPrices])
 
-    def update_income_statement_table(self) -> None:
-        db = get_db()
+    def update_balance_sheet_table(self) -> list[str]:
+        return self.update_tables([models.QuarterlyBalanceSheetData])
 
-        # create a dict, in order to have a for loop for all tickers
-        stock_name_and_id_dict = self.create_ticker_to_id_dictionary_from_db()
-        keys = list(stock_name_and_id_dict.keys())
-        for ticker_name in keys:
-            ticker_id = stock_name_and_id_dict[ticker_name]
-
-            # retrieve the latest date existing in our db "income statement" table per stock
-            latest_db_date = sqlalch.select([func.max(models.QuarterlyIncomeStatement.date)]). \
-                filter(models.QuarterlyIncomeStatement.stock_id == ticker_id)
-            latest_db_date_res = db.execute(latest_db_date).first()[0]
-
-            # compare between our last_date_in_table and tiingo_last_date + action for "not the same date" or "the same date"
-            last_tiingo_update_date = self.t_api.get_last_update_quarterly_fundamentals_date(ticker_name)
-
-            if last_tiingo_update_date:
-                if last_tiingo_update_date > latest_db_date_res:
-                    fundamentals_lst = self.t_api.get_last_update_quarterly_fundamentals(ticker_name)
-                    for fundamental_item in fundamentals_lst:
-                        if fundamental_item.date == last_tiingo_update_date:
-                            # create a dictionary from array
-                            dict1 = {}
-
-                            # if there is no income statement then dictionary will be empty and rows with None values will be created
-                            if hasattr(fundamental_item.statementData, 'incomeStatement'):
-                                for key_value in fundamental_item.statementData.incomeStatement:
-                                    dict1[key_value.dataCode] = key_value.value
-
-                                new_obj = models.QuarterlyIncomeStatement(
-                                    year=fundamental_item.year,
-                                    stock_id=ticker_id,
-                                    date=fundamental_item.date,
-                                    quarter=fundamental_item.quarter,
-                                    ebit=dict1.get("ebit"),
-                                    epsDil=dict1.get("epsDil"),
-                                    rnd=dict1.get("rnd"),
-                                    shareswa=dict1.get("shareswa"),
-                                    taxExp=dict1.get("taxExp"),
-                                    opinc=dict1.get("opinc"),
-                                    costRev=dict1.get("costRev"),
-                                    grossProfit=dict1.get("grossProfit"),
-                                    ebitda=dict1.get("ebitda"),
-                                    nonControllingInterests=dict1.get("nonControllingInterests"),
-                                    netIncDiscOps=dict1.get("netIncDiscOps"),
-                                    eps=dict1.get("eps"),
-                                    intexp=dict1.get("intexp"),
-                                    shareswaDil=dict1.get("shareswaDil"),
-                                    revenue=dict1.get("revenue"),
-                                    netinc=dict1.get("netinc"),
-                                    opex=dict1.get("opex"),
-                                    consolidatedIncome=dict1.get("consolidatedIncome"),
-                                    netIncComStock=dict1.get("netIncComStock"),
-                                    ebt=dict1.get("ebt"),
-                                    prefDVDs=dict1.get("prefDVDs"),
-                                    sga=dict1.get("sga"),
-                                )
-                            db.add(new_obj)
-
-                    db.commit()
-
-                    print(f"quarterly income statement for {ticker_name} updated successfully")
+    def update_cash_flow_table(self) -> list[str]:
+        return self.update_tables([models.QuarterlyCashFlow])
 
-                else:
-                    print(f"No new income statement sheet data was found for {ticker_name}")
-            else:
-                print(f"No new data was found for {ticker_name}")
+    def update_income_statement_table(self) -> list[str]:
+        return self.update_tables([models.QuarterlyIncomeStatement])
 
-    def update_overview_table(self) -> None:
-        db = get_db()
+    def update_overview_table(self) -> list[str]:
+        return self.update_tables([models.QuarterlyOverview])
 
-        # create a dict, in order to have a for loop for all tickers
-        stock_name_and_id_dict = self.create_ticker_to_id_dictionary_from_db()
-        keys = list(stock_name_and_id_dict.keys())
-        for ticker_name in keys:
-            ticker_id = stock_name_and_id_dict[ticker_name]
-
-            # retrieve the latest date existing in our db "overview" table per stock
-            latest_db_date = sqlalch.select([func.max(models.QuarterlyOverview.date)]). \
-                filter(models.QuarterlyOverview.stock_id == ticker_id)
-            latest_db_date_res = db.execute(latest_db_date).first()[0]
-
-            # compare between our last_date_in_table and tiingo_last_date + action for "not the same date" or "the same date"
-            last_tiingo_update_date = self.t_api.get_last_update_quarterly_fundamentals_date(ticker_name)
-
-            if last_tiingo_update_date:
-                if last_tiingo_update_date > latest_db_date_res:
-                    fundamentals_lst = self.t_api.get_last_update_quarterly_fundamentals(ticker_name)
-                    for fundamental_item in fundamentals_lst:
-                        if fundamental_item.date == last_tiingo_update_date:
-                            # create a dictionary from array
-                            dict1 = {}
-
-                            # if there is no overview report then dictionary will be empty and rows with None values will be created
-                            if hasattr(fundamental_item.statementData, 'overview'):
-                                for key_value in fundamental_item.statementData.overview:
-                                    dict1[key_value.dataCode] = key_value.value
-
-                            new_obj = models.QuarterlyOverview(
-                                year=fundamental_item.year,
-                                stock_id=ticker_id,
-                                date=fundamental_item.date,
-                                quarter=fundamental_item.quarter,
-                                longTermDebtEquity=dict1.get("longTermDebtEquity"),
-                                shareFactor=dict1.get("shareFactor"),
-                                bookVal=dict1.get("bookVal"),
-                                roa=dict1.get("roa"),
-                                currentRatio=dict1.get("currentRatio"),
-                                roe=dict1.get("roe"),
-                                grossMargin=dict1.get("grossMargin"),
-                                piotroskiFScore=dict1.get("piotroskiFScore"),
-                                epsQoQ=dict1.get("epsQoQ"),
-                                revenueQoQ=dict1.get("revenueQoQ"),
-                                profitMargin=dict1.get("profitMargin"),
-                                rps=dict1.get("rps"),
-                                bvps=dict1.get("bvps")
-
-                            )
-                            db.add(new_obj)
-
-                    db.commit()
-
-                    print(f"quarterly overview for {ticker_name} updated successfully")
+    def update_full_daily_multipliers_table(self) -> list[str]:
+        return self.update_tables([models.FullDailyMultipliers])
 
-                else:
-                    print(f"No new overview data was found for {ticker_name}")
-            else:
-                print(f"No new data was found for {ticker_name}")
+    # the nightly update - all tiingo tables in one pass, then the tables calculated from them and the trading signals.
+    # Returns the tickers whose tiingo data couldn't be fetched
+    def update_all_tables(self) -> list[str]:
+        failed_tickers = self.update_tables()
+        if failed_tickers:
+            print(f"Tiingo tables updated, except for {len(failed_tickers)} tickers that failed: {', '.join(failed_tickers)}")
+        else:
+            print("All tiingo tables updated successfully")
 
-    def update_full_daily_multipliers_table(self) -> None:
+        self.update_graham_number_table()
+        print("All graham numbers updated successfully")
 
-        db = get_db()
+        self.update_pfree_cash_flow_multiplier_table()
+        print("All pfree cash flow multipliers data updated successfully")
 
-        # create a dict, in order to have a for loop for all tickers
-        stock_name_and_id_dict = self.create_ticker_to_id_dictionary_from_db()
-        keys = list(stock_name_and_id_dict.keys())
-        for ticker_name in keys:
-            ticker_id = stock_name_and_id_dict[ticker_name]
-
-            # retrieve the latest date existing in our db "full daily multiplier" table per stock
-            latest_db_date = sqlalch.select([func.max(models.FullDailyMultipliers.date)]). \
-                filter(models.FullDailyMultipliers.stock_id == ticker_id)
-            latest_db_date_res = db.execute(latest_db_date).first()[0]
-
-            # compare between our last_date_in_table and tiingo_last_date + action for "not the same date" or "the same date"
-            last_tiingo_update_date = self.t_api.get_last_update_date_daily(ticker_name)
-
-            if last_tiingo_update_date:
-
-                if last_tiingo_update_date > latest_db_date_res:
-                    daily_multipliers_lst = self.t_api.get_daily_multipliers(ticker_name)
-
-                    # for loop is used just in case more than 1 date needs to be updated
-                    for daily_multipliers_item in daily_multipliers_lst:
-                        model = models.FullDailyMultipliers(stock_id=ticker_id,
-                                                            date=daily_multipliers_item.date[:10],
-                                                            market_cap=daily_multipliers_item.marketCap,
-                                                            enterprise_val=daily_multipliers_item.enterpriseVal,
-                                                            pe_ratio=daily_multipliers_item.peRatio,
-                                                            pb_ratio=daily_multipliers_item.pbRatio,
-                                                            trailing_peg_1_y=daily_multipliers_item.trailingPEG1Y,
-                                                            )
-                        db.add(model)
-                    db.commit()
-                    print(f"daily multipliers for {ticker_name} updated successfully")
+        updated_stock_ids = self.update_model_features_table()
+        print("All model features updated successfully")
 
-                else:
-                    print(f"Nothing has changed with {ticker_name}")
-            else:
-                print(f"No new data was found for {ticker_name}")
+        self.update_daily_signals_table(updated_stock_ids)
+        print("All daily signals updated successfully")
+        return failed_tickers
+
+    # re-calculates the features (and the now known labels) of the stocks with new prices or multipliers.
+    # Returns the ids of the updated stocks
+    def update_model_features_table(self) -> list[int]:
+        return ModelFeatureBuilder(self.freshness_index, self.series_cache).update_features()
 
+    # scores the latest features of the given stocks (whose features were just updated) with the registered models
+    def update_daily_signals_table(self, stock_ids: list[int]) -> None:
+        signal_generator = DailySignalGenerator(self.freshness_index, series_cache=self.series_cache)
+        signal_generator.write_signals(stock_ids, self.data_arrived_at or datetime.now())
 
+    # graham numbers are re-calculated at once (see "utils/graham_number_calculation.py") for the quarters newer than
+    # every stock's latest graham number, starting a year earlier - a year's annual eps arrives after its quarters,
+    # so the previous year's missing values are completed once it does. Stocks without graham numbers get all quarters
     def update_graham_number_table(self) -> None:
-        print(f"this is working")
+        start_time = time.perf_counter()
+        stock_ids = list(self.create_ticker_to_id_dictionary_from_db().values())
+        latest_graham_quarters = self.freshness_index.get_latest_year_and_quarters(models.GrahamNumber)
+        first_years = {stock_id: latest_graham_quarters[stock_id].year - 1 for stock_id in stock_ids
+                       if stock_id in latest_graham_quarters}
+
+        year_quarters = None
+        if stock_ids and len(first_years) == len(stock_ids):
+            latest_statement_years = [year_and_quarter.year
+                                      for table in [models.QuarterlyBalanceSheetData, models.QuarterlyOverview,
+                                                    models.QuarterlyIncomeStatement]
+                                      for year_and_quarter in self.freshness_index.get_latest_year_and_quarters(table).values()]
+            last_year = max(latest_statement_years + list(first_years.values()))
+            year_quarters = [(year, quarter) for year in range(min(first_years.values()), last_year + 1)
+                             for quarter in QUARTERS]
+
+        graham_frame = CalcGrahamNumber().graham_number_frame(stock_ids, year_quarters)
+        graham_frame = graham_frame[graham_frame['year'] >= graham_frame['stock_id'].map(first_years).fillna(0)]
+        with BulkWriter(models.GrahamNumber) as writer:
+            writer.add_many(frame_to_rows(graham_frame))
+
+        self.freshness_index.invalidate(models.GrahamNumber)
+        logging.info(f"graham number: {len(graham_frame)} quarters of {graham_frame['stock_id'].nunique()} stocks "
+                     f"calculated ({graham_frame['graham_value'].isna().sum()} missing, "
+                     f"{time.perf_counter() - start_time:.2f} seconds)")
+
+    def update_pfree_cash_flow_multiplier_table(self) -> None:
         db = get_db()
 
         # create a dict, in order to have a for loop for all tickers
         stock_name_and_id_dict = self.create_ticker_to_id_dictionary_from_db()
         keys = list(stock_name_and_id_dict.keys())
-        for ticker_name in keys:
-            ticker_id = stock_name_and_id_dict[ticker_name]
-
-            # retrieve the latest year and quarter existing in our db "graham number" table per stock
-            latest_year_and_quarter = self.get_table_latest_year_and_quarter(ticker_id, models.GrahamNumber)
-            if latest_year_and_quarter:
-                latest_current_year = latest_year_and_quarter.year
-                latest_current_quarter = latest_year_and_quarter.quarter
-
-                # extract values from "balance sheet", "overview" and "income statement" tables to check if all updated:
-                latest_year_and_quarter_balance = self.get_table_latest_year_and_quarter(ticker_id,
-                                                                                         models.QuarterlyBalanceSheetData)
-                latest_year_and_quarter_overview = self.get_table_latest_year_and_quarter(ticker_id,
-                                                                                          models.QuarterlyOverview)
-                latest_year_and_quarter_income = self.get_table_latest_year_and_quarter(ticker_id,
-                                                                                        models.QuarterlyIncomeStatement)
-
-                latest_year_balance = latest_year_and_quarter_balance.year
-                latest_quarter_balance = latest_year_and_quarter_balance.quarter
-                latest_year_overview = latest_year_and_quarter_overview.year
-                latest_quarter_overview = latest_year_and_quarter_overview.quarter
-                latest_year_statement_income = latest_year_and_quarter_income.year
-                latest_quarter_statement_income = latest_year_and_quarter_income.quarter
-
-                # now check if latest year and quarter exist and match in all three tables:
-                if latest_year_and_quarter_balance and latest_year_and_quarter_overview and latest_year_and_quarter_income:
-                    if latest_year_balance == latest_year_overview and latest_year_balance == latest_year_statement_income:
-                        if latest_quarter_balance == latest_quarter_overview and latest_quarter_balance == latest_quarter_statement_income:
-                            if latest_current_year > latest_year_balance:  # graham number cannot be updated
-                                print(f"No new data was found for {ticker_name}, graham number can't be updated")
-                            else:
-                                if (latest_current_quarter < latest_quarter_balance) and (latest_current_year == latest_year_balance):  # year has changed, graham number for sure needs to be updated
-
-                                    # Retrieve the latest values necessary for graham number calculation:
-                                    balance_sheet_sharesbasic = sqlalch.select(
-                                        models.QuarterlyBalanceSheetData.sharesBasic). \
+        # the new ratios are upserted in batches instead of a commit per stock
+        with BulkWriter(models.PFreeCashFlowMultiplier) as writer:
+            for ticker_name in keys:
+                ticker_id = stock_name_and_id_dict[ticker_name]
+
+                # retrieve the latest date, year and quarter existing in our db "pfree cash flow" table per stock
+                latest_year_and_quarter = self.get_table_latest_year_and_quarter(ticker_id, models.PFreeCashFlowMultiplier)
+                latest_date = self.freshness_index.get_latest_date(ticker_id, models.PFreeCashFlowMultiplier)
+
+                if latest_year_and_quarter and latest_date:
+
+                    # extract values from "balance sheet", "overview" and "end of day prices" tables to check if all updated:
+                    latest_year_and_quarter_balance = self.get_table_latest_year_and_quarter(ticker_id,
+                                                                                            models.QuarterlyBalanceSheetData)
+                    latest_year_and_quarter_cash_flow = self.get_table_latest_year_and_quarter(ticker_id,
+                                                                                              models.QuarterlyCashFlow)
+                    latest_date_eod_prices = self.freshness_index.get_latest_date(ticker_id, models.EndOfDayPrices)
+
+                    # now check if latest date, year and quarter exist and match in all three tables:
+                    if latest_year_and_quarter_balance and latest_year_and_quarter_cash_flow and latest_date_eod_prices:
+                        latest_eod_year = int(latest_date_eod_prices.year)
+                        latest_eod_quarter = pd.Timestamp(latest_date_eod_prices).quarter
+                        latest_year_balance = latest_year_and_quarter_balance.year
+                        latest_quarter_balance = latest_year_and_quarter_balance.quarter
+                        latest_year_cash_flow = latest_year_and_quarter_cash_flow.year
+                        latest_quarter_cash_flow = latest_year_and_quarter_cash_flow.quarter
+
+                        if latest_year_balance == latest_year_cash_flow and latest_year_balance == latest_eod_year:
+                            if latest_quarter_balance == latest_quarter_cash_flow and latest_quarter_balance == latest_eod_quarter:
+                                if latest_date >= latest_date_eod_prices:  # pfree cash flow multiplier cannot be updated
+                                    print(f"No new data was found for {ticker_name}, pfree cash flow multiplier can't be updated")
+                                else:
+                                    # pfree cash flow multiplier can be updated
+
+                                    # Retrieve the latest values necessary for pfree cash flow multiplier calculation:
+                                    close_price = sqlalch.select([models.EndOfDayPrices.close_price]). \
+                                        filter(models.EndOfDayPrices.date == latest_date_eod_prices,
+                                               models.EndOfDayPrices.stock_id == ticker_id)
+                                    close_res = db.execute(close_price).first()
+
+                                    # the year's annual free cash flow (quarter 0), like the populated ratios
+                                    fcf_val = sqlalch.select(models.QuarterlyCashFlow.freeCashFlow). \
+                                        filter(models.QuarterlyCashFlow.stock_id == ticker_id,
+                                               models.QuarterlyCashFlow.year == latest_year_cash_flow,
+                                               models.QuarterlyCashFlow.quarter == ANNUAL_QUARTER)
+                                    fcf_res = db.execute(fcf_val).first()
+
+                                    num_of_shares = sqlalch.select(models.QuarterlyBalanceSheetData.sharesBasic). \
                                         filter(models.QuarterlyBalanceSheetData.stock_id == ticker_id,
                                                models.QuarterlyBalanceSheetData.year == latest_year_balance,
                                                models.QuarterlyBalanceSheetData.quarter == latest_quarter_balance)
-                                    sharesbasic_res = db.execute(balance_sheet_sharesbasic).first()[0]
-
-                                    overview_bookval = sqlalch.select(models.QuarterlyOverview.bookVal). \
-                                        filter(models.QuarterlyOverview.stock_id == ticker_id,
-                                               models.QuarterlyOverview.year == latest_year_overview,
-                                               models.QuarterlyOverview.quarter == latest_quarter_overview)
-                                    bookval_res = db.execute(overview_bookval).first()[0]
-
-                                    income_statement_epsdil = sqlalch.select(models.QuarterlyIncomeStatement.epsDil). \
-                                        filter(models.QuarterlyIncomeStatement.stock_id == ticker_id,
-                                               models.QuarterlyIncomeStatement.year == latest_year_statement_income,
-                                               models.QuarterlyIncomeStatement.quarter == latest_quarter_statement_income)
-                                    epsdil_res = db.execute(income_statement_epsdil).first()[0]
-
-                                    if sharesbasic_res is not None and bookval_res is not None and epsdil_res is not None:
-                                        if sharesbasic_res != 0:  # avoid division by zero
-                                            before_root = 22.5 * (bookval_res / sharesbasic_res) * epsdil_res  # avoid sqrt of negative number
-                                            if before_root >= 0:
-                                                graham_value = np.sqrt(before_root)
-
-                                                new_obj = models.GrahamNumber(
-                                                    stock_id=ticker_id,
-                                                    year=latest_year_balance,
-                                                    quarter=latest_quarter_balance,
-                                                    graham_value=graham_value
-                                                )
-                                                db.add(new_obj)
-                                                print(f"Graham Number {graham_value} was updated for stock {ticker_name}")
-                                                db.commit()
-                                else:
-                                    print(f"No new update was recorded for stock {ticker_name}")
-                        else:
-                            print(
-                                f"Not able to calculate graham number for stock {ticker_name} due to unmatching quarters")
-                    else:
-                        print(f"Not able to calculate graham number for stock {ticker_name} due to unmatching years")
-                else:
-                    print(f"Not able to calculate graham number for stock {ticker_name} due to missing values")
-            else:
-                print(f"No data was found for stock {ticker_name} in Graham number table")
-
-
-    def update_pfree_cash_flow_multiplier_table(self) -> None:
-        db = get_db()
-
-        # create a dict, in order to have a for loop for all tickers
-        stock_name_and_id_dict = self.create_ticker_to_id_dictionary_from_db()
-        keys = list(stock_name_and_id_dict.keys())
-        for ticker_name in keys:
-            ticker_id = stock_name_and_id_dict[ticker_name]
-
-            # retrieve the latest date, year and quarter existing in our db "pfree cash flow" table per stock
-            latest_year_and_quarter = self.get_table_latest_year_and_quarter(ticker_id, models.PFreeCashFlowMultiplier)
-            latest_date_query = sqlalch.select(models.PFreeCashFlowMultiplier.date). \
-                            filter(models.PFreeCashFlowMultiplier.stock_id == ticker_id).order_by(models.PFreeCashFlowMultiplier.date.desc())
-            latest_date = db.execute(latest_date_query).first()[0]
-
-            if latest_year_and_quarter and latest_date:
-
-                # extract values from "balance sheet", "overview" and "end of day prices" tables to check if all updated:
-                latest_year_and_quarter_balance = self.get_table_latest_year_and_quarter(ticker_id,
-                                                                                        models.QuarterlyBalanceSheetData)
-                latest_year_and_quarter_cash_flow = self.get_table_latest_year_and_quarter(ticker_id,
-                                                                                          models.QuarterlyCashFlow)
-                latest_date_eod_prices_query =sqlalch.select(models.EndOfDayPrices.date). \
-                            filter(models.EndOfDayPrices.stock_id == ticker_id).order_by(models.EndOfDayPrices.date.desc())
-                latest_str_date_eod_prices_res = db.execute(latest_date_eod_prices_query).first()[0]
-                latest_date_eod_prices = datetime.strptime(latest_str_date_eod_prices_res, "%Y-%m-%d").date()
-
-                latest_eod_year = int(latest_date_eod_prices.year)
-                latest_eod_quarter = pd.Timestamp(latest_date_eod_prices).quarter
-                latest_year_balance = latest_year_and_quarter_balance.year
-                latest_quarter_balance = latest_year_and_quarter_balance.quarter
-                latest_year_cash_flow = latest_year_and_quarter_cash_flow.year
-                latest_quarter_cash_flow = latest_year_and_quarter_cash_flow.quarter
-
-                # now check if latest date, year and quarter exist and match in all three tables:
-                if latest_year_and_quarter_balance and latest_year_and_quarter_cash_flow and latest_date_eod_prices:
-                    if latest_year_balance == latest_year_cash_flow and latest_year_balance == latest_eod_year:
-                        if latest_quarter_balance == latest_quarter_cash_flow and latest_quarter_balance == latest_eod_quarter:
-                            if latest_date >= latest_date_eod_prices:  # pfree cash flow multiplier cannot be updated
-                                print(f"No new data was found for {ticker_name}, pfree cash flow multiplier can't be updated")
+                                    num_of_shares_res = db.execute(num_of_shares).first()
+
+                                    if num_of_shares_res is not None and \
+                                            num_of_shares_res[0] is not None and \
+                                            fcf_res is not None and fcf_res[0] is not None and close_res is not None:
+                                        if fcf_res[0] != 0 and num_of_shares_res[0] != 0:
+                                            final_pfcf_ratio_calc = (close_res[0] / (fcf_res[0] / num_of_shares_res[0]))
+
+                                            writer.add({
+                                                'stock_id': ticker_id,
+                                                'date': latest_date_eod_prices,
+                                                'year': latest_eod_year,
+                                                'quarter': latest_eod_quarter,
+                                                'pfree_cash_flow_ratio': final_pfcf_ratio_calc})
+                                            logging.debug(f"ticker id:{ticker_id}, date {latest_date_eod_prices}, year {latest_eod_year}, quarter {latest_eod_quarter} new row added with {final_pfcf_ratio_calc} number")
+                                    else:
+                                        print(f"No new update was recorded for stock {ticker_name}")
                             else:
-                                # pfree cash flow multiplier can be updated
-
-                                # Retrieve the latest values necessary for pfree cash flow multiplier calculation:
-                                close_price = sqlalch.select([models.EndOfDayPrices.close_price]). \
-                                    filter(models.EndOfDayPrices.date == latest_str_date_eod_prices_res,
-                                           models.EndOfDayPrices.stock_id == ticker_id)
-                                close_res = db.execute(close_price).first()
-
-                                fcf_val = sqlalch.select(models.QuarterlyCashFlow.freeCashFlow). \
-                                    filter(models.QuarterlyOverview.stock_id == ticker_id,
-                                           models.QuarterlyOverview.year == latest_year_cash_flow,
-                                           models.QuarterlyOverview.quarter == latest_quarter_cash_flow)
-                                fcf_res = db.execute(fcf_val).first()
-
-                                num_of_shares = sqlalch.select(models.QuarterlyBalanceSheetData.sharesBasic). \
-                                    filter(models.QuarterlyIncomeStatement.stock_id == ticker_id,
-                                           models.QuarterlyIncomeStatement.year == latest_year_balance,
-                                           models.QuarterlyIncomeStatement.quarter == latest_quarter_balance)
-                                num_of_shares_res = db.execute(num_of_shares).first()
-
-                                if num_of_shares_res is not None and \
-                                        num_of_shares_res[0] is not None and \
-                                        fcf_res is not None and fcf_res[0] is not None and close_res is not None:
-                                    if fcf_res[0] != 0 and num_of_shares_res[0] != 0:
-                                        final_pfcf_ratio_calc = (close_res[0] / (fcf_res[0] / num_of_shares_res[0]))
-
-                                        new_obj = models.PFreeCashFlowMultiplier(
-                                            stock_id=ticker_id,
-                                            year=latest_eod_year,
-                                            quarter=latest_eod_quarter,
-                                            pfree_cash_flow_ratio=final_pfcf_ratio_calc
-                                        )
-                                        db.add(new_obj)
-                                        print(f"ticker id:{ticker_id}, date {date}, year {year}, quarter {current_quarter} new row added with {pfree_cash_flow} number")
-                                        db.commit()
-                                else:
-                                    print(f"No new update was recorded for stock {ticker_name}")
+                                print(f"Not able to calculate pfree cash flow multiplier for stock {ticker_name} due to unmatching quarters")
                         else:
-                            print(f"Not able to calculate pfree cash flow multiplier for stock {ticker_name} due to unmatching quarters")
+                            print(f"Not able to calculate pfree cash flow multiplier for stock {ticker_name} due to unmatching years")
                     else:
-                        print(f"Not able to calculate pfree cash flow multiplier for stock {ticker_name} due to unmatching years")
+                        print(f"Not able to calculate pfree cash flow multiplier for stock {ticker_name} due to missing values")
                 else:
-                    print(f"Not able to calculate pfree cash flow multiplier for stock {ticker_name} due to missing values")
-            else:
-                print(f"No data was found for stock {ticker_name} in pfree cash flow multiplier table")
+                    print(f"No data was found for stock {ticker_name} in pfree cash flow multiplier table")
 
-if __name__ == '__main__':
-
-    update_db = UpdateDB()
-    db = get_db()
+        self.freshness_index.invalidate(models.PFreeCashFlowMultiplier)
 
-    # update_db.update_end_of_day_prices_table()
-    # print("All end of day prices data updated successfully")
 
-    # update_db.update_balance_sheet_table()
-    # print("All balance sheet data updated successfully")
-
-    # update_db.update_cash_flow_table()
-    # print("All cash flow data updated successfully")
-
-    # update_db.update_income_statement_table()
-    # print("All income statement data updated successfully")
-
-    # update_db.update_overview_table()
-    # print("All overview data updated successfully")
-
-    # update_db.update_full_daily_multipliers_table()
-    # print("All daily multipliers data updated successfully")
-
-    # update_db.update_graham_number_table()
-    # print("All daily multipliers data updated successfully")
-
-    # update_db.update_graham_number_table()
-    # print("All graham numbers updated successfully")
-
-    # update_db.update_pfree_cash_flow_multiplier_table()
-    # print("All pfree cash flow multipliers data updated successfully")
+if __name__ == '__main__':
 
-    # print("All tables updated successfully! :))
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
+    update_db = UpdateDB()
 
+    # every ticker's tiingo data is fetched once and routed to all the tiingo tables, then the calculated tables
+    # (graham number, pfree cash flow multiplier, model features) and the daily signals are updated.
+    # A single table can still be updated on its own, e.g. update_db.update_end_of_day_prices_table()
+    failed_tickers = update_db.update_all_tables()
+    if failed_tickers:
+        print(f"Tables updated, {len(failed_tickers)} tickers failed and will be retried by the next update: "
+              f"{', '.join(failed_tickers)}")
+    else:
+        print("All tables updated successfully! :)")
+
+    # close the connections to tiingo once the run ends
+    update_db.t_api.close()
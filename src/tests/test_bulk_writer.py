@@ -0,0 +1,89 @@
+import os
+import sys
+from pathlib import Path
+
+src_dir = Path(__file__).parent.parent.absolute().__str__() # get parent of parent
+sys.path.append(src_dir)
+
+# the tests run against an in-memory SQLite db - set before "utils.database" creates its engine
+os.environ['DB_CONNECTION_STRING'] = 'sqlite://'
+
+import datetime
+import unittest
+import utils.database as database
+from utils import models
+from utils.bulk_writer import BulkWriter, create_upsert_statement
+
+
+# creates the tables in the in-memory db before every test and drops them after it,
+# so every test starts from an empty db
+class InMemoryDBTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        models.create_tables_for_all_models()
+
+    def tearDown(self) -> None:
+        database.get_db().remove()
+        database.Base.metadata.drop_all(bind=database.engine)
+
+
+class TestBulkWriter(InMemoryDBTestCase):
+
+    def query_prices(self) -> list[tuple]:
+        table = models.EndOfDayPrices
+        return database.get_db().query(table.stock_id, table.date, table.close_price) \
+            .order_by(table.stock_id, table.date).all()
+
+    # writing the same natural key (stock_id, date) again updates the row's values instead of adding a row
+    def test_upsert_updates_row_of_same_natural_key(self):
+        with BulkWriter(models.EndOfDayPrices) as writer:
+            writer.add({'stock_id': 1, 'date': datetime.date(2022, 1, 3), 'close_price': 10.0})
+            writer.add({'stock_id': 1, 'date': datetime.date(2022, 1, 4), 'close_price': 11.0})
+        with BulkWriter(models.EndOfDayPrices) as writer:
+            writer.add({'stock_id': 1, 'date': datetime.date(2022, 1, 3), 'close_price': 12.5})
+
+        self.assertEqual(self.query_prices(), [(1, datetime.date(2022, 1, 3), 12.5),
+                                               (1, datetime.date(2022, 1, 4), 11.0)])
+        self.assertEqual(writer.num_of_written_rows, 1)
+
+    # the same key twice in one batch leaves a single row holding the later values
+    def test_upsert_of_same_natural_key_in_one_batch(self):
+        with BulkWriter(models.EndOfDayPrices) as writer:
+            writer.add({'stock_id': 1, 'date': datetime.date(2022, 1, 3), 'close_price': 10.0})
+            writer.add({'stock_id': 1, 'date': datetime.date(2022, 1, 3), 'close_price': 12.5})
+
+        self.assertEqual(self.query_prices(), [(1, datetime.date(2022, 1, 3), 12.5)])
+
+    # an error inside the "with" block drops the pending batch and rolls back the uncommitted batches
+    def test_exception_rolls_back_uncommitted_rows(self):
+        with self.assertRaises(RuntimeError):
+            with BulkWriter(models.EndOfDayPrices, batch_size=2, commit_per_batch=False) as writer:
+                writer.add({'stock_id': 1, 'date': datetime.date(2022, 1, 3), 'close_price': 10.0})
+                writer.add({'stock_id': 1, 'date': datetime.date(2022, 1, 4), 'close_price': 11.0}) # flushed
+                writer.add({'stock_id': 1, 'date': datetime.date(2022, 1, 5), 'close_price': 12.0}) # pending
+                raise RuntimeError("failed while writing")
+
+        self.assertEqual(writer.rows, [])
+        self.assertEqual(self.query_prices(), [])
+
+        # the session is usable again after the rollback
+        with BulkWriter(models.EndOfDayPrices) as writer:
+            writer.add({'stock_id': 1, 'date': datetime.date(2022, 1, 3), 'close_price': 10.0})
+        self.assertEqual(self.query_prices(), [(1, datetime.date(2022, 1, 3), 10.0)])
+
+    # batches committed before the error are kept
+    def test_exception_keeps_committed_batches(self):
+        with self.assertRaises(RuntimeError):
+            with BulkWriter(models.EndOfDayPrices, batch_size=1) as writer:
+                writer.add({'stock_id': 1, 'date': datetime.date(2022, 1, 3), 'close_price': 10.0})
+                raise RuntimeError("failed while writing")
+
+        self.assertEqual(self.query_prices(), [(1, datetime.date(2022, 1, 3), 10.0)])
+
+    def test_upsert_statement_of_unsupported_dialect(self):
+        with self.assertRaises(ValueError):
+            create_upsert_statement(models.EndOfDayPrices, ['stock_id', 'date', 'close_price'], 'postgresql')
+
+
+if __name__ == '__main__':
+    unittest.main()
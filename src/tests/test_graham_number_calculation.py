@@ -0,0 +1,83 @@
+import os
+import sys
+from pathlib import Path
+
+src_dir = Path(__file__).parent.parent.absolute().__str__() # get parent of parent
+sys.path.append(src_dir)
+
+# the tests run against an in-memory SQLite db - set before "utils.database" creates its engine
+os.environ['DB_CONNECTION_STRING'] = 'sqlite://'
+
+import math
+import unittest
+import utils.database as database
+from utils import models
+from utils.graham_number_calculation import CalcGrahamNumber
+
+
+class TestGrahamNumberFrame(unittest.TestCase):
+
+    # stock 1's 2021 quarters: Q1 is valid, Q2 has 0 shares, Q3 has no book value and Q4 a negative book value.
+    # Its quarterly eps differs from the annual one, so the test tells which one was used.
+    # Stock 2 has a negative annual eps in 2021
+    def setUp(self) -> None:
+        models.create_tables_for_all_models()
+
+        db = database.get_db()
+        db.add_all([models.QuarterlyIncomeStatement(stock_id=1, year=2021, quarter=0, epsDil=2.0),
+                    models.QuarterlyIncomeStatement(stock_id=1, year=2021, quarter=1, epsDil=50.0),
+                    models.QuarterlyBalanceSheetData(stock_id=1, year=2021, quarter=1, sharesBasic=100.0),
+                    models.QuarterlyBalanceSheetData(stock_id=1, year=2021, quarter=2, sharesBasic=0.0),
+                    models.QuarterlyBalanceSheetData(stock_id=1, year=2021, quarter=3, sharesBasic=100.0),
+                    models.QuarterlyBalanceSheetData(stock_id=1, year=2021, quarter=4, sharesBasic=100.0),
+                    models.QuarterlyOverview(stock_id=1, year=2021, quarter=1, bookVal=1000.0),
+                    models.QuarterlyOverview(stock_id=1, year=2021, quarter=2, bookVal=1000.0),
+                    models.QuarterlyOverview(stock_id=1, year=2021, quarter=4, bookVal=-1000.0),
+                    models.QuarterlyIncomeStatement(stock_id=2, year=2021, quarter=0, epsDil=-2.0),
+                    models.QuarterlyBalanceSheetData(stock_id=2, year=2021, quarter=1, sharesBasic=100.0),
+                    models.QuarterlyOverview(stock_id=2, year=2021, quarter=1, bookVal=1000.0)])
+        db.commit()
+
+    def tearDown(self) -> None:
+        database.get_db().remove()
+        database.Base.metadata.drop_all(bind=database.engine)
+
+    def graham_values(self, **kwargs) -> dict[tuple[int, int, int], float]:
+        frame = CalcGrahamNumber().graham_number_frame(**kwargs)
+        self.assertEqual(list(frame.columns), ['stock_id', 'year', 'quarter', 'graham_value'])
+        return {(row.stock_id, row.year, row.quarter): row.graham_value for row in frame.itertuples()}
+
+    # the annual eps (quarter 0) is used for every quarter of the year, not the quarter's own eps
+    def test_uses_annual_eps(self):
+        values = self.graham_values()
+        self.assertAlmostEqual(values[(1, 2021, 1)], math.sqrt(22.5 * (1000.0 / 100.0) * 2.0))
+
+    # a quarter without shares / book value is missing, and so is a quarter with no data but the annual eps
+    def test_missing_value_gives_nan(self):
+        values = self.graham_values()
+        self.assertTrue(math.isnan(values[(1, 2021, 3)]))
+        self.assertTrue(math.isnan(values[(2, 2021, 2)]))
+
+    def test_zero_shares_gives_nan(self):
+        values = self.graham_values()
+        self.assertTrue(math.isnan(values[(1, 2021, 2)]))
+
+    # a negative book value or eps makes the value under the root negative
+    def test_negative_root_gives_nan(self):
+        values = self.graham_values()
+        self.assertTrue(math.isnan(values[(1, 2021, 4)]))
+        self.assertTrue(math.isnan(values[(2, 2021, 1)]))
+
+    # every quarter (1-4) of a year with an annual eps gets a row, the annual quarter itself doesn't
+    def test_calculated_quarters(self):
+        values = self.graham_values()
+        self.assertEqual(sorted(values), [(stock_id, 2021, quarter) for stock_id in (1, 2) for quarter in (1, 2, 3, 4)])
+
+    def test_limited_to_stocks_and_year_quarters(self):
+        values = self.graham_values(stock_ids=[1], year_quarters=[(2021, 1), (2021, 2)])
+        self.assertEqual(sorted(values), [(1, 2021, 1), (1, 2021, 2)])
+        self.assertAlmostEqual(values[(1, 2021, 1)], math.sqrt(450.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import sys
+from pathlib import Path
+
+src_dir = Path(__file__).parent.parent.absolute().__str__() # get parent of parent
+sys.path.append(src_dir)
+
+import unittest
+import numpy as np
+import pandas as pd
+from utils.nan_cleaning import clean_nan_runs, MAX_INTERPOLATED_GAP
+
+nan = np.nan
+
+
+# builds a frame of one stock per value list, the "day" column numbers the stock's rows
+def create_frame(values_by_stock: dict[int, list[float]]) -> pd.DataFrame:
+    return pd.DataFrame({'stock_id': [stock_id for stock_id, values in values_by_stock.items() for _ in values],
+                         'day': [day for values in values_by_stock.values() for day in range(len(values))],
+                         'value': [value for values in values_by_stock.values() for value in values]})
+
+
+class TestCleanNanRuns(unittest.TestCase):
+
+    def assert_cleaned(self, values: list[float], expected_days: list[int], expected_values: list[float]):
+        cleaned_frame = clean_nan_runs(create_frame({1: values}))
+        self.assertEqual(cleaned_frame['day'].tolist(), expected_days)
+        np.testing.assert_allclose(cleaned_frame['value'].to_numpy(), expected_values)
+
+    def test_gap_up_to_max_is_interpolated(self):
+        values = [0.0] + [nan] * MAX_INTERPOLATED_GAP + [6.0]
+        self.assert_cleaned(values, list(range(7)), [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+
+    def test_longer_gap_is_dropped(self):
+        values = [0.0] + [nan] * (MAX_INTERPOLATED_GAP + 1) + [7.0, 8.0]
+        self.assert_cleaned(values, [0, 7, 8], [0.0, 7.0, 8.0])
+
+    # long runs at the stock's start / end are trimmed like any other long gap
+    def test_long_leading_and_trailing_runs_are_trimmed(self):
+        values = [nan] * (MAX_INTERPOLATED_GAP + 2) + [1.0, nan, 3.0] + [nan] * (MAX_INTERPOLATED_GAP + 1)
+        self.assert_cleaned(values, [7, 8, 9], [1.0, 2.0, 3.0])
+
+    # short runs at the stock's start / end are kept, but not extrapolated - there's no value on one of their sides
+    def test_short_leading_and_trailing_runs_stay_missing(self):
+        values = [nan, nan, 2.0, nan, 4.0, nan]
+        self.assert_cleaned(values, list(range(6)), [nan, nan, 2.0, 3.0, 4.0, nan])
+
+    # gaps are measured and interpolated per stock - the end of one stock and the start of the next aren't one gap
+    def test_gaps_are_per_stock(self):
+        frame = create_frame({1: [0.0, 1.0] + [nan] * 3, 2: [nan] * 3 + [3.0, 4.0]})
+        cleaned_frame = clean_nan_runs(frame)
+        self.assertEqual(cleaned_frame['stock_id'].tolist(), [1] * 5 + [2] * 5)
+        np.testing.assert_allclose(cleaned_frame['value'].to_numpy(), [0.0, 1.0] + [nan] * 6 + [3.0, 4.0])
+
+    # a row is dropped if any of its value columns is in a long gap, the other columns are left as they are
+    def test_long_gap_in_any_column_drops_row(self):
+        frame = pd.DataFrame({'stock_id': [1] * 9,
+                              'a': [0.0] + [nan] * (MAX_INTERPOLATED_GAP + 1) + [7.0, 8.0],
+                              'b': [0.0, 1.0, nan, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0],
+                              'label': ['x'] * 9})
+        cleaned_frame = clean_nan_runs(frame)
+        self.assertEqual(cleaned_frame['b'].tolist(), [0.0, 7.0, 8.0])
+        self.assertEqual(cleaned_frame['label'].tolist(), ['x'] * 3)
+
+    # the result matches pandas' per stock interpolation of the kept rows
+    def test_same_as_pandas_interpolate(self):
+        random_generator = np.random.default_rng(0)
+        values = random_generator.normal(size=400)
+        values[random_generator.random(400) < 0.3] = nan
+        values[100:110] = nan
+        frame = pd.DataFrame({'stock_id': np.repeat([1, 2, 3, 4], 100), 'value': values})
+
+        cleaned_frame = clean_nan_runs(frame)
+        kept_frame = frame.loc[self.kept_rows(frame)].reset_index(drop=True)
+        expected_values = kept_frame.groupby('stock_id')['value']. \
+            transform(lambda column: column.interpolate(limit_area='inside', limit=MAX_INTERPOLATED_GAP))
+        np.testing.assert_allclose(cleaned_frame['value'].to_numpy(), expected_values.to_numpy())
+
+    # the rows that aren't in a run of more than MAX_INTERPOLATED_GAP missing values of their stock
+    @staticmethod
+    def kept_rows(frame: pd.DataFrame) -> pd.Index:
+        is_missing = frame['value'].isna()
+        run_ids = (is_missing != is_missing.shift()).cumsum() + frame['stock_id'].diff().ne(0).cumsum() * len(frame)
+        run_lengths = is_missing.groupby(run_ids).transform('sum')
+        return frame.index[~(is_missing & (run_lengths > MAX_INTERPOLATED_GAP))]
+
+
+if __name__ == '__main__':
+    unittest.main()
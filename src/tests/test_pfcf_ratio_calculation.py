@@ -0,0 +1,98 @@
+import os
+import sys
+from pathlib import Path
+
+src_dir = Path(__file__).parent.parent.absolute().__str__() # get parent of parent
+sys.path.append(src_dir)
+
+# the tests run against an in-memory SQLite db - set before "utils.database" creates its engine
+os.environ['DB_CONNECTION_STRING'] = 'sqlite://'
+
+import datetime
+import math
+import unittest
+import utils.database as database
+from utils import models
+from utils.pfcf_ratio_calculation import CalcPFCFMultiplier
+
+VALID_DATE = datetime.date(2021, 2, 1)
+ZERO_SHARES_DATE = datetime.date(2021, 5, 3)
+MISSING_SHARES_DATE = datetime.date(2021, 8, 2)
+MISSING_CLOSE_PRICE_DATE = datetime.date(2021, 8, 3)
+MISSING_QUARTER_DATE = datetime.date(2021, 11, 1)
+ZERO_FCF_DATE = datetime.date(2022, 2, 1)
+DATES = [VALID_DATE, ZERO_SHARES_DATE, MISSING_SHARES_DATE, MISSING_CLOSE_PRICE_DATE, MISSING_QUARTER_DATE,
+         ZERO_FCF_DATE]
+
+
+class TestPFCFRatioFrame(unittest.TestCase):
+
+    # stock 1 has the 2021 Q1-Q3 and 2022 Q1 statements, and a close price on every date but MISSING_CLOSE_PRICE_DATE.
+    # The quarterly free cash flow differs from the annual (quarter 0) one, so the test tells which one was used
+    def setUp(self) -> None:
+        models.create_tables_for_all_models()
+
+        db = database.get_db()
+        db.add_all([models.EndOfDayPrices(stock_id=1, date=date, close_price=50.0)
+                    for date in DATES if date != MISSING_CLOSE_PRICE_DATE])
+        db.add_all([models.QuarterlyCashFlow(stock_id=1, year=2021, quarter=0, freeCashFlow=1000.0),
+                    models.QuarterlyCashFlow(stock_id=1, year=2021, quarter=1, freeCashFlow=999999.0),
+                    models.QuarterlyCashFlow(stock_id=1, year=2021, quarter=2, freeCashFlow=999999.0),
+                    models.QuarterlyCashFlow(stock_id=1, year=2021, quarter=3, freeCashFlow=999999.0),
+                    models.QuarterlyCashFlow(stock_id=1, year=2022, quarter=0, freeCashFlow=0.0),
+                    models.QuarterlyCashFlow(stock_id=1, year=2022, quarter=1, freeCashFlow=999999.0),
+                    models.QuarterlyBalanceSheetData(stock_id=1, year=2021, quarter=1, sharesBasic=100.0),
+                    models.QuarterlyBalanceSheetData(stock_id=1, year=2021, quarter=2, sharesBasic=0.0),
+                    models.QuarterlyBalanceSheetData(stock_id=1, year=2021, quarter=3, sharesBasic=None),
+                    models.QuarterlyBalanceSheetData(stock_id=1, year=2022, quarter=1, sharesBasic=100.0)])
+        db.commit()
+
+    def tearDown(self) -> None:
+        database.get_db().remove()
+        database.Base.metadata.drop_all(bind=database.engine)
+
+    def pfcf_ratios(self, stock_ids: list[int]) -> dict[tuple[int, datetime.date], float]:
+        frame = CalcPFCFMultiplier().pfcf_ratio_frame(stock_ids, DATES)
+        self.assertEqual(list(frame.columns), ['stock_id', 'date', 'year', 'quarter', 'pfree_cash_flow_ratio'])
+        return {(row.stock_id, row.date): row.pfree_cash_flow_ratio for row in frame.itertuples()}
+
+    # close price / (annual free cash flow / the quarter's shares)
+    def test_uses_annual_free_cash_flow(self):
+        ratios = self.pfcf_ratios([1])
+        self.assertAlmostEqual(ratios[(1, VALID_DATE)], 50.0 / (1000.0 / 100.0))
+
+    def test_missing_value_gives_nan(self):
+        ratios = self.pfcf_ratios([1])
+        self.assertTrue(math.isnan(ratios[(1, MISSING_SHARES_DATE)]))
+        self.assertTrue(math.isnan(ratios[(1, MISSING_CLOSE_PRICE_DATE)]))
+
+    def test_zero_shares_or_free_cash_flow_gives_nan(self):
+        ratios = self.pfcf_ratios([1])
+        self.assertTrue(math.isnan(ratios[(1, ZERO_SHARES_DATE)]))
+        self.assertTrue(math.isnan(ratios[(1, ZERO_FCF_DATE)]))
+
+    # the date's quarter has to exist in both quarterly tables, even though the annual free cash flow does
+    def test_missing_quarter_gives_nan(self):
+        ratios = self.pfcf_ratios([1])
+        self.assertTrue(math.isnan(ratios[(1, MISSING_QUARTER_DATE)]))
+
+    # every stock gets a row for every date, a stock without data gets missing ratios
+    def test_row_for_every_stock_and_date(self):
+        ratios = self.pfcf_ratios([1, 2])
+        self.assertEqual(sorted(ratios), sorted((stock_id, date) for stock_id in (1, 2) for date in DATES))
+        self.assertTrue(all(math.isnan(ratios[(2, date)]) for date in DATES))
+
+    # the vectorized calculation gives the per-date calculation's results
+    def test_same_as_per_date_calculation(self):
+        ratios = self.pfcf_ratios([1])
+        for date in DATES:
+            ratio = CalcPFCFMultiplier().pfcf_ratio_calc(1, models.EndOfDayPrices, models.QuarterlyCashFlow,
+                                                         models.QuarterlyBalanceSheetData, date)
+            if ratio is None:
+                self.assertTrue(math.isnan(ratios[(1, date)]), date)
+            else:
+                self.assertAlmostEqual(ratios[(1, date)], ratio)
+
+
+if __name__ == '__main__':
+    unittest.main()
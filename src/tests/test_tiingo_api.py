@@ -0,0 +1,144 @@
+import sys
+from pathlib import Path
+
+src_dir = Path(__file__).parent.parent.absolute().__str__() # get parent of parent
+sys.path.append(src_dir)
+
+import json
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import mock
+import requests
+from utils.tiingo_api import TiingoApi
+from utils.tiingo_concurrent_fetcher import RateLimiter, TokenBucket, ConcurrentTiingoFetcher
+from utils.tiingo_response_cache import TiingoResponseCache, DAILY_META_ENDPOINT
+
+META_PATH = '/daily/AAPL'
+META_BODY = {'ticker': 'aapl', 'endDate': '2022-01-14'}
+
+
+# a local stand-in for tiingo - every path answers with its queued responses (status, headers, body) in order,
+# repeating the last one, and the requests it received are kept for the assertions
+class FakeTiingoServer(ThreadingHTTPServer):
+
+    def __init__(self) -> None:
+        super().__init__(('127.0.0.1', 0), FakeTiingoHandler)
+
+        self.responses_by_path: dict[str, list[tuple[int, dict, object]]] = {}
+        self.requests: list[tuple[str, dict]] = []
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def next_response(self, path: str) -> tuple[int, dict, object]:
+        with self.lock:
+            responses = self.responses_by_path.get(path, [(404, {}, {})])
+            return responses.pop(0) if len(responses) > 1 else responses[0]
+
+
+class FakeTiingoHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        path = self.path.split('?')[0]
+        self.server.requests.append((path, dict(self.headers)))
+        status_code, headers, body = self.server.next_response(path)
+
+        payload = json.dumps(body).encode() if status_code != 304 else b''
+        self.send_response(status_code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+# counts the tokens taken, without ever blocking
+class CountingRateLimiter(RateLimiter):
+
+    def __init__(self) -> None:
+        super().__init__([TokenBucket(1000, 1)])
+
+        self.num_of_acquires = 0
+
+    def acquire(self) -> None:
+        self.num_of_acquires += 1
+        super().acquire()
+
+
+class TiingoApiTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.server = FakeTiingoServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.rate_limiter = CountingRateLimiter()
+        self.api = TiingoApi(base_url=self.server.base_url, rate_limiter=self.rate_limiter, max_retries=2)
+
+        # backoffs are recorded instead of slept
+        sleep_patcher = mock.patch('utils.tiingo_api.time.sleep')
+        self.sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def tearDown(self) -> None:
+        self.api.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_rate_limited_request_is_retried(self) -> None:
+        self.server.responses_by_path[META_PATH] = [(429, {}, {}), (200, {}, META_BODY)]
+
+        self.assertEqual(self.api.get_last_update_date_daily('AAPL'), '2022-01-14')
+        self.assertEqual(len(self.server.requests), 2)
+        # every attempt is a request of its own, and takes a token of its own
+        self.assertEqual(self.rate_limiter.num_of_acquires, 2)
+        self.assertEqual(self.sleep.call_count, 1)
+
+    def test_retry_after_header_is_respected(self) -> None:
+        self.server.responses_by_path[META_PATH] = [(503, {'Retry-After': '7'}, {}), (200, {}, META_BODY)]
+
+        self.assertEqual(self.api.get_last_update_date_daily('AAPL'), '2022-01-14')
+        self.sleep.assert_called_once_with(7.0)
+
+    def test_retries_run_out(self) -> None:
+        self.server.responses_by_path[META_PATH] = [(500, {}, {})]
+
+        with self.assertRaises(requests.HTTPError):
+            self.api.get_last_update_date_daily('AAPL')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_client_error_is_not_retried(self) -> None:
+        with self.assertRaises(requests.HTTPError):
+            self.api.get_last_update_date_daily('AAPL')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_expired_response_is_revalidated(self) -> None:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # a ttl of 0 - every cached response has to be revalidated
+            self.api.cache = TiingoResponseCache(cache_dir, ttl_by_endpoint={DAILY_META_ENDPOINT: 0})
+            self.server.responses_by_path[META_PATH] = [(200, {'ETag': '"v1"'}, META_BODY), (304, {}, None)]
+
+            self.assertEqual(self.api.get_last_update_date_daily('AAPL'), '2022-01-14')
+            self.assertEqual(self.api.get_last_update_date_daily('AAPL'), '2022-01-14')
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1][1].get('If-None-Match'), '"v1"')
+
+    def test_failed_tickers_are_collected(self) -> None:
+        self.server.responses_by_path[META_PATH] = [(200, {}, META_BODY)]
+
+        failed_tickers = []
+        results = dict(ConcurrentTiingoFetcher(max_workers=2).fetch_all(
+            ['AAPL', 'MSFT'], self.api.get_last_update_date_daily, failed_tickers=failed_tickers))
+        self.assertEqual(results, {'AAPL': '2022-01-14'})
+        self.assertEqual(failed_tickers, ['MSFT'])
+
+
+if __name__ == '__main__':
+    unittest.main()
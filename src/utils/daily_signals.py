@@ -0,0 +1,59 @@
+import logging
+import time
+from datetime import datetime
+import pandas as pd
+from .database import engine
+from .freshness_index import FreshnessIndex
+from .model_features import ModelFeatureBuilder
+from .model_scoring import ModelScorer
+from .series_cache import SeriesCache
+from .bulk_writer import BulkWriter, frame_to_rows
+from . import models
+
+
+# This class turns the nightly update's new data into trading signals - the features of the stocks whose prices or
+# multipliers changed are updated, their latest feature row is scored with the registered models (nothing is refitted)
+# and the signals are upserted into the "daily_signals" table with the time it took from the data to the signal
+class DailySignalGenerator:
+
+    def __init__(self, freshness_index: FreshnessIndex = None, scorer: ModelScorer = None,
+                 series_cache: SeriesCache = None) -> None:
+        super().__init__()
+
+        self.freshness_index = freshness_index if freshness_index is not None else FreshnessIndex()
+        self.scorer = scorer if scorer is not None else ModelScorer()
+        # the feature builds' daily inputs, kept in memory between runs in the same process
+        self.series_cache = series_cache if series_cache is not None else SeriesCache()
+        # databases created before the signals existed get their table on first use
+        models.DailySignals.__table__.create(bind=engine, checkfirst=True)
+
+    # scores the latest features of the given stocks and writes their signals. "data_arrived_at" is when their new
+    # data was written to the db. Returns the written signals
+    def write_signals(self, stock_ids: list[int], data_arrived_at: datetime) -> pd.DataFrame:
+        signals = self.scorer.score_latest(stock_ids) if stock_ids else pd.DataFrame()
+        if len(signals) == 0:
+            logging.info("daily signals: no stock to score")
+            return signals
+
+        scored_at = datetime.now()
+        signals = signals.assign(date=signals['date'].dt.date, data_arrived_at=data_arrived_at, scored_at=scored_at,
+                                 latency_sec=(scored_at - data_arrived_at).total_seconds())
+        with BulkWriter(models.DailySignals) as writer:
+            writer.add_many(frame_to_rows(signals))
+
+        logging.info(f"daily signals: {len(signals)} stocks scored, {int(signals['signal'].sum())} buy signals "
+                     f"({signals['latency_sec'].iloc[0]:.2f} seconds from data arrival to signal)")
+        return signals
+
+    # the complete stage - updates the features of the stocks (all stocks when None) whose inputs changed since the
+    # last run, then scores them. Returns the written signals
+    def run(self, stock_ids: list[int] = None, data_arrived_at: datetime = None) -> pd.DataFrame:
+        data_arrived_at = data_arrived_at if data_arrived_at is not None else datetime.now()
+        start_time = time.perf_counter()
+        changed_stock_ids = ModelFeatureBuilder(self.freshness_index, self.series_cache).update_features(stock_ids)
+        features_time = time.perf_counter()
+        signals = self.write_signals(changed_stock_ids, data_arrived_at)
+
+        logging.info(f"daily signals stage: features {features_time - start_time:.2f} seconds, "
+                     f"scoring {time.perf_counter() - features_time:.2f} seconds")
+        return signals
@@ -1,4 +1,5 @@
 import os
+import pandas as pd
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
@@ -16,3 +17,10 @@ Base = declarative_base()
 def get_db() -> scoped_session:
     return db_session
 
+
+# runs a select of plain columns and returns the result as a DataFrame, key columns are cast to int64
+# so frames loaded from different tables (or empty ones) can be merged on them
+def load_frame(query, columns: list[str], key_columns: list[str]) -> pd.DataFrame:
+    db = get_db()
+    frame = pd.DataFrame(db.execute(query).fetchall(), columns=columns)
+    return frame.astype({column: 'int64' for column in key_columns})
@@ -0,0 +1,110 @@
+import logging
+import time
+from datetime import date
+import pandas as pd
+import sqlalchemy as sqlalch
+from sqlalchemy import Integer, Float, Date, DateTime
+from .database import get_db
+from . import models
+
+# the tables the model notebooks read
+DATASET_TABLES = [
+    models.EndOfDayPrices,
+    models.FullDailyMultipliers,
+    models.PFreeCashFlowMultiplier,
+    models.GrahamNumber,
+    models.QuarterlyOverview,
+    models.ModelFeatures,
+]
+
+# quarterly tables are filtered by year (the notebooks' "2012 < year"), daily tables by date
+QUARTERLY_DATASET_TABLES = [models.GrahamNumber, models.QuarterlyOverview]
+
+# number of stock ids sent in a single "stock_id IN (...)" query
+STOCKS_PER_QUERY = 100
+
+
+# returns the pandas dtype of a model column - integers and floats keep a numeric dtype even when a
+# stock has no rows or only null values, dates are returned as datetime64
+def get_column_dtype(column) -> str | None:
+    if isinstance(column.type, (Date, DateTime)):
+        return 'datetime64[ns]'
+    if isinstance(column.type, Float):
+        return 'float64'
+    if isinstance(column.type, Integer):
+        return 'int64' if not column.nullable or column.name in ['stock_id', 'year', 'quarter'] else 'float64'
+    return None
+
+
+# This class loads the model tables for a set of stocks and a period with the filters and the column selection
+# done by the db - "WHERE stock_id IN (...) AND date > ..." runs on the (stock_id, date) / (stock_id, year, quarter)
+# unique indexes, so loading a stock costs the same no matter how many stocks the table holds.
+# It replaces reading a whole table with "pd.read_sql" and filtering it with "df.loc[df['stock_id'] == ticker_id]"
+class DatasetLoader:
+
+    def __init__(self, stocks_per_query: int = STOCKS_PER_QUERY) -> None:
+        super().__init__()
+
+        self.stocks_per_query = stocks_per_query
+
+    # builds the select of the given columns (all the table's columns when None), in the table's column order.
+    # Dates are "after_date < date <= until_date" (the notebooks' split boundaries), quarterly tables use the years
+    # of these dates instead. Annual rows (quarter 0) of quarterly tables are left out unless "include_annual" is set
+    @staticmethod
+    def build_query(table: models, stock_ids: list[int] | None, columns: list[str] | None = None,
+                    after_date: date | str | None = None, until_date: date | str | None = None,
+                    include_annual: bool = True):
+        column_names = columns if columns is not None else [column.name for column in table.__table__.columns]
+        query = sqlalch.select([getattr(table, column_name) for column_name in column_names])
+
+        if stock_ids is not None:
+            query = query.filter(table.stock_id.in_(stock_ids))
+
+        after_date = pd.Timestamp(after_date).date() if after_date is not None else None
+        until_date = pd.Timestamp(until_date).date() if until_date is not None else None
+        if table in QUARTERLY_DATASET_TABLES:
+            if after_date is not None:
+                query = query.filter(table.year >= after_date.year)
+            if until_date is not None:
+                query = query.filter(table.year <= until_date.year)
+            if not include_annual:
+                query = query.filter(table.quarter != 0)
+            return query.order_by(table.stock_id, table.year, table.quarter)
+
+        if after_date is not None:
+            query = query.filter(table.date > after_date)
+        if until_date is not None:
+            query = query.filter(table.date <= until_date)
+        return query.order_by(table.stock_id, table.date)
+
+    # returns the rows of the given stocks (all stocks when None) as a DataFrame with typed columns
+    def load(self, table: models, stock_ids: list[int] = None, columns: list[str] = None,
+             after_date: date | str = None, until_date: date | str = None, include_annual: bool = True) -> pd.DataFrame:
+        start_time = time.perf_counter()
+        column_names = columns if columns is not None else [column.name for column in table.__table__.columns]
+
+        db = get_db()
+        rows = []
+        stock_id_batches = [None] if stock_ids is None else \
+            [stock_ids[i:i + self.stocks_per_query] for i in range(0, len(stock_ids), self.stocks_per_query)]
+        for stock_id_batch in stock_id_batches:
+            query = self.build_query(table, stock_id_batch, column_names, after_date, until_date, include_annual)
+            rows.extend(db.execute(query).fetchall())
+        db.commit()
+
+        frame = pd.DataFrame(rows, columns=column_names)
+        dtypes = {column.name: get_column_dtype(column) for column in table.__table__.columns
+                  if column.name in column_names and get_column_dtype(column) is not None}
+        frame = frame.astype({column_name: dtype for column_name, dtype in dtypes.items()
+                              if not dtype.startswith('datetime')})
+        for column_name in [column_name for column_name, dtype in dtypes.items() if dtype.startswith('datetime')]:
+            frame[column_name] = pd.to_datetime(frame[column_name])
+
+        logging.debug(f"{table.__tablename__}: {len(frame)} rows of "
+                      f"{'all' if stock_ids is None else len(stock_ids)} stocks loaded "
+                      f"({time.perf_counter() - start_time:.2f} seconds)")
+        return frame
+
+    def load_stock(self, table: models, stock_id: int, columns: list[str] = None, after_date: date | str = None,
+                   until_date: date | str = None, include_annual: bool = True) -> pd.DataFrame:
+        return self.load(table, [stock_id], columns, after_date, until_date, include_annual)
@@ -0,0 +1,75 @@
+import logging
+import time
+from dataclasses import dataclass
+from datetime import date
+import sqlalchemy as sqlalch
+from sqlalchemy import func
+from .database import get_db
+from . import models
+
+
+@dataclass
+class YearAndQuarter:
+    year: int
+    quarter: int
+
+
+# This class answers "what is the latest data we have for a stock" for every table, with a single GROUP BY query
+# per table instead of a query per stock. Results are cached for the run and shared by all the updaters,
+# a table's entry has to be invalidated after writing to it
+class FreshnessIndex:
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.latest_dates: dict[str, dict[int, date]] = {}
+        self.latest_year_and_quarters: dict[str, dict[int, YearAndQuarter]] = {}
+
+    # queries the latest date per stock id of a table with a "date" column (of the given stocks when not None),
+    # without the cached results
+    @staticmethod
+    def query_latest_dates(table: models, stock_ids: list[int] = None) -> dict[int, date]:
+        query = sqlalch.select([table.stock_id, func.max(table.date)]).group_by(table.stock_id)
+        if stock_ids is not None:
+            query = query.filter(table.stock_id.in_(stock_ids))
+        return {stock_id: latest_date for stock_id, latest_date in get_db().execute(query)}
+
+    # returns the latest date per stock id of a table with a "date" column
+    def get_latest_dates(self, table: models) -> dict[int, date]:
+        table_name = table.__tablename__
+        if table_name not in self.latest_dates:
+            start_time = time.perf_counter()
+            self.latest_dates[table_name] = self.query_latest_dates(table)
+            logging.debug(f"{table_name}: latest dates of {len(self.latest_dates[table_name])} stocks loaded "
+                          f"({time.perf_counter() - start_time:.2f} seconds)")
+
+        return self.latest_dates[table_name]
+
+    # returns the latest (year, quarter) per stock id of a table with "year" and "quarter" columns - the highest
+    # quarter of the latest year, the same row as ordering by year and quarter descending
+    def get_latest_year_and_quarters(self, table: models) -> dict[int, YearAndQuarter]:
+        table_name = table.__tablename__
+        if table_name not in self.latest_year_and_quarters:
+            db = get_db()
+            start_time = time.perf_counter()
+            # quarters are 0-4, so year * 10 + quarter orders like (year, quarter)
+            query = sqlalch.select([table.stock_id, func.max(table.year * 10 + table.quarter)]). \
+                filter(table.year.isnot(None), table.quarter.isnot(None)).group_by(table.stock_id)
+            self.latest_year_and_quarters[table_name] = {
+                stock_id: YearAndQuarter(int(year_and_quarter) // 10, int(year_and_quarter) % 10)
+                for stock_id, year_and_quarter in db.execute(query)}
+            logging.debug(f"{table_name}: latest quarters of {len(self.latest_year_and_quarters[table_name])} stocks "
+                          f"loaded ({time.perf_counter() - start_time:.2f} seconds)")
+
+        return self.latest_year_and_quarters[table_name]
+
+    def get_latest_date(self, stock_id: int, table: models) -> date | None:
+        return self.get_latest_dates(table).get(stock_id)
+
+    def get_latest_year_and_quarter(self, stock_id: int, table: models) -> YearAndQuarter | None:
+        return self.get_latest_year_and_quarters(table).get(stock_id)
+
+    # drops the cached entries of a table, so the next lookup sees the rows written since
+    def invalidate(self, table: models) -> None:
+        self.latest_dates.pop(table.__tablename__, None)
+        self.latest_year_and_quarters.pop(table.__tablename__, None)
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy as sqlalch
+from .database import load_frame
+from . import models
+
+GRAHAM_CONSTANT = 22.5
+QUARTERS = [1, 2, 3, 4]
+ANNUAL_QUARTER = 0
+
+
+class CalcGrahamNumber:
+
+    def __init__(self) -> None:
+        super().__init__()
+
+    # loads (stock_id, year, quarter, value) of one quarterly table column, for the given stocks and years only
+    # (all of them when None). When a key was written more than once the last written row wins
+    @staticmethod
+    def load_quarterly_column(table: models, column_name: str, stock_ids: list[int] | None,
+                              years: list[int] | None) -> pd.DataFrame:
+        query = sqlalch.select([table.stock_id, table.year, table.quarter, getattr(table, column_name)]).order_by(table.id)
+        if stock_ids is not None:
+            query = query.filter(table.stock_id.in_(stock_ids))
+        if years is not None:
+            query = query.filter(table.year.in_(years))
+
+        frame = load_frame(query, ['stock_id', 'year', 'quarter', column_name], ['stock_id', 'year', 'quarter'])
+        return frame.drop_duplicates(['stock_id', 'year', 'quarter'], keep='last')
+
+    # this function calculates the graham number - sqrt(22.5 * book value per share * eps) - of every quarter (1-4)
+    # that has data in the balance sheet, overview or income statement tables, all at once.
+    # Book value per share is the quarter's bookVal / sharesBasic, eps is the year's annual (quarter 0) epsDil.
+    # The graham value is missing (NaN) when a value is missing, sharesBasic is 0 or the root is of a negative number.
+    # "stock_ids" and "year_quarters" limit the calculation to the given stocks / (year, quarter) pairs,
+    # for incremental updates. Returns a frame with the graham number table's columns
+    def graham_number_frame(self, stock_ids: list[int] | None = None,
+                            year_quarters: list[tuple[int, int]] | None = None) -> pd.DataFrame:
+        years = sorted({year for year, _ in year_quarters}) if year_quarters is not None else None
+
+        shares = self.load_quarterly_column(models.QuarterlyBalanceSheetData, 'sharesBasic', stock_ids, years)
+        book_values = self.load_quarterly_column(models.QuarterlyOverview, 'bookVal', stock_ids, years)
+        eps = self.load_quarterly_column(models.QuarterlyIncomeStatement, 'epsDil', stock_ids, years)
+        annual_eps = eps[eps['quarter'] == ANNUAL_QUARTER][['stock_id', 'year', 'epsDil']]
+
+        # a quarter is calculated if any of the three tables has data for it - the annual eps counts for all quarters
+        annual_eps_quarters = annual_eps[['stock_id', 'year']].merge(pd.DataFrame({'quarter': QUARTERS}), how='cross')
+        frame = pd.concat([shares[['stock_id', 'year', 'quarter']], book_values[['stock_id', 'year', 'quarter']],
+                           annual_eps_quarters]).drop_duplicates()
+        frame = frame[frame['quarter'].isin(QUARTERS)]
+        if year_quarters is not None:
+            frame = frame.merge(pd.DataFrame(year_quarters, columns=['year', 'quarter']).astype('int64'),
+                                on=['year', 'quarter'])
+
+        frame = frame.merge(shares, on=['stock_id', 'year', 'quarter'], how='left'). \
+            merge(book_values, on=['stock_id', 'year', 'quarter'], how='left'). \
+            merge(annual_eps, on=['stock_id', 'year'], how='left'). \
+            sort_values(['stock_id', 'year', 'quarter'], ignore_index=True)
+
+        shares_basic = frame['sharesBasic'].to_numpy(dtype=np.float64)
+        book_val = frame['bookVal'].to_numpy(dtype=np.float64)
+        eps_dil = frame['epsDil'].to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            before_root = GRAHAM_CONSTANT * (book_val / shares_basic) * eps_dil
+            # NaN values (a missing value) fail the ">= 0" check as well
+            is_valid = (shares_basic != 0) & (before_root >= 0)
+            graham_value = np.where(is_valid, np.sqrt(before_root), np.nan)
+
+        return pd.DataFrame({'stock_id': frame['stock_id'], 'year': frame['year'], 'quarter': frame['quarter'],
+                             'graham_value': graham_value})
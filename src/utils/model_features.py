@@ -0,0 +1,168 @@
+import logging
+import time
+from datetime import date, timedelta
+import pandas as pd
+import sqlalchemy as sqlalch
+from sqlalchemy import func
+from .database import get_db
+from .dataset_loader import DatasetLoader
+from .freshness_index import FreshnessIndex
+from .bulk_writer import BulkWriter, frame_to_rows
+from .nan_cleaning import clean_nan_runs
+from .series_cache import SeriesCache
+from . import models
+
+# the label is the market cap this many trading days (rows) later - about 3 months
+LABEL_DAY_GAP = 60
+# p/fcf gaps left by the join are interpolated up to this many days in a row
+PFCF_INTERPOLATION_LIMIT = 5
+# extra days loaded before an incremental update's first date, so the missing values handling and the p/fcf
+# interpolation see the values before it
+FEATURE_LOOKBACK_DAYS = 30
+# labelled rows up to this many days before the first unlabelled date are re-calculated as well - their label may be
+# the market cap of one of the latest (up to 5) rows, which are dropped or interpolated once the gap they're in is closed
+RELABELLED_DAYS = 14
+FEATURE_STOCKS_PER_BATCH = 50
+
+DAILY_MULTIPLIERS_COLUMNS = ['market_cap', 'enterprise_val', 'pe_ratio', 'pb_ratio', 'trailing_peg_1_y']
+
+
+# converts features into rows for a "BulkWriter" - the date columns are written as plain dates
+def features_to_rows(features: pd.DataFrame) -> list[dict]:
+    features = features.assign(date=features['date'].dt.date, date_plus_3m=features['date_plus_3m'].dt.date)
+    return frame_to_rows(features)
+
+
+# This class maintains the "model_features" table - the joined and labelled frame the random forest notebooks used
+# to build with four chained merges for every run. The joins and the 60 day shift are done for a batch of stocks at
+# once, grouped by stock. Updates are incremental: a stock is re-calculated from its first unlabelled date, which
+# covers its new dates as well as the latest 60 days whose label is now known
+class ModelFeatureBuilder:
+
+    # with a "series_cache", the daily inputs (prices, multipliers, p/fcf) of repeated builds in the process are
+    # read from memory instead of the db, and the cached features of the updated stocks are invalidated
+    def __init__(self, freshness_index: FreshnessIndex = None, series_cache: SeriesCache = None) -> None:
+        super().__init__()
+
+        self.dataset_loader = DatasetLoader()
+        self.freshness_index = freshness_index if freshness_index is not None else FreshnessIndex()
+        self.series_cache = series_cache
+
+    # returns the features of the given stocks, from each stock's start date (all dates when it has none)
+    def build_features(self, stock_ids: list[int], start_dates: dict[int, date] = None) -> pd.DataFrame:
+        start_dates = start_dates or {}
+        known_start_dates = [start_dates[stock_id] for stock_id in stock_ids if start_dates.get(stock_id) is not None]
+        after_date = min(known_start_dates) - timedelta(days=FEATURE_LOOKBACK_DAYS) \
+            if len(known_start_dates) == len(stock_ids) else None
+
+        loader = self.dataset_loader
+        daily_loader = self.series_cache if self.series_cache is not None else self.dataset_loader
+        end_of_day_prices = daily_loader.load(models.EndOfDayPrices, stock_ids, ['stock_id', 'date', 'close_price'],
+                                              after_date=after_date)
+        daily_multipliers = daily_loader.load(models.FullDailyMultipliers, stock_ids,
+                                              ['stock_id', 'date'] + DAILY_MULTIPLIERS_COLUMNS, after_date=after_date)
+        pfree_cash_flow = daily_loader.load(models.PFreeCashFlowMultiplier, stock_ids,
+                                            ['stock_id', 'date', 'pfree_cash_flow_ratio'], after_date=after_date)
+        graham_number = loader.load(models.GrahamNumber, stock_ids, ['stock_id', 'year', 'quarter', 'graham_value'])
+        overview_data = loader.load(models.QuarterlyOverview, stock_ids, ['stock_id', 'year', 'quarter', 'currentRatio'],
+                                    include_annual=False)
+
+        # like the notebooks - rows in more than 5 missing values in a row are dropped, shorter gaps are interpolated
+        end_of_day_prices = clean_nan_runs(end_of_day_prices, ['close_price'])
+        daily_multipliers = clean_nan_runs(daily_multipliers, DAILY_MULTIPLIERS_COLUMNS)
+        pfree_cash_flow = clean_nan_runs(pfree_cash_flow, ['pfree_cash_flow_ratio'])
+
+        # prices and multipliers of the same days, ordered by stock and date
+        features = pd.merge(end_of_day_prices, daily_multipliers, on=['stock_id', 'date'], how='inner')
+
+        features = pd.merge(features, pfree_cash_flow, on=['stock_id', 'date'], how='left')
+        features['pfree_cash_flow_ratio'] = features.groupby('stock_id')['pfree_cash_flow_ratio'].transform(
+            lambda ratios: ratios.interpolate(axis=0, limit_area='inside', limit=PFCF_INTERPOLATION_LIMIT))
+
+        features['year'] = features['date'].dt.year
+        features['quarter'] = features['date'].dt.quarter
+        features = pd.merge(features, graham_number, on=['stock_id', 'year', 'quarter'], how='left')
+        features = pd.merge(features, overview_data, on=['stock_id', 'year', 'quarter'], how='left')
+
+        # the label - the change in market cap 60 trading days later, in percents
+        grouped_features = features.groupby('stock_id')
+        features['date_plus_3m'] = grouped_features['date'].shift(-LABEL_DAY_GAP)
+        features['market_cap_plus_3m'] = grouped_features['market_cap'].shift(-LABEL_DAY_GAP)
+        features['diff_in_mc'] = features['market_cap_plus_3m'] - features['market_cap']
+        features['diff_in_mc_perc'] = features['diff_in_mc'] / features['market_cap'] * 100
+
+        first_dates = pd.to_datetime(features['stock_id'].map(start_dates)).fillna(pd.Timestamp.min)
+        features = features[features['date'] >= first_dates]
+
+        return features.reset_index(drop=True)
+
+    # replaces the stocks' stored features from their start dates (all their features when they have none) with the
+    # given features, without committing. Stored rows that were dropped from the new features are deleted
+    @staticmethod
+    def replace_features(stock_ids: list[int], start_dates: dict[int, date], features: pd.DataFrame) -> None:
+        db = get_db()
+        table = models.ModelFeatures
+        for stock_id in stock_ids:
+            query = db.query(table).filter(table.stock_id == stock_id)
+            if start_dates.get(stock_id) is not None:
+                query = query.filter(table.date >= start_dates[stock_id])
+            query.delete(synchronize_session=False)
+
+        writer = BulkWriter(table, commit_per_batch=False)
+        writer.add_many(features_to_rows(features))
+        writer.flush()
+
+    # returns the date each stock's features have to be re-calculated from - shortly before its first unlabelled date,
+    # or the day after its latest date. Stocks without features aren't in the result
+    def get_update_start_dates(self) -> dict[int, date]:
+        db = get_db()
+        table = models.ModelFeatures
+        query = sqlalch.select([table.stock_id, func.min(table.date)]). \
+            filter(table.date_plus_3m.is_(None)).group_by(table.stock_id)
+        first_unlabelled_dates = {stock_id: first_date - timedelta(days=RELABELLED_DAYS)
+                                  for stock_id, first_date in db.execute(query)}
+        db.commit()
+
+        latest_dates = self.freshness_index.get_latest_dates(table)
+        return {stock_id: first_unlabelled_dates.get(stock_id, latest_date + timedelta(days=1))
+                for stock_id, latest_date in latest_dates.items()}
+
+    # re-calculates and upserts the features of stocks with new prices or multipliers (all given stocks when "full"
+    # is set). Returns the ids of the updated stocks
+    def update_features(self, stock_ids: list[int] = None, full: bool = False) -> list[int]:
+        start_time = time.perf_counter()
+        if stock_ids is None:
+            db = get_db()
+            stock_ids = [stock_id for stock_id, in db.execute(sqlalch.select([models.StocksByID.id]))]
+            db.commit()
+
+        start_dates = {} if full else self.get_update_start_dates()
+        latest_feature_dates = {} if full else self.freshness_index.get_latest_dates(models.ModelFeatures)
+        latest_price_dates = self.freshness_index.get_latest_dates(models.EndOfDayPrices)
+        latest_multipliers_dates = self.freshness_index.get_latest_dates(models.FullDailyMultipliers)
+
+        stock_ids_to_update = []
+        for stock_id in stock_ids:
+            latest_input_date = min(latest_price_dates.get(stock_id, date.min),
+                                    latest_multipliers_dates.get(stock_id, date.min))
+            if latest_input_date == date.min:
+                continue
+            if stock_id not in latest_feature_dates or latest_input_date > latest_feature_dates[stock_id]:
+                stock_ids_to_update.append(stock_id)
+
+        num_of_rows = 0
+        for i in range(0, len(stock_ids_to_update), FEATURE_STOCKS_PER_BATCH):
+            stock_id_batch = stock_ids_to_update[i:i + FEATURE_STOCKS_PER_BATCH]
+            features = self.build_features(stock_id_batch, start_dates)
+            self.replace_features(stock_id_batch, start_dates, features)
+            get_db().commit()
+            num_of_rows += len(features)
+            # re-calculated rows keep their dates, the cached series of the stocks can't tell they changed
+            if self.series_cache is not None:
+                self.series_cache.invalidate(models.ModelFeatures, stock_id_batch)
+
+        self.freshness_index.invalidate(models.ModelFeatures)
+        logging.info(f"model features: {num_of_rows} rows of {len(stock_ids_to_update)} stocks updated "
+                     f"({len(stock_ids) - len(stock_ids_to_update)} up to date, "
+                     f"{time.perf_counter() - start_time:.2f} seconds)")
+        return stock_ids_to_update
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+import joblib
+import numpy as np
+import pandas as pd
+import sqlalchemy as sqlalch
+from sqlalchemy import func
+from sklearn.ensemble import RandomForestClassifier
+from .database import get_db, engine
+from .bulk_writer import create_upsert_statement
+from . import models
+
+# the fitted models directory can be changed with the "TAU_MODEL_DIR" environment variable
+DEFAULT_MODEL_DIR = os.getenv('TAU_MODEL_DIR', str(Path.home() / '.tau_trading' / 'models'))
+# the registry's stock id of a model trained on many stocks at once
+POOLED_STOCK_ID = 0
+
+
+# a fingerprint of the training rows - the same rows (values and order) always get the same hash
+def get_feature_hash(frame: pd.DataFrame) -> str:
+    row_hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    return hashlib.sha256(row_hashes.tobytes() + ','.join(frame.columns).encode()).hexdigest()[:32]
+
+
+def get_model_key(stock_id: int, feature_hash: str, params: dict, label_threshold: float) -> str:
+    key = f"{stock_id}|{feature_hash}|{json.dumps(params, sort_keys=True)}|{float(label_threshold)}"
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+# This class keeps the fitted random forests - a joblib file per model ("<model dir>/<stock id>/<model key>.joblib")
+# and a row with its training details and test metrics in the "trained_models" table
+class ModelRegistry:
+
+    def __init__(self, model_dir: str = DEFAULT_MODEL_DIR) -> None:
+        super().__init__()
+
+        self.model_dir = Path(model_dir)
+        # models loaded by this registry, by path - a model file is never rewritten with different content
+        # (its name is the model key), so a loaded model stays valid
+        self.loaded_models = {}
+        self.model_dir.mkdir(parents=True, exist_ok=True)
+        # databases created before the registry existed get its table on first use
+        models.TrainedModel.__table__.create(bind=engine, checkfirst=True)
+
+    def get_model_path(self, stock_id: int, model_key: str) -> Path:
+        return self.model_dir / str(stock_id) / f'{model_key}.joblib'
+
+    # saves the model and upserts its registry row ("entry" holds the "trained_models" columns, without the path)
+    def register(self, model, entry: dict) -> None:
+        model_path = self.get_model_path(entry['stock_id'], entry['model_key'])
+        model_path.parent.mkdir(parents=True, exist_ok=True)
+        # written to a temporary file first, so a reader never loads a half written model
+        tmp_model_path = model_path.with_suffix('.tmp')
+        joblib.dump(model, tmp_model_path)
+        os.replace(tmp_model_path, model_path)
+
+        row = dict(entry, model_path=str(model_path), trained_at=datetime.now())
+        db = get_db()
+        db.execute(create_upsert_statement(models.TrainedModel, list(row.keys()), db.get_bind().dialect.name), [row])
+        db.commit()
+
+    # the latest registered model of every stock (of the given stocks when not None), as a DataFrame of registry rows
+    @staticmethod
+    def get_latest_entries(stock_ids: list[int] = None) -> pd.DataFrame:
+        db = get_db()
+        table = models.TrainedModel
+        latest_query = sqlalch.select([table.stock_id, func.max(table.trained_at).label('trained_at')]). \
+            group_by(table.stock_id)
+        if stock_ids is not None:
+            latest_query = latest_query.filter(table.stock_id.in_(stock_ids))
+        latest_query = latest_query.subquery()
+
+        query = sqlalch.select([table.__table__]).join(latest_query, (table.stock_id == latest_query.c.stock_id) &
+                                             (table.trained_at == latest_query.c.trained_at))
+        result = db.execute(query)
+        entries = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+        db.commit()
+        return entries
+
+    # the registry rows of the given model keys that were already fitted, by model key
+    @staticmethod
+    def get_entries(model_keys: list[str]) -> dict[str, dict]:
+        if not model_keys:
+            return {}
+        db = get_db()
+        table = models.TrainedModel.__table__
+        result = db.execute(sqlalch.select([table]).where(table.c.model_key.in_(model_keys)))
+        entries = {row['model_key']: dict(row) for row in result.mappings()}
+        db.commit()
+        # a row whose model file was deleted isn't a cached fit
+        return {model_key: entry for model_key, entry in entries.items() if Path(entry['model_path']).exists()}
+
+    # model files are written uncompressed, so they're loaded through joblib's memory-mapping instead of being
+    # decompressed and read into a buffer first. A loaded model is kept by path, scoring many rows reads its file once
+    def load_model(self, model_path: str):
+        model_path = str(model_path)
+        if model_path not in self.loaded_models:
+            self.loaded_models[model_path] = joblib.load(model_path, mmap_mode='r')
+        return self.loaded_models[model_path]
+
+    # the fitted model of the given training data and params - loaded from the registry when the same stock, data,
+    # params and label threshold were fitted before, otherwise fitted and registered
+    def get_or_fit(self, stock_id: int, params: dict, x_train: pd.DataFrame, y_train: np.ndarray,
+                   label_threshold: float, model_threshold: float = None):
+        feature_hash = get_feature_hash(x_train.assign(label=y_train))
+        model_key = get_model_key(stock_id, feature_hash, params, label_threshold)
+        entry = self.get_entries([model_key]).get(model_key)
+        if entry is not None:
+            return self.load_model(entry['model_path'])
+
+        start_time = time.perf_counter()
+        model = RandomForestClassifier(**params)
+        model.fit(x_train, y_train)
+        self.register(model, {'model_key': model_key, 'stock_id': stock_id, 'feature_hash': feature_hash,
+                              'params': json.dumps(params, sort_keys=True),
+                              'feature_columns': json.dumps(list(x_train.columns)),
+                              'label_threshold': label_threshold, 'model_threshold': model_threshold,
+                              'num_of_train_rows': len(x_train),
+                              'fit_duration_sec': time.perf_counter() - start_time})
+        return model
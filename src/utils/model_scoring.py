@@ -0,0 +1,89 @@
+import json
+import logging
+import time
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+import sqlalchemy as sqlalch
+from sqlalchemy import func
+from .database import get_db
+from .dataset_loader import DatasetLoader
+from .model_registry import ModelRegistry, POOLED_STOCK_ID
+from . import models
+
+# the latest feature row of a stock may miss a value (e.g. a p/fcf not calculated yet), its latest complete row
+# within this many days is scored instead
+LATEST_FEATURES_DAYS = 30
+SIGNAL_COLUMNS = ['stock_id', 'date', 'probability', 'label_threshold', 'model_threshold', 'signal', 'model_key']
+
+
+# This class scores feature rows with the registered models, without refitting - every stock's rows with its latest
+# model (the latest pooled model when the stock has none of its own). The rows of all the stocks sharing a model are
+# scored by a single "predict_proba" call
+class ModelScorer:
+
+    def __init__(self, registry: ModelRegistry = None) -> None:
+        super().__init__()
+
+        self.registry = registry if registry is not None else ModelRegistry()
+        self.dataset_loader = DatasetLoader()
+
+    # the recent rows of the "model_features" table of every stock (of the given stocks when not None) - the rows of
+    # the last LATEST_FEATURES_DAYS before the table's latest date
+    def load_latest_features(self, stock_ids: list[int] = None) -> pd.DataFrame:
+        db = get_db()
+        table = models.ModelFeatures
+        latest_date = db.execute(sqlalch.select([func.max(table.date)])).scalar()
+        db.commit()
+        if latest_date is None:
+            return pd.DataFrame(columns=[column.name for column in table.__table__.columns])
+        return self.dataset_loader.load(table, stock_ids, after_date=latest_date - timedelta(days=LATEST_FEATURES_DAYS))
+
+    # the model entry (registry row) that scores every stock - its own latest model, else the latest pooled model
+    def get_stock_entries(self, stock_ids: list[int]) -> dict[int, dict]:
+        latest_entries = self.registry.get_latest_entries(list(stock_ids) + [POOLED_STOCK_ID])
+        entries = {row['stock_id']: row for row in latest_entries.to_dict('records')}
+        pooled_entry = entries.get(POOLED_STOCK_ID)
+        return {stock_id: entries.get(stock_id, pooled_entry) for stock_id in stock_ids
+                if entries.get(stock_id, pooled_entry) is not None}
+
+    # scores the given feature rows. Rows of stocks without a model, or missing a feature the model uses, aren't scored
+    def score(self, features: pd.DataFrame) -> pd.DataFrame:
+        stock_entries = self.get_stock_entries(features['stock_id'].unique().tolist())
+        entries = {entry['model_key']: entry for entry in stock_entries.values()}
+        model_keys = features['stock_id'].map({stock_id: entry['model_key'] for stock_id, entry in stock_entries.items()})
+
+        signals = []
+        for model_key, model_features in features.groupby(model_keys):
+            entry = entries[model_key]
+            feature_columns = json.loads(entry['feature_columns'])
+            model_features = model_features.dropna(subset=feature_columns)
+            if len(model_features) == 0:
+                continue
+
+            model = self.registry.load_model(entry['model_path'])
+            probabilities = model.predict_proba(model_features[feature_columns].to_numpy())
+            positive_class = np.flatnonzero(model.classes_ == 1)
+            probability = probabilities[:, positive_class[0]] if len(positive_class) > 0 else \
+                np.zeros(len(model_features))
+            signals.append(pd.DataFrame({'stock_id': model_features['stock_id'].to_numpy(),
+                                         'date': model_features['date'].to_numpy(),
+                                         'probability': probability,
+                                         'label_threshold': entry['label_threshold'],
+                                         'model_threshold': entry['model_threshold'],
+                                         'signal': (probability > entry['model_threshold']).astype(int),
+                                         'model_key': model_key}))
+
+        if not signals:
+            return pd.DataFrame(columns=SIGNAL_COLUMNS)
+        return pd.concat(signals, ignore_index=True).sort_values('stock_id', ignore_index=True)
+
+    # scores the latest complete feature row of every stock (of the given stocks when not None)
+    def score_latest(self, stock_ids: list[int] = None) -> pd.DataFrame:
+        start_time = time.perf_counter()
+        features = self.load_latest_features(stock_ids)
+        signals = self.score(features) if len(features) > 0 else pd.DataFrame(columns=SIGNAL_COLUMNS)
+        signals = signals.sort_values(['stock_id', 'date']).groupby('stock_id').tail(1).reset_index(drop=True)
+        logging.info(f"{len(signals)} of {features['stock_id'].nunique()} stocks scored "
+                     f"({time.perf_counter() - start_time:.2f} seconds)")
+        return signals
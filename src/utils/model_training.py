@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, roc_auc_score
+from .dataset_loader import DatasetLoader
+from .model_registry import ModelRegistry, get_feature_hash, get_model_key, POOLED_STOCK_ID
+from .rf_grid_search import FEATURE_COLUMNS, PROFIT_COLUMN, get_profit_perc_mean
+from .series_cache import SeriesCache
+from . import models
+
+
+@dataclass
+class TrainingConfig:
+    rf_params: dict = field(default_factory=lambda: {'n_estimators': 151, 'criterion': "gini", 'max_depth': 5,
+                                                     'max_features': 7, 'random_state': 711})
+    label_threshold: float = 5
+    model_threshold: float = 0.7
+    feature_columns: list[str] = field(default_factory=lambda: list(FEATURE_COLUMNS))
+    # the notebooks' split - "after_date < date <= train_until" is trained on, the following dates until
+    # "test_until" are tested
+    after_date: date = date(2013, 1, 1)
+    train_until: date = date(2018, 8, 29)
+    test_until: date = date(2020, 2, 1)
+
+
+# fits a forest on a stock's (or the pooled stocks') training rows and returns it with its metrics on the test rows -
+# runs in a worker process
+def train_model(train: pd.DataFrame, test: pd.DataFrame, config: TrainingConfig, n_jobs: int) -> tuple:
+    start_time = time.perf_counter()
+    y_train = (train[PROFIT_COLUMN] > config.label_threshold).astype(int).to_numpy()
+    rand_frst_clf = RandomForestClassifier(**config.rf_params, n_jobs=n_jobs)
+    rand_frst_clf.fit(train[config.feature_columns].to_numpy(), y_train)
+    fit_duration = time.perf_counter() - start_time
+
+    metrics = {'num_of_train_rows': len(train), 'num_of_test_rows': len(test), 'accuracy': None, 'roc_auc': None,
+               'num_of_trades': 0, 'profit_perc_mean': None, 'fit_duration_sec': fit_duration}
+    if len(test) > 0:
+        y_test = (test[PROFIT_COLUMN] > config.label_threshold).astype(int).to_numpy()
+        probabilities = rand_frst_clf.predict_proba(test[config.feature_columns].to_numpy())
+        y_pred_proba = probabilities[:, 1] if probabilities.shape[1] > 1 else \
+            np.full(len(test), float(rand_frst_clf.classes_[0]))
+        predictions = (y_pred_proba > config.model_threshold).astype(int)
+
+        metrics['accuracy'] = accuracy_score(y_test, y_pred_proba > 0.5)
+        if len(np.unique(y_test)) > 1:
+            metrics['roc_auc'] = roc_auc_score(y_test, y_pred_proba)
+        metrics['num_of_trades'] = int(predictions.sum())
+        profit_perc_mean = get_profit_perc_mean(test[PROFIT_COLUMN].to_numpy(dtype=np.float64), predictions)
+        metrics['profit_perc_mean'] = None if np.isnan(profit_perc_mean) else float(profit_perc_mean)
+
+    return rand_frst_clf, metrics
+
+
+# This class trains the random forest for many stocks at once, from the "model_features" table - a model per stock
+# (fitted in parallel by a process pool, every forest with the cores left per worker) or a single model pooled over
+# all the stocks' rows. Every model and its test metrics are written to the model registry.
+# With a "series_cache", the features of repeated trainings in the process are read from memory instead of the db
+class ModelTrainer:
+
+    def __init__(self, config: TrainingConfig = None, registry: ModelRegistry = None,
+                 num_of_workers: int = None, series_cache: SeriesCache = None) -> None:
+        super().__init__()
+
+        self.config = config if config is not None else TrainingConfig()
+        self.registry = registry if registry is not None else ModelRegistry()
+        self.num_of_workers = num_of_workers if num_of_workers is not None else os.cpu_count() or 1
+        self.dataset_loader = DatasetLoader()
+        self.series_cache = series_cache
+
+    # the labelled feature rows of the training and test periods, without rows missing a feature value
+    def load_features(self, stock_ids: list[int] = None) -> pd.DataFrame:
+        columns = ['stock_id', 'date', PROFIT_COLUMN] + self.config.feature_columns
+        loader = self.series_cache if self.series_cache is not None else self.dataset_loader
+        features = loader.load(models.ModelFeatures, stock_ids, columns, after_date=self.config.after_date,
+                               until_date=self.config.test_until)
+        return features.dropna(subset=[PROFIT_COLUMN] + self.config.feature_columns).reset_index(drop=True)
+
+    def split(self, features: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+        is_train = features['date'] <= pd.Timestamp(self.config.train_until)
+        return features[is_train], features[~is_train]
+
+    # the registry row of a model trained on "train" (without the metrics)
+    def create_entry(self, stock_id: int, train: pd.DataFrame) -> dict:
+        feature_hash = get_feature_hash(train[['stock_id', 'date', PROFIT_COLUMN] + self.config.feature_columns])
+        return {'model_key': get_model_key(stock_id, feature_hash, self.config.rf_params, self.config.label_threshold),
+                'stock_id': stock_id,
+                'feature_hash': feature_hash,
+                'params': json.dumps(self.config.rf_params, sort_keys=True),
+                'feature_columns': json.dumps(self.config.feature_columns),
+                'label_threshold': self.config.label_threshold,
+                'model_threshold': self.config.model_threshold,
+                'train_after': self.config.after_date,
+                'train_until': self.config.train_until,
+                'test_until': self.config.test_until}
+
+    # trains and registers a model per stock (all stocks when None). Stocks whose model was already fitted on the same
+    # training rows, params and label threshold aren't refitted, their registry row is returned as is.
+    # Returns the registry rows of the stocks' models
+    def train_per_stock(self, stock_ids: list[int] = None) -> pd.DataFrame:
+        start_time = time.perf_counter()
+        features = self.load_features(stock_ids)
+
+        stock_splits = {}
+        for stock_id, stock_features in features.groupby('stock_id'):
+            train, test = self.split(stock_features)
+            if len(train) == 0:
+                logging.warning(f"stock {stock_id} has no training rows, no model trained")
+                continue
+            stock_splits[stock_id] = (train, test, self.create_entry(stock_id, train))
+        cached_entries = self.registry.get_entries([entry['model_key'] for _, _, entry in stock_splits.values()])
+        entries = list(cached_entries.values())
+        stock_splits = {stock_id: split for stock_id, split in stock_splits.items()
+                        if split[2]['model_key'] not in cached_entries}
+
+        num_of_workers = max(1, min(self.num_of_workers, len(stock_splits)))
+        n_jobs = max(1, (os.cpu_count() or 1) // num_of_workers)
+        with ProcessPoolExecutor(max_workers=num_of_workers) as executor:
+            futures = {executor.submit(train_model, train, test, self.config, n_jobs): entry
+                       for train, test, entry in stock_splits.values()}
+
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    model, metrics = future.result()
+                except Exception:
+                    logging.exception(f"training the model of stock {entry['stock_id']} failed")
+                    continue
+                entry.update(metrics)
+                self.registry.register(model, entry)
+                entries.append(entry)
+
+        logging.info(f"{len(entries) - len(cached_entries)} stock models trained and registered, "
+                     f"{len(cached_entries)} reused from the registry ({num_of_workers} workers, "
+                     f"{n_jobs} jobs per forest, {time.perf_counter() - start_time:.2f} seconds)")
+        return pd.DataFrame(entries)
+
+    # trains and registers a single model on the rows of all the given stocks (all stocks when None), unless it was
+    # already fitted on the same rows. Returns its registry row
+    def train_pooled(self, stock_ids: list[int] = None) -> pd.DataFrame:
+        start_time = time.perf_counter()
+        features = self.load_features(stock_ids)
+        train, test = self.split(features)
+        entry = self.create_entry(POOLED_STOCK_ID, train)
+        cached_entry = self.registry.get_entries([entry['model_key']]).get(entry['model_key'])
+        if cached_entry is not None:
+            logging.info(f"pooled model of {features['stock_id'].nunique()} stocks reused from the registry")
+            return pd.DataFrame([cached_entry])
+
+        model, metrics = train_model(train, test, self.config, n_jobs=self.num_of_workers)
+        entry.update(metrics)
+        self.registry.register(model, entry)
+
+        logging.info(f"pooled model of {features['stock_id'].nunique()} stocks trained and registered "
+                     f"({len(train)} training rows, {time.perf_counter() - start_time:.2f} seconds)")
+        return pd.DataFrame([entry])
@@ -1,6 +1,6 @@
 # this file refers to SQLAlchemy models
 from typing import Any
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Index
 import utils.database as database
 from utils.database import Base
 from sqlalchemy.orm import relationship
@@ -8,17 +8,26 @@ from sqlalchemy.orm import relationship
 # All models below comprise the stock_database tables that hold the relevant data extracted from Tiingo's website
 # (SQLAlchemy ORM -  presents a method of associating user-defined Python classes with database tables,
 # and instances of those classes (objects) with rows in their corresponding tables)
+# Every table has a unique index on its natural key - (stock_id, date) for daily tables and
+# (stock_id, year, quarter) for quarterly tables - so writing the same data twice updates rows instead of duplicating them.
+# The index is named by the model's "natural_key_index", which the upserts and the migration look the key columns up by.
+# The unique indexes double as the composite indexes of the per-stock lookups, the remaining lookups
+# (latest date of a quarterly table, latest quarter of the p/fcf table) have an index of their own
 
 class EndOfDayPrices(Base):
     __tablename__ = 'end_of_day_prices'
+    natural_key_index = 'uq_end_of_day_prices_stock_id_date'
+    __table_args__ = (Index(natural_key_index, 'stock_id', 'date', unique=True),)
 
     id = Column(Integer, primary_key=True, index=True)
     stock_id = Column(Integer)
-    date = Column(String(16))
+    date = Column(Date)
     close_price = Column(Float)
 
 class GrahamNumber(Base):
     __tablename__ = 'graham_number'
+    natural_key_index = 'uq_graham_number_stock_id_year_quarter'
+    __table_args__ = (Index(natural_key_index, 'stock_id', 'year', 'quarter', unique=True),)
 
     id = Column(Integer, primary_key=True, index=True)
     stock_id = Column(Integer)
@@ -28,19 +37,24 @@ class GrahamNumber(Base):
 
 class PFreeCashFlowMultiplier(Base):
     __tablename__ = 'p_free_cash_flow_multiplier'
+    natural_key_index = 'uq_p_free_cash_flow_multiplier_stock_id_date'
+    __table_args__ = (Index(natural_key_index, 'stock_id', 'date', unique=True),
+                      Index('ix_p_free_cash_flow_multiplier_stock_id_year_quarter', 'stock_id', 'year', 'quarter'))
 
     id = Column(Integer, primary_key=True, index=True)
     stock_id = Column(Integer)
-    date = Column(String(16))
+    date = Column(Date)
     year = Column(Integer)
     quarter = Column(Integer)
     pfree_cash_flow_ratio = Column(Float)
 
 class FullDailyMultipliers(Base):
     __tablename__ = 'full_daily_multipliers'
+    natural_key_index = 'uq_full_daily_multipliers_stock_id_date'
+    __table_args__ = (Index(natural_key_index, 'stock_id', 'date', unique=True),)
 
     id = Column(Integer, primary_key=True, index=True)
-    date = Column(String(16))
+    date = Column(Date)
     stock_id = Column(Integer)
     market_cap = Column(Float)
     enterprise_val = Column(Float)
@@ -50,10 +64,13 @@ class FullDailyMultipliers(Base):
 
 class QuarterlyBalanceSheetData(Base):
     __tablename__ = 'quarterly_balance_sheet_data'
+    natural_key_index = 'uq_quarterly_balance_sheet_data_stock_id_year_quarter'
+    __table_args__ = (Index(natural_key_index, 'stock_id', 'year', 'quarter', unique=True),
+                      Index('ix_quarterly_balance_sheet_data_stock_id_date', 'stock_id', 'date'))
 
     id = Column(Integer, primary_key=True, index=True)
     stock_id = Column(Integer)
-    date = Column(String(16))
+    date = Column(Date)
     year = Column(Integer)
     quarter = Column(Integer)
     debtCurrent = Column(Float)
@@ -86,10 +103,13 @@ class QuarterlyBalanceSheetData(Base):
 
 class QuarterlyCashFlow(Base):
     __tablename__ = 'quarterly_cash_flow_data'
+    natural_key_index = 'uq_quarterly_cash_flow_data_stock_id_year_quarter'
+    __table_args__ = (Index(natural_key_index, 'stock_id', 'year', 'quarter', unique=True),
+                      Index('ix_quarterly_cash_flow_data_stock_id_date', 'stock_id', 'date'))
 
     id = Column(Integer, primary_key=True, index=True)
     stock_id = Column(Integer)
-    date = Column(String(16))
+    date = Column(Date)
     year = Column(Integer)
     quarter = Column(Integer)
     ncfi = Column(Float)
@@ -110,10 +130,13 @@ class QuarterlyCashFlow(Base):
 
 class QuarterlyIncomeStatement(Base):
     __tablename__ = 'quarterly_income_statement_data'
+    natural_key_index = 'uq_quarterly_income_statement_data_stock_id_year_quarter'
+    __table_args__ = (Index(natural_key_index, 'stock_id', 'year', 'quarter', unique=True),
+                      Index('ix_quarterly_income_statement_data_stock_id_date', 'stock_id', 'date'))
 
     id = Column(Integer, primary_key=True, index=True)
     stock_id = Column(Integer)
-    date = Column(String(16))
+    date = Column(Date)
     year = Column(Integer)
     quarter = Column(Integer)
     ebit = Column(Float)
@@ -142,10 +165,13 @@ class QuarterlyIncomeStatement(Base):
 
 class QuarterlyOverview(Base):
     __tablename__ = 'quarterly_overview_data'
+    natural_key_index = 'uq_quarterly_overview_data_stock_id_year_quarter'
+    __table_args__ = (Index(natural_key_index, 'stock_id', 'year', 'quarter', unique=True),
+                      Index('ix_quarterly_overview_data_stock_id_date', 'stock_id', 'date'))
 
     id = Column(Integer, primary_key=True, index=True)
     stock_id = Column(Integer)
-    date = Column(String(16))
+    date = Column(Date)
     year = Column(Integer)
     quarter = Column(Integer)
     longTermDebtEquity = Column(Float)
@@ -165,6 +191,8 @@ class QuarterlyOverview(Base):
 
 class StocksByID(Base):
     __tablename__ = 'stocks_by_id'
+    natural_key_index = 'uq_stocks_by_id_stock_name'
+    __table_args__ = (Index(natural_key_index, 'stock_name', unique=True),)
 
     def __init__(self, stock_name=None, *args: Any, **kwargs: Any):
         super().__init__(*args, **kwargs)
@@ -173,5 +201,96 @@ class StocksByID(Base):
     id = Column(Integer, primary_key=True, index=True)
     stock_name = Column(String(16))
 
+# progress ledger of the latest populate / pipeline run - a row per (stage, stock) whose data was written and committed,
+# so an interrupted run can be resumed from the stocks that weren't done. "stage" is the name of the table written
+class PipelineProgress(Base):
+    __tablename__ = 'pipeline_progress'
+    natural_key_index = 'uq_pipeline_progress_stage_stock_id'
+    __table_args__ = (Index(natural_key_index, 'stage', 'stock_id', unique=True),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    stage = Column(String(64))
+    stock_id = Column(Integer)
+    num_of_rows = Column(Integer)
+    duration_sec = Column(Float)
+    completed_at = Column(DateTime)
+
+# the random forest's feature matrix - end of day prices joined with the daily multipliers, p/fcf, graham number and
+# the overview's current ratio, and labelled with the market cap 60 trading days later (null for the latest 60 days,
+# until their label is known). Maintained by "utils/model_features.py"
+class ModelFeatures(Base):
+    __tablename__ = 'model_features'
+    natural_key_index = 'uq_model_features_stock_id_date'
+    __table_args__ = (Index(natural_key_index, 'stock_id', 'date', unique=True),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    stock_id = Column(Integer)
+    date = Column(Date)
+    year = Column(Integer)
+    quarter = Column(Integer)
+    close_price = Column(Float)
+    market_cap = Column(Float)
+    enterprise_val = Column(Float)
+    pe_ratio = Column(Float)
+    pb_ratio = Column(Float)
+    trailing_peg_1_y = Column(Float)
+    pfree_cash_flow_ratio = Column(Float)
+    graham_value = Column(Float)
+    currentRatio = Column(Float)
+    date_plus_3m = Column(Date)
+    market_cap_plus_3m = Column(Float)
+    diff_in_mc = Column(Float)
+    diff_in_mc_perc = Column(Float)
+
+# the model registry - a row per fitted random forest (saved with joblib at "model_path") and its test metrics.
+# "model_key" identifies the fit - the stock (0 for a model pooled over many stocks), the hash of the training rows,
+# the params and the label threshold
+class TrainedModel(Base):
+    __tablename__ = 'trained_models'
+    natural_key_index = 'uq_trained_models_model_key'
+    __table_args__ = (Index(natural_key_index, 'model_key', unique=True),
+                      Index('ix_trained_models_stock_id_trained_at', 'stock_id', 'trained_at'))
+
+    id = Column(Integer, primary_key=True, index=True)
+    model_key = Column(String(64))
+    stock_id = Column(Integer)
+    feature_hash = Column(String(32))
+    params = Column(String(512))
+    feature_columns = Column(String(512))
+    label_threshold = Column(Float)
+    model_threshold = Column(Float)
+    train_after = Column(Date)
+    train_until = Column(Date)
+    test_until = Column(Date)
+    num_of_train_rows = Column(Integer)
+    num_of_test_rows = Column(Integer)
+    accuracy = Column(Float)
+    roc_auc = Column(Float)
+    num_of_trades = Column(Integer)
+    profit_perc_mean = Column(Float)
+    fit_duration_sec = Column(Float)
+    model_path = Column(String(512))
+    trained_at = Column(DateTime)
+
+# the random forest's daily trading signals - the latest feature row of every stock whose inputs changed, scored by
+# the stock's registered model (see "utils/model_scoring.py"). "latency_sec" is the time from the new data being
+# written by the nightly update ("data_arrived_at") to the signal being written ("scored_at")
+class DailySignals(Base):
+    __tablename__ = 'daily_signals'
+    natural_key_index = 'uq_daily_signals_stock_id_date'
+    __table_args__ = (Index(natural_key_index, 'stock_id', 'date', unique=True),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    stock_id = Column(Integer)
+    date = Column(Date)
+    probability = Column(Float)
+    label_threshold = Column(Float)
+    model_threshold = Column(Float)
+    signal = Column(Integer)
+    model_key = Column(String(64))
+    data_arrived_at = Column(DateTime)
+    scored_at = Column(DateTime)
+    latency_sec = Column(Float)
+
 def create_tables_for_all_models():
     Base.metadata.create_all(bind=database.engine)
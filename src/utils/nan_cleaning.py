@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+# gaps (consecutive missing values of a column) up to this length are interpolated, rows in longer gaps are dropped
+MAX_INTERPOLATED_GAP = 5
+
+
+# returns True at the first row of every stock - the rows are expected to be ordered by stock
+def get_group_starts(group_values: np.ndarray) -> np.ndarray:
+    group_starts = np.ones(len(group_values), dtype=bool)
+    group_starts[1:] = group_values[1:] != group_values[:-1]
+    return group_starts
+
+
+# returns, for every missing value, the length of the run of consecutive missing values (of the same column and
+# stock) it belongs to, and 0 for values that aren't missing. "mask" is a (rows, columns) array of missing values.
+# The columns are laid end to end, so every run gets a single id from one cumsum and its length from one bincount
+def get_nan_run_lengths(mask: np.ndarray, group_starts: np.ndarray) -> np.ndarray:
+    num_of_rows, num_of_columns = mask.shape
+    if num_of_rows == 0:
+        return np.zeros(mask.shape, dtype=np.int64)
+
+    previous_mask = np.zeros_like(mask)
+    previous_mask[1:] = mask[:-1]
+    previous_mask[group_starts] = False
+    run_starts = mask & ~previous_mask
+
+    flat_mask = mask.T.ravel()
+    run_ids = np.cumsum(run_starts.T.ravel())
+    run_lengths = np.bincount(run_ids[flat_mask], minlength=run_ids[-1] + 1)
+    return np.where(flat_mask, run_lengths[run_ids], 0).reshape(num_of_columns, num_of_rows).T
+
+
+# linear interpolation of every column, per stock - the same as pandas' interpolate(limit_area='inside', limit=limit):
+# a missing value is filled only if the stock has a value before and after it in that column, and it's at most
+# "limit" rows after the last value before it
+def interpolate_gaps(values: np.ndarray, group_starts: np.ndarray, limit: int = MAX_INTERPOLATED_GAP) -> np.ndarray:
+    num_of_rows, num_of_columns = values.shape
+    if num_of_rows == 0:
+        return values.copy()
+
+    positions = np.arange(num_of_rows)[:, np.newaxis]
+    group_first_rows = np.flatnonzero(group_starts)
+    group_ids = np.cumsum(group_starts) - 1
+    first_rows = group_first_rows[group_ids]
+    last_rows = (np.append(group_first_rows[1:], num_of_rows) - 1)[group_ids]
+
+    is_valid = ~np.isnan(values)
+    previous_valid_rows = np.maximum.accumulate(np.where(is_valid, positions, -1), axis=0)
+    next_valid_rows = np.minimum.accumulate(np.where(is_valid, positions, num_of_rows)[::-1], axis=0)[::-1]
+
+    # only the missing values are looked at from here on
+    rows, columns = np.nonzero(~is_valid)
+    previous_rows = previous_valid_rows[rows, columns]
+    next_rows = next_valid_rows[rows, columns]
+    to_fill = (previous_rows >= first_rows[rows]) & (next_rows <= last_rows[rows]) & (rows - previous_rows <= limit)
+    rows, columns, previous_rows, next_rows = rows[to_fill], columns[to_fill], previous_rows[to_fill], next_rows[to_fill]
+
+    previous_values = values[previous_rows, columns]
+    next_values = values[next_rows, columns]
+    interpolated_values = values.copy()
+    interpolated_values[rows, columns] = previous_values + (next_values - previous_values) * \
+        (rows - previous_rows) / (next_rows - previous_rows)
+    return interpolated_values
+
+
+# This function replaces the notebooks' missing values handling, for any number of stocks at once:
+# rows with a gap longer than "max_gap" in any of the value columns are dropped, and the remaining gaps are
+# interpolated (inside gaps only, up to "max_gap" values in a row). The value columns (all float columns by default)
+# are returned as float64. Rows are expected to be ordered by date within each stock
+def clean_nan_runs(frame: pd.DataFrame, value_columns: list[str] = None, group_column: str = 'stock_id',
+                   max_gap: int = MAX_INTERPOLATED_GAP) -> pd.DataFrame:
+    if value_columns is None:
+        value_columns = [column for column in frame.columns
+                         if column != group_column and pd.api.types.is_float_dtype(frame[column])]
+
+    frame = frame.sort_values(group_column, kind='stable') if group_column in frame.columns else frame.copy()
+    group_values = frame[group_column].to_numpy() if group_column in frame.columns else np.zeros(len(frame))
+    values = frame[value_columns].to_numpy(dtype=np.float64)
+
+    run_lengths = get_nan_run_lengths(np.isnan(values), get_group_starts(group_values))
+    rows_to_keep = ~(run_lengths > max_gap).any(axis=1)
+
+    cleaned_frame = frame[rows_to_keep].reset_index(drop=True)
+    cleaned_frame[value_columns] = interpolate_gaps(values[rows_to_keep], get_group_starts(group_values[rows_to_keep]),
+                                                    max_gap)
+    return cleaned_frame
@@ -0,0 +1,126 @@
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+import pandas as pd
+import sqlalchemy as sqlalch
+from sqlalchemy import Integer, Float, Date, DateTime, String
+from .database import get_db
+from . import models
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# the store directory can be changed with the "TAU_PARQUET_DIR" environment variable
+DEFAULT_STORE_DIR = os.getenv('TAU_PARQUET_DIR', str(Path.home() / '.tau_trading' / 'parquet'))
+
+# the tables the model notebooks read
+EXPORT_TABLES = [
+    models.EndOfDayPrices,
+    models.FullDailyMultipliers,
+    models.PFreeCashFlowMultiplier,
+    models.GrahamNumber,
+    models.QuarterlyOverview,
+    models.ModelFeatures,
+]
+
+# the partition key is part of the directory name, the row id isn't needed outside of the db
+EXCLUDED_COLUMNS = ['id', 'stock_id']
+PARTITION_FILE_NAME = 'part-0.parquet'
+
+
+def check_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("the parquet store requires pyarrow (pip install -r requirements.txt)")
+
+
+# arrow schema of a table's exported columns, taken from the model so every partition has the same types
+# (even a stock whose column is all null)
+def get_arrow_schema(table: models):
+    check_pyarrow()
+    arrow_types = {Integer: pa.int64(), Float: pa.float64(), Date: pa.date32(), DateTime: pa.timestamp('us'),
+                   String: pa.string()}
+    return pa.schema([(column.name, next(arrow_type for sql_type, arrow_type in arrow_types.items()
+                                         if isinstance(column.type, sql_type)))
+                      for column in table.__table__.columns if column.name not in EXCLUDED_COLUMNS])
+
+
+# This class keeps a columnar copy of the model tables on disk - one parquet file per (table, stock), in hive
+# partitioned directories ("<store dir>/<table>/stock_id=<id>/part-0.parquet"), so the whole table can also be read
+# as a single dataset. Loading a stock memory-maps only that stock's file and only the requested columns
+class ParquetStore:
+
+    def __init__(self, store_dir: str = DEFAULT_STORE_DIR) -> None:
+        super().__init__()
+        check_pyarrow()
+
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+
+    def get_partition_path(self, table: models, stock_id: int) -> Path:
+        return self.store_dir / table.__tablename__ / f'stock_id={stock_id}' / PARTITION_FILE_NAME
+
+    # writes the stock's current rows of a table, replacing its previous file. Returns the number of rows
+    def export_stock(self, table: models, stock_id: int) -> int:
+        schema = get_arrow_schema(table)
+        db = get_db()
+        query = sqlalch.select([getattr(table, column_name) for column_name in schema.names]). \
+            filter(table.stock_id == stock_id).order_by(*self.get_sort_columns(table))
+        rows = db.execute(query).fetchall()
+        db.commit()
+
+        arrow_table = pa.Table.from_pylist([dict(zip(schema.names, row)) for row in rows], schema=schema)
+        partition_path = self.get_partition_path(table, stock_id)
+        partition_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # write to a temporary file first, so a reader never memory-maps a half written file
+        tmp_partition_path = partition_path.with_suffix(f'.{threading.get_ident()}.tmp')
+        pq.write_table(arrow_table, tmp_partition_path, compression='snappy')
+        os.replace(tmp_partition_path, partition_path)
+
+        return len(rows)
+
+    @staticmethod
+    def get_sort_columns(table: models) -> list:
+        if hasattr(table, 'date'):
+            return [table.date]
+        return [table.year, table.quarter]
+
+    # exports the given stocks (all stocks in the db when None) of every export table
+    def export_tables(self, tables: list[models] = None, stock_ids: list[int] = None) -> None:
+        tables = tables if tables is not None else EXPORT_TABLES
+        if stock_ids is None:
+            db = get_db()
+            stock_ids = [stock_id for stock_id, in db.execute(sqlalch.select([models.StocksByID.id]))]
+
+        for table in tables:
+            start_time = time.perf_counter()
+            num_of_rows = sum(self.export_stock(table, stock_id) for stock_id in stock_ids)
+            logging.info(f"{table.__tablename__}: {num_of_rows} rows of {len(stock_ids)} stocks exported "
+                         f"({time.perf_counter() - start_time:.2f} seconds)")
+
+    # loads a single stock's rows of a table. Only the requested columns (all when None) are read, from a memory
+    # mapped file. Date columns are returned as datetime64 and a "stock_id" column is added
+    def load_stock(self, table: models, stock_id: int, columns: list[str] = None) -> pd.DataFrame:
+        partition_path = self.get_partition_path(table, stock_id)
+        if columns is not None:
+            columns = [column for column in columns if column != 'stock_id']
+
+        if partition_path.exists():
+            arrow_table = pq.read_table(partition_path, columns=columns, memory_map=True)
+        else:
+            arrow_table = get_arrow_schema(table).empty_table()
+            if columns is not None:
+                arrow_table = arrow_table.select(columns)
+
+        frame = arrow_table.to_pandas(date_as_object=False)
+        frame.insert(0, 'stock_id', stock_id)
+        return frame
+
+    def load_stocks(self, table: models, stock_ids: list[int], columns: list[str] = None) -> pd.DataFrame:
+        return pd.concat([self.load_stock(table, stock_id, columns) for stock_id in stock_ids], ignore_index=True)
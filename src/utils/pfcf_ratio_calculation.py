@@ -1,9 +1,13 @@
 import logging
 import sqlalchemy as sqlalch
-from .database import get_db
+from .database import get_db, load_frame
 from . import models
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from datetime import date as date_type
+
+# number of stocks whose prices and statements are loaded (and whose ratios are computed) at once
+PFCF_STOCKS_PER_BATCH = 50
 
 
 class CalcPFCFMultiplier:
@@ -11,17 +15,16 @@ class CalcPFCFMultiplier:
     def __init__(self) -> None:
         super().__init__()
 
-    def get_quarter_by_date(self, date: str) -> int:
+    def get_quarter_by_date(self, date: date_type) -> int:
 
-        string_to_date = datetime.strptime(date, '%Y-%m-%d').date()
-        quarter = pd.Timestamp(string_to_date).quarter
+        quarter = pd.Timestamp(date).quarter
         return quarter
 
-    def check_if_quarter_exists_in_table(self, stock_id: int, db_table: models, date: str, quarter_default = 0) -> bool:
+    def check_if_quarter_exists_in_table(self, stock_id: int, db_table: models, date: date_type, quarter_default = 0) -> bool:
 
         db = get_db()
         quarter_num = self.get_quarter_by_date(date)
-        year = date[0:4]
+        year = date.year
         query_for_quarter = sqlalch.select([db_table.quarter]).\
                                     filter(db_table.year == year,
                                            db_table.stock_id == stock_id,
@@ -35,7 +38,7 @@ class CalcPFCFMultiplier:
             return False
 
     def pfcf_ratio_calc(self, stock_id: int, end_of_day_prices: models.EndOfDayPrices, quarterly_cash_flow_data: models.QuarterlyCashFlow,
-                        quarterly_balance_sheet_data: models.QuarterlyBalanceSheetData, date: str,
+                        quarterly_balance_sheet_data: models.QuarterlyBalanceSheetData, date: date_type,
                         quarter_default=0) -> float | None:
         db = get_db()
 
@@ -50,13 +53,13 @@ class CalcPFCFMultiplier:
             close_res = db.execute(close_price).first()
 
             fcf_val = sqlalch.select([quarterly_cash_flow_data.freeCashFlow]).\
-                filter(models.QuarterlyCashFlow.year == date[0:4],
+                filter(models.QuarterlyCashFlow.year == date.year,
                        models.QuarterlyCashFlow.quarter == quarter_default,
                        models.QuarterlyCashFlow.stock_id == stock_id)
             fcf_res = db.execute(fcf_val).first()
 
             num_of_shares = sqlalch.select([quarterly_balance_sheet_data.sharesBasic]).\
-                filter(models.QuarterlyBalanceSheetData.year == date[0:4],
+                filter(models.QuarterlyBalanceSheetData.year == date.year,
                        models.QuarterlyBalanceSheetData.quarter == current_quarter,
                        models.QuarterlyBalanceSheetData.stock_id == stock_id)
             num_of_shares_res = db.execute(num_of_shares).first()
@@ -72,4 +75,61 @@ class CalcPFCFMultiplier:
             logging.warning("Quarter doesn't exist in database, unable to complete calculation")
             return None
 
-
+    # vectorized version of "pfcf_ratio_calc" - loads the close prices, free cash flow and shares of a batch of stocks
+    # once, joins them on (year, quarter) and computes the ratio of every (stock, date) pair in one pass.
+    # The rules are the same: a ratio is calculated only if the date's quarter exists in both quarterly tables,
+    # from the annual free cash flow (quarter 0) and the quarter's shares, and is missing (NaN) when a value is
+    # missing or zero. Returns a frame with the p/fcf table's columns
+    def pfcf_ratio_frame(self, stock_ids: list[int], dates: list[date_type], quarter_default=0) -> pd.DataFrame:
+        dates = [date for date in dates if date is not None]
+
+        prices = load_frame(sqlalch.select([models.EndOfDayPrices.stock_id, models.EndOfDayPrices.date,
+                                            models.EndOfDayPrices.close_price]).
+                            filter(models.EndOfDayPrices.stock_id.in_(stock_ids)).order_by(models.EndOfDayPrices.id),
+                            ['stock_id', 'date', 'close_price'], ['stock_id'])
+        cash_flow = load_frame(sqlalch.select([models.QuarterlyCashFlow.stock_id, models.QuarterlyCashFlow.year,
+                                               models.QuarterlyCashFlow.quarter, models.QuarterlyCashFlow.freeCashFlow]).
+                               filter(models.QuarterlyCashFlow.stock_id.in_(stock_ids)).order_by(models.QuarterlyCashFlow.id),
+                               ['stock_id', 'year', 'quarter', 'freeCashFlow'], ['stock_id', 'year', 'quarter'])
+        balance_sheet = load_frame(sqlalch.select([models.QuarterlyBalanceSheetData.stock_id,
+                                                   models.QuarterlyBalanceSheetData.year,
+                                                   models.QuarterlyBalanceSheetData.quarter,
+                                                   models.QuarterlyBalanceSheetData.sharesBasic]).
+                                   filter(models.QuarterlyBalanceSheetData.stock_id.in_(stock_ids)).
+                                   order_by(models.QuarterlyBalanceSheetData.id),
+                                   ['stock_id', 'year', 'quarter', 'sharesBasic'], ['stock_id', 'year', 'quarter'])
+
+        # like ".first()" in the per-date queries, the first written row of a key wins
+        prices = prices.drop_duplicates(['stock_id', 'date'])
+        cash_flow = cash_flow.drop_duplicates(['stock_id', 'year', 'quarter'])
+        balance_sheet = balance_sheet.drop_duplicates(['stock_id', 'year', 'quarter'])
+
+        # every stock gets a row for every date
+        frame = pd.DataFrame({'stock_id': np.repeat(np.asarray(stock_ids, dtype='int64'), len(dates)),
+                              'date': np.tile(np.array(dates, dtype=object), len(stock_ids))})
+        timestamps = pd.DatetimeIndex(pd.to_datetime(frame['date']))
+        frame['year'] = timestamps.year.astype('int64')
+        frame['quarter'] = timestamps.quarter.astype('int64')
+
+        annual_cash_flow = cash_flow[cash_flow['quarter'] == quarter_default][['stock_id', 'year', 'freeCashFlow']]
+        frame = frame.merge(prices, on=['stock_id', 'date'], how='left', indicator='has_close_price'). \
+            merge(cash_flow[['stock_id', 'year', 'quarter']], on=['stock_id', 'year', 'quarter'], how='left',
+                  indicator='has_cash_flow_quarter'). \
+            merge(balance_sheet, on=['stock_id', 'year', 'quarter'], how='left', indicator='has_balance_sheet_quarter'). \
+            merge(annual_cash_flow, on=['stock_id', 'year'], how='left')
+
+        close_price = frame['close_price'].to_numpy(dtype=np.float64)
+        free_cash_flow = frame['freeCashFlow'].to_numpy(dtype=np.float64)
+        shares_basic = frame['sharesBasic'].to_numpy(dtype=np.float64)
+        is_valid = (frame['has_cash_flow_quarter'] == 'both').to_numpy() & \
+                   (frame['has_balance_sheet_quarter'] == 'both').to_numpy() & \
+                   (frame['has_close_price'] == 'both').to_numpy() & \
+                   ~np.isnan(close_price) & ~np.isnan(free_cash_flow) & ~np.isnan(shares_basic) & \
+                   (free_cash_flow != 0) & (shares_basic != 0)
+
+        # same operation order as the per-date calculation, so the results are identical
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pfree_cash_flow_ratio = np.where(is_valid, close_price / (free_cash_flow / shares_basic), np.nan)
+
+        return pd.DataFrame({'stock_id': frame['stock_id'], 'date': frame['date'], 'year': frame['year'],
+                             'quarter': frame['quarter'], 'pfree_cash_flow_ratio': pfree_cash_flow_ratio})
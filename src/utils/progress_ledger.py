@@ -0,0 +1,47 @@
+import logging
+from datetime import datetime
+import sqlalchemy as sqlalch
+from .database import get_db, engine
+from .bulk_writer import create_upsert_statement
+from . import models
+
+
+# This class keeps the "pipeline progress" table - which (stage, stock) pairs of the current run are done.
+# A stage's rows of a stock and its ledger row are committed together by the caller, so a stock is either
+# completely written and recorded or not at all. A new run resets the ledger of its stages, a resumed run keeps it
+# and skips the recorded stocks
+class ProgressLedger:
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        # databases created before the ledger existed get its table on first use
+        models.PipelineProgress.__table__.create(bind=engine, checkfirst=True)
+
+    @staticmethod
+    def reset(stages: list[str]) -> None:
+        db = get_db()
+        db.execute(sqlalch.delete(models.PipelineProgress.__table__).
+                   where(models.PipelineProgress.stage.in_(stages)))
+        db.commit()
+
+    # returns {stock_id: number of rows written} of the stocks that completed the stage
+    @staticmethod
+    def load_completed(stage: str) -> dict[int, int]:
+        db = get_db()
+        query = sqlalch.select([models.PipelineProgress.stock_id, models.PipelineProgress.num_of_rows]). \
+            filter(models.PipelineProgress.stage == stage)
+        completed = {stock_id: num_of_rows for stock_id, num_of_rows in db.execute(query)}
+        db.commit()
+
+        if completed:
+            logging.info(f"{stage}: {len(completed)} stocks already completed, skipping them")
+        return completed
+
+    # adds the stock's ledger row to the current transaction - it's committed together with the stock's data
+    @staticmethod
+    def record(stage: str, stock_id: int, num_of_rows: int, duration_sec: float) -> None:
+        db = get_db()
+        row = {'stage': stage, 'stock_id': stock_id, 'num_of_rows': num_of_rows, 'duration_sec': duration_sec,
+               'completed_at': datetime.now()}
+        db.execute(create_upsert_statement(models.PipelineProgress, list(row.keys()), db.get_bind().dialect.name), [row])
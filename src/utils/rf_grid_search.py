@@ -0,0 +1,110 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import ParameterGrid
+
+# the notebooks' search space
+LABEL_THRESHOLDS = [1, 5, 10, 15, 20]
+MODEL_THRESHOLDS = [0.7, 0.75, 0.8, 0.85, 0.9, 0.95]
+RF_PARAM_GRID = {
+    'n_estimators': [51, 101, 151],
+    'criterion': ["gini", "entropy"],
+    'max_depth': [5, 7, 9, 11],
+    'max_features': [3, 5, 7, 8],
+    'random_state': [711],
+}
+
+FEATURE_COLUMNS = ['enterprise_val', 'pe_ratio', 'pb_ratio', 'trailing_peg_1_y', 'pfree_cash_flow_ratio', 'graham_value',
+                   'currentRatio']
+PROFIT_COLUMN = 'diff_in_mc_perc'
+NUM_OF_TOP_RESULTS = 5
+
+
+# fits a forest and returns the positive class probabilities of the validation rows - runs in a worker process
+def fit_and_predict_proba(params: dict, x_train: np.ndarray, y_train: np.ndarray, x_validation: np.ndarray,
+                          n_jobs: int) -> np.ndarray:
+    rand_frst_clf = RandomForestClassifier(**params, n_jobs=n_jobs)
+    rand_frst_clf.fit(x_train, y_train)
+    return rand_frst_clf.predict_proba(x_validation)[:, 1]
+
+
+# returns the mean profit (in percents) of the days the model predicted an increase, rounded like the notebooks -
+# NaN when no day was predicted
+def get_profit_perc_mean(profits: np.ndarray, predictions: np.ndarray) -> float:
+    profit_perc_sum = round(np.nansum(profits * predictions), 3)
+    num_of_predicted_days = int(predictions.sum())
+    if num_of_predicted_days == 0:
+        return np.nan
+    return round(profit_perc_sum / num_of_predicted_days, 3)
+
+
+# the best results of a search - {mean profit: [label threshold, model threshold, params]} ordered by profit,
+# results without a profit (no predicted days) left out
+def rank_profits(profit_with_params_dict: dict, top_n: int = NUM_OF_TOP_RESULTS) -> dict:
+    profit_keys_lst_not_null = sorted([profit for profit in profit_with_params_dict if not pd.isna(profit)], reverse=True)
+    return {profit: profit_with_params_dict[profit] for profit in profit_keys_lst_not_null[:top_n]}
+
+
+# This class runs the random forest optimization of "rf_model_optimization.ipynb". The model threshold only changes
+# how "predict_proba" is turned into predictions, so every (label threshold, params) forest is fitted once and
+# all the model thresholds are evaluated on its probabilities. The fits run in a process pool, and every forest
+# builds its trees with the cores left per worker ("n_jobs")
+class RFGridSearch:
+
+    def __init__(self, label_thresholds: list[float] = None, model_thresholds: list[float] = None,
+                 param_grid: dict = None, feature_columns: list[str] = None, num_of_workers: int = None,
+                 n_jobs: int = None) -> None:
+        super().__init__()
+
+        self.label_thresholds = label_thresholds if label_thresholds is not None else LABEL_THRESHOLDS
+        self.model_thresholds = model_thresholds if model_thresholds is not None else MODEL_THRESHOLDS
+        self.all_rf_params_permutations = list(ParameterGrid(param_grid if param_grid is not None else RF_PARAM_GRID))
+        self.feature_columns = feature_columns if feature_columns is not None else FEATURE_COLUMNS
+
+        num_of_cpus = os.cpu_count() or 1
+        num_of_fits = len(self.label_thresholds) * len(self.all_rf_params_permutations)
+        self.num_of_workers = num_of_workers if num_of_workers is not None else max(1, min(num_of_cpus, num_of_fits))
+        self.n_jobs = n_jobs if n_jobs is not None else max(1, num_of_cpus // self.num_of_workers)
+
+    # returns the probabilities of every (label threshold, params index) forest
+    def fit_all(self, train: pd.DataFrame, validation: pd.DataFrame) -> dict[tuple[float, int], np.ndarray]:
+        x_train = train[self.feature_columns].to_numpy()
+        x_validation = validation[self.feature_columns].to_numpy()
+
+        probabilities = {}
+        with ProcessPoolExecutor(max_workers=self.num_of_workers) as executor:
+            futures = {}
+            for label_thresh in self.label_thresholds:
+                y_train = (train[PROFIT_COLUMN] > label_thresh).astype(int).to_numpy()
+                for params_index, params in enumerate(self.all_rf_params_permutations):
+                    future = executor.submit(fit_and_predict_proba, params, x_train, y_train, x_validation, self.n_jobs)
+                    futures[future] = (label_thresh, params_index)
+
+            for future in as_completed(futures):
+                probabilities[futures[future]] = future.result()
+
+        return probabilities
+
+    # returns {mean validation profit: [label threshold, model threshold, params]} of all the combinations, the same
+    # dictionary the notebook's loop builds (a combination with the same profit as an earlier one replaces it)
+    def search(self, train: pd.DataFrame, validation: pd.DataFrame) -> dict:
+        start_time = time.perf_counter()
+        probabilities = self.fit_all(train, validation)
+        profits = validation[PROFIT_COLUMN].to_numpy(dtype=np.float64)
+
+        profit_with_params_dict = {}
+        for label_thresh in self.label_thresholds:
+            for model_thresh in self.model_thresholds:
+                for params_index, params in enumerate(self.all_rf_params_permutations):
+                    predictions = (probabilities[(label_thresh, params_index)] > model_thresh).astype(int)
+                    profit_perc_mean = get_profit_perc_mean(profits, predictions)
+                    profit_with_params_dict[profit_perc_mean] = [label_thresh, model_thresh, params]
+
+        logging.info(f"{len(probabilities)} forests fitted for {len(profit_with_params_dict)} results in "
+                     f"{time.perf_counter() - start_time:.2f} seconds "
+                     f"({self.num_of_workers} workers, {self.n_jobs} jobs per forest)")
+        return profit_with_params_dict
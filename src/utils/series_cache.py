@@ -0,0 +1,190 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+import numpy as np
+import pandas as pd
+from sqlalchemy import Float
+from .database import get_db
+from .dataset_loader import DatasetLoader
+from .freshness_index import FreshnessIndex
+from . import models
+
+# the daily tables the cache holds - a stock's series is a column per float column of the table
+CACHED_TABLES = [models.EndOfDayPrices, models.FullDailyMultipliers, models.PFreeCashFlowMultiplier,
+                 models.ModelFeatures]
+# the cache's memory budget can be changed with the "TAU_SERIES_CACHE_MB" environment variable
+DEFAULT_MEMORY_BUDGET = int(os.getenv('TAU_SERIES_CACHE_MB', '256')) * 1024 * 1024
+
+
+def get_value_columns(table: models) -> list[str]:
+    return [column.name for column in table.__table__.columns if isinstance(column.type, Float)]
+
+
+# dates as days since 1970-01-01, the int32 day numbers the series are kept in
+def to_day_numbers(dates: pd.Series | pd.DatetimeIndex) -> np.ndarray:
+    return pd.DatetimeIndex(dates).to_numpy(dtype='datetime64[D]').astype(np.int32)
+
+
+def from_day_numbers(day_numbers: np.ndarray) -> np.ndarray:
+    return day_numbers.astype('datetime64[D]').astype('datetime64[ns]')
+
+
+# a stock's rows of a table, column by column and ordered by date. "watermark" is the stock's latest date in the
+# table when it was loaded - the series is stale once the table has a newer date for the stock. The series holds the
+# rows after "after_day" (all the stock's rows when None)
+@dataclass
+class StockSeries:
+    days: np.ndarray
+    values: dict[str, np.ndarray]
+    watermark: date | None
+    after_day: int | None = None
+
+    # whether the series holds all the rows after the given day
+    def covers(self, after_day: int | None) -> bool:
+        return self.after_day is None or (after_day is not None and after_day >= self.after_day)
+
+    @property
+    def nbytes(self) -> int:
+        return self.days.nbytes + sum(column_values.nbytes for column_values in self.values.values())
+
+
+# This class keeps the daily tables' per stock series in memory, so repeated loads of the same stocks (feature builds,
+# training, analyses) in a process don't query the db again. A stock is loaded on its first access, from the requested
+# date on (all the stocks missing from a request in one query), and reloaded when a request starts before the cached
+# rows or its table has a newer date for it than the cached one - the stocks' latest dates are queried again on every
+# load, so rows appended by another process are seen too. Rows re-written without a newer date aren't detected,
+# their writer has to invalidate them. The least recently used stocks are evicted once the series take more than the
+# memory budget. Values are float64 by default, float32 halves their memory. Not thread safe
+class SeriesCache:
+
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET, value_dtype: type = np.float64) -> None:
+        super().__init__()
+
+        self.memory_budget = memory_budget
+        self.value_dtype = value_dtype
+        self.dataset_loader = DatasetLoader()
+        # (table name, stock id) -> series, from the least to the most recently used
+        self.series: OrderedDict[tuple[str, int], StockSeries] = OrderedDict()
+        self.nbytes = 0
+        self.num_of_hits = 0
+        self.num_of_misses = 0
+
+    def add(self, table: models, stock_id: int, stock_series: StockSeries) -> None:
+        self.remove((table.__tablename__, stock_id))
+        self.series[(table.__tablename__, stock_id)] = stock_series
+        self.nbytes += stock_series.nbytes
+        while self.nbytes > self.memory_budget and len(self.series) > 1:
+            _, evicted_series = self.series.popitem(last=False)
+            self.nbytes -= evicted_series.nbytes
+
+    def remove(self, key: tuple[str, int]) -> None:
+        stock_series = self.series.pop(key, None)
+        if stock_series is not None:
+            self.nbytes -= stock_series.nbytes
+
+    # drops the cached series of a table (of all tables when None), only of the given stocks when not None
+    def invalidate(self, table: models = None, stock_ids: list[int] = None) -> None:
+        for key in list(self.series.keys()):
+            if (table is None or key[0] == table.__tablename__) and (stock_ids is None or key[1] in stock_ids):
+                self.remove(key)
+
+    # the latest date of the given stocks (of all the table's stocks when None), read again on every call
+    @staticmethod
+    def get_watermarks(table: models, stock_ids: list[int] = None) -> dict[int, date]:
+        watermarks = FreshnessIndex.query_latest_dates(table, stock_ids)
+        # a new transaction for the next call, so it sees the rows committed since
+        get_db().commit()
+        return watermarks
+
+    # loads the given stocks' series after "after_day" from the db, a stock without rows gets an empty series
+    def load_series(self, table: models, stock_ids: list[int], watermarks: dict[int, date],
+                    after_day: int | None = None) -> dict[int, StockSeries]:
+        value_columns = get_value_columns(table)
+        after_date = from_day_numbers(np.array([after_day]))[0] if after_day is not None else None
+        frame = self.dataset_loader.load(table, stock_ids, ['stock_id', 'date'] + value_columns, after_date=after_date)
+        stock_frames = dict(tuple(frame.groupby('stock_id'))) if len(frame) > 0 else {}
+
+        loaded_series = {}
+        for stock_id in stock_ids:
+            stock_frame = stock_frames.get(stock_id, frame.iloc[:0])
+            loaded_series[stock_id] = StockSeries(
+                days=to_day_numbers(stock_frame['date']),
+                values={column: stock_frame[column].to_numpy(dtype=self.value_dtype) for column in value_columns},
+                watermark=watermarks.get(stock_id),
+                after_day=after_day)
+        return loaded_series
+
+    # returns the series of the given stocks holding their rows after "after_day" (all their rows when None),
+    # loading the ones that aren't cached, are stale or start too late
+    def get_series(self, table: models, stock_ids: list[int], after_day: int | None = None,
+                   watermarks: dict[int, date] = None) -> dict[int, StockSeries]:
+        if table not in CACHED_TABLES:
+            raise ValueError(f"{table.__tablename__} isn't cached")
+        if watermarks is None:
+            watermarks = self.get_watermarks(table, stock_ids)
+
+        stock_series = {}
+        missing_stock_ids = []
+        for stock_id in stock_ids:
+            key = (table.__tablename__, stock_id)
+            cached_series = self.series.get(key)
+            if cached_series is not None and cached_series.watermark == watermarks.get(stock_id) and \
+                    cached_series.covers(after_day):
+                self.series.move_to_end(key)
+                stock_series[stock_id] = cached_series
+            else:
+                missing_stock_ids.append(stock_id)
+
+        self.num_of_hits += len(stock_series)
+        self.num_of_misses += len(missing_stock_ids)
+        if missing_stock_ids:
+            start_time = time.perf_counter()
+            loaded_series = self.load_series(table, missing_stock_ids, watermarks, after_day)
+            for stock_id, series in loaded_series.items():
+                self.add(table, stock_id, series)
+            stock_series.update(loaded_series)
+            logging.debug(f"{table.__tablename__}: series of {len(missing_stock_ids)} stocks cached "
+                          f"({self.nbytes / 1024 ** 2:.1f} MB in use, {time.perf_counter() - start_time:.2f} seconds)")
+
+        return stock_series
+
+    # returns the rows of the given stocks (all stocks of the table when None) like "DatasetLoader.load" -
+    # "after_date < date <= until_date", ordered by stock and date
+    def load(self, table: models, stock_ids: list[int] = None, columns: list[str] = None,
+             after_date: date | str = None, until_date: date | str = None) -> pd.DataFrame:
+        watermarks = None
+        if stock_ids is None:
+            watermarks = self.get_watermarks(table)
+            stock_ids = sorted(watermarks.keys())
+        column_names = columns if columns is not None else ['stock_id', 'date'] + get_value_columns(table)
+        value_columns = [column for column in column_names if column not in ['stock_id', 'date']]
+        unknown_columns = set(value_columns) - set(get_value_columns(table))
+        if unknown_columns:
+            raise ValueError(f"{table.__tablename__} columns {sorted(unknown_columns)} aren't cached")
+
+        after_day = to_day_numbers([pd.Timestamp(after_date)])[0] if after_date is not None else None
+        until_day = to_day_numbers([pd.Timestamp(until_date)])[0] if until_date is not None else None
+        stock_series = self.get_series(table, sorted(set(stock_ids)), after_day, watermarks)
+
+        stock_id_parts, day_parts, value_parts = [], [], {column: [] for column in value_columns}
+        for stock_id, series in sorted(stock_series.items()):
+            first = np.searchsorted(series.days, after_day, side='right') if after_day is not None else 0
+            last = np.searchsorted(series.days, until_day, side='right') if until_day is not None else len(series.days)
+            stock_id_parts.append(np.full(max(last - first, 0), stock_id, dtype=np.int64))
+            day_parts.append(series.days[first:last])
+            for column in value_columns:
+                value_parts[column].append(series.values[column][first:last])
+
+        data = {'stock_id': np.concatenate(stock_id_parts) if stock_id_parts else np.empty(0, dtype=np.int64),
+                'date': from_day_numbers(np.concatenate(day_parts) if day_parts else np.empty(0, dtype=np.int32))}
+        for column in value_columns:
+            data[column] = np.concatenate(value_parts[column]) if value_parts[column] else \
+                np.empty(0, dtype=self.value_dtype)
+        return pd.DataFrame(data)[column_names]
+
+    def load_stock(self, table: models, stock_id: int, columns: list[str] = None, after_date: date | str = None,
+                   until_date: date | str = None) -> pd.DataFrame:
+        return self.load(table, [stock_id], columns, after_date, until_date)
@@ -0,0 +1,11 @@
+import pandas as pd
+
+# wikipedia's list of the S&P 500 companies - the stocks the db is populated with
+SNP500_WIKI_URL = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+SNP500_WIKI_SYMBOL_COLUMN_NAME = 'Symbol'
+
+
+# fetches the relevant table, containing the s&p500 tickers, from wikipedia and returns its symbols
+def fetch_snp500_tickers() -> list[str]:
+    datatable_snp500 = pd.read_html(SNP500_WIKI_URL)[0]
+    return datatable_snp500[SNP500_WIKI_SYMBOL_COLUMN_NAME].tolist()
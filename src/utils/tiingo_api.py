@@ -1,12 +1,38 @@
-from types import SimpleNamespace
-from dataclasses import dataclass
+from collections import defaultdict
+from dataclasses import dataclass, field, fields
+import json
+import numpy as np
+import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+from utils.tiingo_concurrent_fetcher import RateLimiter, RETRY_STATUS_CODES, describe_error
+from utils.tiingo_response_cache import TiingoResponseCache, CacheMissError, FUNDAMENTALS_STATEMENTS_ENDPOINT, \
+    FUNDAMENTALS_DAILY_ENDPOINT, DAILY_PRICES_ENDPOINT, DAILY_META_ENDPOINT
 
 # creating the connection to the tiingo website
 BASE_URL = "https://api.tiingo.com/tiingo"
 API_TOKEN = os.getenv('TIINGO_API_TOKEN')
 
+# connection pool size should be at least the number of threads fetching in parallel
+DEFAULT_POOL_SIZE = 10
+# (connect timeout, read timeout) in seconds - the full fundamentals payloads can take a while to download
+DEFAULT_TIMEOUT = (10, 120)
+# a request failing with a rate limit, a temporary server error or a connection error is retried up to this many times
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE_SEC = 1.0
+
+# orjson parses the large payloads (full price history / fundamentals) several times faster than json, if available
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # first dataclass below - fundamentals
 @dataclass
 class DailyMultipliersData:
@@ -42,13 +68,14 @@ class BalanceSheet:
     value: float
 
 
+# tiingo sends every statement as a list of dataCode/value pairs (the dataclasses above),
+# the decoder flattens each list into a {dataCode: value} dictionary
 @dataclass
 class StatementData:
-    incomeStatement: object
-    balanceSheet: list[BalanceSheet]
-    cashFlow: list[FreeCashFlow]
-    incomeStatement: list[IncomeStatement]
-    overview: list[Overview]
+    balanceSheet: dict[str, float] = field(default_factory=dict)
+    cashFlow: dict[str, float] = field(default_factory=dict)
+    incomeStatement: dict[str, float] = field(default_factory=dict)
+    overview: dict[str, float] = field(default_factory=dict)
 
     def __getitem__(self, key):
         return self.balanceSheet[key]
@@ -83,41 +110,222 @@ class EndOfDayPrices:
     splitFactor: float
 
 
+def loads(body: bytes):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+# this function decodes a list of daily records (prices / daily multipliers) straight into typed columns.
+# The frame's columns are the fields of the given dataclass, missing values are NaN and dates are "YYYY-MM-DD"
+def decode_daily_records(payload: list[dict], record_class: type) -> pd.DataFrame:
+    columns = {}
+    for record_field in fields(record_class):
+        values = [record.get(record_field.name) for record in payload]
+        if record_field.type is str:
+            columns[record_field.name] = [value[:10] if value is not None else None for value in values]
+        else:
+            columns[record_field.name] = np.array(values, dtype=np.float64)
+
+    return pd.DataFrame(columns)
+
+
+def decode_end_of_day_prices(payload: list[dict]) -> pd.DataFrame:
+    return decode_daily_records(payload, EndOfDayPrices)
+
+
+def decode_daily_multipliers(payload: list[dict]) -> pd.DataFrame:
+    return decode_daily_records(payload, DailyMultipliersData)
+
+
+def decode_fundamentals(payload: list[dict]) -> list[Fundamental]:
+    fundamentals_lst = []
+    for item in payload:
+        statement_data = item.get('statementData') or {}
+        statements = {}
+        for statement_field in fields(StatementData):
+            key_values = statement_data.get(statement_field.name) or []
+            statements[statement_field.name] = {key_value['dataCode']: key_value['value'] for key_value in key_values}
+
+        fundamentals_lst.append(Fundamental(item['date'], item['year'], item['quarter'], StatementData(**statements)))
+
+    return fundamentals_lst
+
+
+# this function yields the rows of a decoded frame as named tuples (e.g. item.date, item.close),
+# with None instead of NaN so they can be written to the db as is
+def iter_records(frame: pd.DataFrame):
+    return frame.astype(object).where(frame.notna(), None).itertuples(index=False)
+
+
 class TiingoApi:
-    def __init__(self) -> None:
+    def __init__(self, base_url: str = BASE_URL, pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: tuple[float, float] = DEFAULT_TIMEOUT, cache: TiingoResponseCache = None,
+                 rate_limiter: RateLimiter = None, max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base_sec: float = DEFAULT_BACKOFF_BASE_SEC) -> None:
         super().__init__()
 
+        # base url can be replaced (e.g. by a local http server) for testing purposes
+        self.base_url = base_url
+        self.timeout = timeout
+        # every request sent to tiingo takes a token, so the hourly and daily quotas are kept by all the threads
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.max_retries = max_retries
+        self.backoff_base_sec = backoff_base_sec
+        # optional disk cache of the raw responses (None - every request goes to tiingo)
+        self.cache = cache
         self.headers = {
             'Content-Type': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
             'Authorization': API_TOKEN
         }
 
+        # a single session is shared by all requests, so connections are kept alive and reused
+        # instead of paying a new TCP + TLS handshake per request
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # payload bytes received from tiingo and number of requests sent, per endpoint (cache hits aren't counted)
+        self.stats_lock = threading.Lock()
+        self.received_bytes_by_endpoint: dict[str, int] = defaultdict(int)
+        self.num_of_requests_by_endpoint: dict[str, int] = defaultdict(int)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def get_backoff_time(self, attempt: int, error: Exception) -> float:
+        # respect the server's own instruction when it sends one
+        response = getattr(error, 'response', None)
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return float(response.headers['Retry-After'])
+
+        # exponential backoff with jitter, so parallel workers don't retry at the exact same moment
+        return self.backoff_base_sec * (2 ** attempt) * (1 + random.random())
+
+    # this function sends a single request to tiingo. Every attempt takes a token from the rate limiter, and a rate
+    # limit, a temporary server error or a connection error retries this request only (never the requests a caller
+    # already completed). Any other error status code raises requests.HTTPError
+    def _get(self, url: str, params: dict = None, headers: dict = None) -> requests.Response:
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+                response.raise_for_status()
+                return response
+            except requests.HTTPError as error:
+                if error.response is None or error.response.status_code not in RETRY_STATUS_CODES \
+                        or attempt >= self.max_retries:
+                    raise
+                retry_error = error
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if attempt >= self.max_retries:
+                    raise
+                retry_error = error
+
+            # the url's path only - the query string holds the api token
+            backoff_time = self.get_backoff_time(attempt, retry_error)
+            logging.warning(f"{urlparse(url).path} failed ({describe_error(retry_error)}), "
+                            f"retrying in {backoff_time:.1f} seconds")
+            time.sleep(backoff_time)
+            attempt += 1
+
+    def count_response(self, endpoint: str, response: requests.Response) -> None:
+        with self.stats_lock:
+            self.received_bytes_by_endpoint[endpoint] += len(response.content)
+            self.num_of_requests_by_endpoint[endpoint] += 1
+
+    def reset_transfer_stats(self) -> None:
+        with self.stats_lock:
+            self.received_bytes_by_endpoint.clear()
+            self.num_of_requests_by_endpoint.clear()
+
+    # returns the number of requests answered by tiingo since the last reset (retried attempts aren't counted)
+    def get_num_of_requests(self) -> int:
+        with self.stats_lock:
+            return sum(self.num_of_requests_by_endpoint.values())
+
+    # returns the number of requests and the payload size received per endpoint since the last reset, for logging
+    def describe_transfer_stats(self) -> str:
+        with self.stats_lock:
+            return ', '.join(f"{endpoint}: {self.num_of_requests_by_endpoint[endpoint]} requests, "
+                             f"{received_bytes / 1024:.1f} KB"
+                             for endpoint, received_bytes in sorted(self.received_bytes_by_endpoint.items())) or 'nothing'
+
+    # this function returns the parsed json of a tiingo endpoint, served from the disk cache when possible.
+    # Expired responses are revalidated with tiingo (etag / last-modified) instead of being downloaded again
+    def _get_json(self, endpoint: str, ticker: str, url: str, params: dict = None, decoder=None):
+        params = params if params is not None else {}
+        decoder = decoder if decoder is not None else (lambda payload: payload)
+        if self.cache is None:
+            response = self._get(url, {**params, 'token': API_TOKEN})
+            self.count_response(endpoint, response)
+            return decoder(loads(response.content))
+
+        key = self.cache.make_key(endpoint, ticker, params)
+        cached = self.cache.get(key, endpoint)
+        if cached is not None and (cached.is_fresh or self.cache.offline):
+            return decoder(loads(cached.body))
+        if self.cache.offline:
+            raise CacheMissError(f"{endpoint} of {ticker} {params} isn't cached (offline mode)")
+
+        headers = {}
+        if cached is not None and cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached is not None and cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+
+        response = self._get(url, {**params, 'token': API_TOKEN}, headers)
+        self.count_response(endpoint, response)
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if response.status_code == 304:
+            self.cache.refresh(key, endpoint, etag or cached.etag, last_modified or cached.last_modified)
+            return decoder(loads(cached.body))
+
+        self.cache.put(key, endpoint, response.content, etag, last_modified)
+        return decoder(loads(response.content))
+
     # this functions returns the complete fundamental data in json format from tiingo per single stock
     def get_all_daily_fundamentals_data(self, ticker: str) -> list[Fundamental]:
         ticker = ticker.replace('.', '')
-        url = f"{BASE_URL}/fundamentals/{ticker}/statements?token={API_TOKEN}"
-        response = requests.get(url, headers=self.headers)
-        return response.json(object_hook=lambda d: SimpleNamespace(**d))
+        url = f"{self.base_url}/fundamentals/{ticker}/statements"
+        return self._get_json(FUNDAMENTALS_STATEMENTS_ENDPOINT, ticker, url, decoder=decode_fundamentals)
 
-    # this functions returns the complete end of day prices data in json format from tiingo per single stock
-    def get_end_of_day_prices_by_date(self, ticker: str, start_date_str='2012-1-1') -> list[EndOfDayPrices]:
+    # this functions returns the complete end of day prices data from tiingo per single stock,
+    # as a frame with the columns of EndOfDayPrices
+    def get_end_of_day_prices_by_date(self, ticker: str, start_date_str='2012-1-1') -> pd.DataFrame:
         ticker = ticker.replace('.', '')
-        url = f"{BASE_URL}/daily/{ticker}/prices?startDate={start_date_str}&token={API_TOKEN}"
-        response = requests.get(url, headers=self.headers)
-        return response.json(object_hook=lambda d: SimpleNamespace(**d))
+        url = f"{self.base_url}/daily/{ticker}/prices"
+        return self._get_json(DAILY_PRICES_ENDPOINT, ticker, url, {'startDate': str(start_date_str)},
+                              decoder=decode_end_of_day_prices)
 
-    # this functions returns the final daily multipliers result data in json format from tiingo per single stock
-    def get_daily_multipliers(self, ticker: str) -> list[DailyMultipliersData]:
+    # this functions returns the final daily multipliers result data from tiingo per single stock,
+    # as a frame with the columns of DailyMultipliersData. Without dates the complete history is returned,
+    # "start_date_str" / "end_date_str" limit it to a window (e.g. only the dates after our db's last one)
+    def get_daily_multipliers(self, ticker: str, start_date_str=None, end_date_str=None) -> pd.DataFrame:
         ticker = ticker.replace('.', '')
-        url = f"{BASE_URL}/fundamentals/{ticker}/daily?token={API_TOKEN}"
-        response = requests.get(url, headers=self.headers)
-        return response.json(object_hook=lambda d: SimpleNamespace(**d))
+        url = f"{self.base_url}/fundamentals/{ticker}/daily"
+        params = {}
+        if start_date_str is not None:
+            params['startDate'] = str(start_date_str)
+        if end_date_str is not None:
+            params['endDate'] = str(end_date_str)
+        return self._get_json(FUNDAMENTALS_DAILY_ENDPOINT, ticker, url, params, decoder=decode_daily_multipliers)
 
     # this functions returns the last update date in tiingo per single stock
     def get_last_update_date_daily(self, ticker: str) -> str | None:
         ticker = ticker.replace('.', '')
-        url = f"{BASE_URL}/daily/{ticker}?token={API_TOKEN}"
-        response = requests.get(url, headers=self.headers).json()
+        url = f"{self.base_url}/daily/{ticker}"
+        response = self._get_json(DAILY_META_ENDPOINT, ticker, url)
         if response is None or len(response) == 0:
             return None
         else:
@@ -126,8 +334,8 @@ class TiingoApi:
     # To request historical statement data limited by date range, use this endpoint
     def get_last_update_quarterly_fundamentals_date(self, ticker: str, start_date_str='2022-01-01') -> str | None:
         ticker = ticker.replace('.', '')
-        url = f"{BASE_URL}/fundamentals/{ticker}/statements?startDate={start_date_str}&token={API_TOKEN}"
-        response = requests.get(url, headers=self.headers).json()
+        url = f"{self.base_url}/fundamentals/{ticker}/statements"
+        response = self._get_json(FUNDAMENTALS_STATEMENTS_ENDPOINT, ticker, url, {'startDate': str(start_date_str)})
 
         if response is None or len(response) == 0:
             return None
@@ -136,6 +344,6 @@ class TiingoApi:
 
     def get_last_update_quarterly_fundamentals(self, ticker: str, start_date_str='2022-01-01') -> list[Fundamental]:
         ticker = ticker.replace('.', '')
-        url = f"{BASE_URL}/fundamentals/{ticker}/statements?startDate={start_date_str}&token={API_TOKEN}"
-        response = requests.get(url, headers=self.headers)
-        return response.json(object_hook=lambda d: SimpleNamespace(**d))
+        url = f"{self.base_url}/fundamentals/{ticker}/statements"
+        return self._get_json(FUNDAMENTALS_STATEMENTS_ENDPOINT, ticker, url, {'startDate': str(start_date_str)},
+                              decoder=decode_fundamentals)
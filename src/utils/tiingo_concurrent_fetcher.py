@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Tiingo's request quotas (power plan), see: https://www.tiingo.com/account/billing/pricing
+TIINGO_HOURLY_REQUESTS_LIMIT = 10000
+TIINGO_DAILY_REQUESTS_LIMIT = 100000
+
+SECONDS_IN_HOUR = 60 * 60
+SECONDS_IN_DAY = 24 * SECONDS_IN_HOUR
+
+# status codes that mean "try again later" (rate limit or a temporary server error)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# a bucket holds up to "capacity" tokens and is refilled continuously along "refill_period_sec",
+# every http request takes one token from it
+class TokenBucket:
+
+    def __init__(self, capacity: int, refill_period_sec: float) -> None:
+        super().__init__()
+
+        self.capacity = capacity
+        self.refill_rate = capacity / refill_period_sec
+        self.tokens = float(capacity)
+        self.last_refill_time = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill_time) * self.refill_rate)
+        self.last_refill_time = now
+
+    # returns the number of seconds until a token will be available (0 if there is one already)
+    def get_wait_time(self) -> float:
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.refill_rate
+
+
+# the rate limiter takes a token from all of its buckets at once, so both the hourly and the daily quotas are kept
+class RateLimiter:
+
+    def __init__(self, buckets: list[TokenBucket] = None) -> None:
+        super().__init__()
+
+        if buckets is None:
+            buckets = [TokenBucket(TIINGO_HOURLY_REQUESTS_LIMIT, SECONDS_IN_HOUR),
+                       TokenBucket(TIINGO_DAILY_REQUESTS_LIMIT, SECONDS_IN_DAY)]
+        self.buckets = buckets
+        self.lock = threading.Lock()
+
+    # blocks until a request is allowed by all buckets
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                for bucket in self.buckets:
+                    bucket.refill(now)
+                wait_time = max(bucket.get_wait_time() for bucket in self.buckets)
+                if wait_time == 0:
+                    for bucket in self.buckets:
+                        bucket.tokens -= 1
+                    return
+            time.sleep(wait_time)
+
+
+# describes an error without its url, since tiingo's urls contain the api token
+def describe_error(error: Exception) -> str:
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return f"status code {response.status_code}"
+    return type(error).__name__
+
+
+# This class runs a fetch function for many tickers in parallel threads. Rate limiting and retries are done per
+# request by the TiingoApi, so a fetch function may send several requests for a ticker
+class ConcurrentTiingoFetcher:
+
+    def __init__(self, max_workers: int = 8) -> None:
+        super().__init__()
+
+        self.max_workers = max_workers
+
+    # this function fetches the data of many tickers in parallel and yields (ticker, result) as soon as each
+    # ticker is done, so the db writers can consume results while the next tickers are still being downloaded.
+    # The number of pending results is bounded, so a slow writer doesn't make the downloaded payloads pile up.
+    # Tickers whose fetch failed are logged and appended to "failed_tickers" (when given), so the run can report them
+    def fetch_all(self, tickers: Iterable[str], fetch_function: Callable, *args, failed_tickers: list[str] = None,
+                  **kwargs) -> Iterator[tuple[str, object]]:
+        tickers_iter = iter(tickers)
+        max_pending = self.max_workers * 2
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {}
+            while True:
+                for ticker in tickers_iter:
+                    pending[executor.submit(fetch_function, ticker, *args, **kwargs)] = ticker
+                    if len(pending) >= max_pending:
+                        break
+
+                if not pending:
+                    return
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ticker = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        logging.error(f"Fetching data for {ticker} failed: {describe_error(error)}")
+                        if failed_tickers is not None:
+                            failed_tickers.append(ticker)
+                        continue
+                    yield ticker, result
@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+# the cache directory can be changed with the "TIINGO_CACHE_DIR" environment variable
+DEFAULT_CACHE_DIR = os.getenv('TIINGO_CACHE_DIR', str(Path.home() / '.tau_trading' / 'tiingo_cache'))
+DEFAULT_MAX_SIZE_BYTES = 2 * 1024 ** 3
+
+# endpoint names used as part of the cache key
+FUNDAMENTALS_STATEMENTS_ENDPOINT = 'fundamentals_statements'
+FUNDAMENTALS_DAILY_ENDPOINT = 'fundamentals_daily'
+DAILY_PRICES_ENDPOINT = 'daily_prices'
+DAILY_META_ENDPOINT = 'daily_meta'
+
+# how long a cached response is served without asking tiingo again, per endpoint (in seconds).
+# Historical statements rarely change, while the meta data endpoint tells us whether there is anything new
+DEFAULT_TTL_BY_ENDPOINT = {
+    FUNDAMENTALS_STATEMENTS_ENDPOINT: 7 * 24 * 60 * 60,
+    FUNDAMENTALS_DAILY_ENDPOINT: 24 * 60 * 60,
+    DAILY_PRICES_ENDPOINT: 24 * 60 * 60,
+    DAILY_META_ENDPOINT: 60 * 60,
+}
+
+PAYLOAD_SUFFIX = '.json.gz'
+META_SUFFIX = '.meta.json'
+
+
+class CacheMissError(Exception):
+    pass
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str | None
+    last_modified: str | None
+    is_fresh: bool
+
+
+# Disk cache of raw tiingo responses. Every response is stored gzip compressed under the hash of the request
+# (endpoint, ticker and query parameters), next to a small meta data file used for ttl and revalidation.
+# When the cache grows above "max_size_bytes" the least recently used responses are evicted
+class TiingoResponseCache:
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl_by_endpoint: dict[str, float] = None,
+                 max_size_bytes: int = DEFAULT_MAX_SIZE_BYTES, offline: bool = False) -> None:
+        super().__init__()
+
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl_by_endpoint = ttl_by_endpoint if ttl_by_endpoint is not None else DEFAULT_TTL_BY_ENDPOINT
+        self.max_size_bytes = max_size_bytes
+        # in offline mode responses are served from the cache only (even if expired), nothing is requested
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.total_size_bytes = sum(path.stat().st_size for path in self.cache_dir.glob(f'*/*{PAYLOAD_SUFFIX}'))
+
+    @staticmethod
+    def make_key(endpoint: str, ticker: str, params: dict) -> str:
+        key_str = json.dumps([endpoint, ticker, params], sort_keys=True, default=str)
+        return hashlib.sha256(key_str.encode()).hexdigest()
+
+    def get_paths(self, key: str) -> tuple[Path, Path]:
+        key_dir = self.cache_dir / key[:2]
+        return key_dir / f'{key}{PAYLOAD_SUFFIX}', key_dir / f'{key}{META_SUFFIX}'
+
+    def get(self, key: str, endpoint: str) -> CachedResponse | None:
+        payload_path, meta_path = self.get_paths(key)
+        try:
+            meta = json.loads(meta_path.read_text())
+            body = gzip.decompress(payload_path.read_bytes())
+        except (OSError, ValueError, EOFError):
+            return None
+
+        # the payload's modification time marks its last use, for the lru eviction
+        os.utime(payload_path)
+        is_fresh = time.time() - meta['fetched_at'] < self.ttl_by_endpoint.get(endpoint, 0)
+        return CachedResponse(body, meta.get('etag'), meta.get('last_modified'), is_fresh)
+
+    def put(self, key: str, endpoint: str, body: bytes, etag: str | None = None, last_modified: str | None = None) -> None:
+        payload_path, meta_path = self.get_paths(key)
+        payload_path.parent.mkdir(exist_ok=True)
+        compressed_body = gzip.compress(body, compresslevel=6)
+
+        with self.lock:
+            if payload_path.exists():
+                self.total_size_bytes -= payload_path.stat().st_size
+
+            # write to temporary files first, so a crash never leaves a half written entry behind
+            tmp_payload_path = payload_path.with_suffix(f'.{threading.get_ident()}.tmp')
+            tmp_payload_path.write_bytes(compressed_body)
+            os.replace(tmp_payload_path, payload_path)
+            self.write_meta(meta_path, endpoint, etag, last_modified)
+            self.total_size_bytes += len(compressed_body)
+
+            if self.total_size_bytes > self.max_size_bytes:
+                self.evict()
+
+    # marks a cached response as fresh again, after tiingo answered "304 not modified"
+    def refresh(self, key: str, endpoint: str, etag: str | None, last_modified: str | None) -> None:
+        _, meta_path = self.get_paths(key)
+        with self.lock:
+            self.write_meta(meta_path, endpoint, etag, last_modified)
+
+    @staticmethod
+    def write_meta(meta_path: Path, endpoint: str, etag: str | None, last_modified: str | None) -> None:
+        meta = {'endpoint': endpoint, 'fetched_at': time.time(), 'etag': etag, 'last_modified': last_modified}
+        tmp_meta_path = meta_path.with_suffix(f'.{threading.get_ident()}.tmp')
+        tmp_meta_path.write_text(json.dumps(meta))
+        os.replace(tmp_meta_path, meta_path)
+
+    # removes the least recently used responses until the cache is back to 90% of its size limit
+    def evict(self) -> None:
+        payload_paths = sorted(self.cache_dir.glob(f'*/*{PAYLOAD_SUFFIX}'), key=lambda path: path.stat().st_mtime)
+        target_size_bytes = self.max_size_bytes * 0.9
+        num_of_evicted = 0
+        for payload_path in payload_paths:
+            if self.total_size_bytes <= target_size_bytes:
+                break
+            self.total_size_bytes -= payload_path.stat().st_size
+            payload_path.unlink(missing_ok=True)
+            payload_path.with_name(payload_path.name.replace(PAYLOAD_SUFFIX, META_SUFFIX)).unlink(missing_ok=True)
+            num_of_evicted += 1
+
+        logging.info(f"tiingo cache: evicted {num_of_evicted} responses, {self.total_size_bytes / 1024 ** 2:.1f} MB left")
@@ -0,0 +1,71 @@
+from datetime import date
+from utils import models
+from utils.tiingo_api import Fundamental
+
+# this file maps the decoded tiingo data into the column values of our db tables
+
+# Every quarterly table is filled from one section of the same Tiingo "statements" item.
+# The dictionary below maps each table to its section name and to the data codes it stores,
+# so a single fetched item can be fanned out to all four tables
+QUARTERLY_TABLES_STATEMENTS = {
+    models.QuarterlyBalanceSheetData: ('balanceSheet', [
+        "debtCurrent", "taxAssets", "investmentsCurrent", "totalAssets", "acctPay", "accoci", "totalLiabilities",
+        "acctRec", "intangibles", "ppeq", "deferredRev", "cashAndEq", "assetsNonCurrent", "taxLiabilities",
+        "investments", "equity", "retainedEarnings", "deposits", "assetsCurrent", "investmentsNonCurrent", "debt",
+        "debtNonCurrent", "liabilitiesNonCurrent", "liabilitiesCurrent", "sharesBasic"
+    ]),
+    models.QuarterlyCashFlow: ('cashFlow', [
+        "ncfi", "capex", "ncfx", "ncff", "sbcomp", "ncf", "payDiv", "businessAcqDisposals", "issrepayDebt",
+        "issrepayEquity", "investmentsAcqDisposals", "freeCashFlow", "ncfo", "depamor"
+    ]),
+    models.QuarterlyIncomeStatement: ('incomeStatement', [
+        "ebit", "epsDil", "rnd", "shareswa", "taxExp", "opinc", "costRev", "grossProfit", "ebitda",
+        "nonControllingInterests", "netIncDiscOps", "eps", "intexp", "shareswaDil", "revenue", "netinc", "opex",
+        "consolidatedIncome", "netIncComStock", "ebt", "prefDVDs", "sga"
+    ]),
+    models.QuarterlyOverview: ('overview', [
+        "longTermDebtEquity", "shareFactor", "bookVal", "roa", "currentRatio", "roe", "grossMargin",
+        "piotroskiFScore", "epsQoQ", "revenueQoQ", "profitMargin", "rps", "bvps"
+    ]),
+}
+
+
+# this function creates the column values of a single quarterly table row from one fundamentals item
+def create_quarterly_row(ticker_id: int, fundamental_item: Fundamental, table: models) -> dict:
+    statement_name, data_codes = QUARTERLY_TABLES_STATEMENTS[table]
+    # the decoded statement is a {dataCode: value} dictionary.
+    # If there is no such statement then dictionary will be empty and rows will be populated with None values
+    dict1 = getattr(fundamental_item.statementData, statement_name)
+
+    row = {
+        'stock_id': ticker_id,
+        'date': date.fromisoformat(fundamental_item.date[:10]),
+        'year': fundamental_item.year,
+        'quarter': fundamental_item.quarter,
+    }
+    for data_code in data_codes:
+        row[data_code] = dict1.get(data_code)
+
+    return row
+
+
+# this function creates the column values of a single "end of day prices" row from one decoded tiingo record
+def create_end_of_day_prices_row(ticker_id: int, end_of_day_item) -> dict:
+    return {
+        'stock_id': ticker_id,
+        'date': date.fromisoformat(end_of_day_item.date),
+        'close_price': end_of_day_item.close,
+    }
+
+
+# this function creates the column values of a single "full daily multipliers" row from one decoded tiingo record
+def create_daily_multipliers_row(ticker_id: int, daily_item) -> dict:
+    return {
+        'stock_id': ticker_id,
+        'date': date.fromisoformat(daily_item.date),
+        'market_cap': daily_item.marketCap,
+        'enterprise_val': daily_item.enterpriseVal,
+        'pe_ratio': daily_item.peRatio,
+        'pb_ratio': daily_item.pbRatio,
+        'trailing_peg_1_y': daily_item.trailingPEG1Y,
+    }
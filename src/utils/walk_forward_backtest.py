@@ -0,0 +1,180 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from .dataset_loader import DatasetLoader
+from .rf_grid_search import FEATURE_COLUMNS, PROFIT_COLUMN
+from . import models
+
+ROLLING_MODE = 'rolling'
+EXPANDING_MODE = 'expanding'
+# a window with fewer labelled training rows isn't traded
+MIN_TRAIN_ROWS = 100
+
+
+@dataclass
+class BacktestConfig:
+    # "rolling" - every model is trained on the last "train_days", "expanding" - on everything since "start_date"
+    mode: str = EXPANDING_MODE
+    start_date: date = date(2013, 1, 2)
+    train_days: int = 4 * 365
+    # the model is retrained every "test_days", and trades the days until the next retrain
+    test_days: int = 182
+    label_threshold: float = 5
+    model_threshold: float = 0.7
+    rf_params: dict = field(default_factory=lambda: {'n_estimators': 101, 'criterion': "gini", 'max_depth': 5,
+                                                     'max_features': 3, 'random_state': 711})
+    feature_columns: list[str] = field(default_factory=lambda: list(FEATURE_COLUMNS))
+
+
+@dataclass
+class BacktestResult:
+    # a row per (stock, traded day) - the model's probability, the prediction and the stock's equity curve
+    stock_curves: pd.DataFrame
+    # a row per traded day - the positions opened by all the stocks and the portfolio's equity curve
+    portfolio_curve: pd.DataFrame
+    # a row per stock - number of retrains and trades and the mean profit per trade
+    stock_summary: pd.DataFrame
+
+
+# returns the first day of every walk-forward window (as day numbers), from the end of the first training period
+def get_window_starts(config: BacktestConfig, last_day: int) -> np.ndarray:
+    first_test_day = np.datetime64(config.start_date, 'D').astype(np.int64) + config.train_days
+    return np.arange(first_test_day, last_day + 1, config.test_days)
+
+
+# runs the walk-forward backtest of a single stock - in a worker process. "days" and "label_days" are the rows' dates
+# and the dates their label is known on (date_plus_3m), as day numbers, ordered by date. Every window's model is trained
+# only on rows whose label was known before the window started, so no future price leaks into a prediction.
+# Returns the probability of every traded row (NaN for rows of windows that weren't traded) and the number of retrains
+def backtest_stock(days: np.ndarray, label_days: np.ndarray, features: np.ndarray, profits: np.ndarray,
+                   config: BacktestConfig) -> tuple[np.ndarray, int]:
+    probabilities = np.full(len(days), np.nan)
+    if len(days) == 0:
+        return probabilities, 0
+
+    labels = (profits > config.label_threshold).astype(int)
+    window_starts = get_window_starts(config, days[-1])
+    test_begins = np.searchsorted(days, window_starts, side='left')
+    test_ends = np.append(test_begins[1:], len(days))
+    # label_days is ordered as well (the dates 60 rows later), so the rows known before a window are a prefix
+    train_ends = np.searchsorted(label_days, window_starts, side='left')
+    if config.mode == ROLLING_MODE:
+        train_begins = np.searchsorted(days, window_starts - config.train_days, side='left')
+    else:
+        train_begins = np.zeros(len(window_starts), dtype=np.int64)
+
+    num_of_retrains = 0
+    for train_begin, train_end, test_begin, test_end in zip(train_begins, train_ends, test_begins, test_ends):
+        if test_begin >= test_end or train_end - train_begin < MIN_TRAIN_ROWS:
+            continue
+
+        train_labels = labels[train_begin:train_end]
+        if train_labels.min() == train_labels.max():
+            # a single class - every day of the window gets its probability
+            probabilities[test_begin:test_end] = float(train_labels[0])
+        else:
+            rand_frst_clf = RandomForestClassifier(**config.rf_params, n_jobs=1)
+            rand_frst_clf.fit(features[train_begin:train_end], train_labels)
+            probabilities[test_begin:test_end] = rand_frst_clf.predict_proba(features[test_begin:test_end])[:, 1]
+        num_of_retrains += 1
+
+    return probabilities, num_of_retrains
+
+
+# This class backtests the random forest's trading signal with walk-forward retraining, over any number of stocks.
+# Like the notebooks, every day the model predicts an increase is a trade whose profit is the market cap change
+# in the next 60 trading days ("diff_in_mc_perc"). The equity curves are the cumulative profit (in percents) of the
+# trades in the order they were opened, and their mean profit per trade so far.
+# Stocks are backtested in parallel by a process pool, each window's days are scored in one vectorized pass
+class WalkForwardBacktest:
+
+    def __init__(self, config: BacktestConfig = None, num_of_workers: int = None) -> None:
+        super().__init__()
+
+        self.config = config if config is not None else BacktestConfig()
+        self.num_of_workers = num_of_workers if num_of_workers is not None else os.cpu_count() or 1
+        self.dataset_loader = DatasetLoader()
+
+    # the labelled feature rows of the stocks (all stocks when None), without rows missing a feature value
+    def load_features(self, stock_ids: list[int] = None) -> pd.DataFrame:
+        columns = ['stock_id', 'date', 'date_plus_3m', PROFIT_COLUMN] + self.config.feature_columns
+        features = self.dataset_loader.load(models.ModelFeatures, stock_ids, columns,
+                                            after_date=pd.Timestamp(self.config.start_date) - pd.Timedelta(days=1))
+        return features.dropna(subset=['date_plus_3m', PROFIT_COLUMN] + self.config.feature_columns). \
+            reset_index(drop=True)
+
+    def run(self, stock_ids: list[int] = None) -> BacktestResult:
+        start_time = time.perf_counter()
+        features = self.load_features(stock_ids)
+
+        stock_frames = {stock_id: stock_frame for stock_id, stock_frame in features.groupby('stock_id')}
+        probabilities = {}
+        num_of_retrains = {}
+        with ProcessPoolExecutor(max_workers=self.num_of_workers) as executor:
+            futures = {}
+            for stock_id, stock_frame in stock_frames.items():
+                future = executor.submit(backtest_stock,
+                                         stock_frame['date'].to_numpy('datetime64[D]').astype(np.int64),
+                                         stock_frame['date_plus_3m'].to_numpy('datetime64[D]').astype(np.int64),
+                                         stock_frame[self.config.feature_columns].to_numpy(dtype=np.float64),
+                                         stock_frame[PROFIT_COLUMN].to_numpy(dtype=np.float64),
+                                         self.config)
+                futures[future] = stock_id
+
+            for future in as_completed(futures):
+                stock_id = futures[future]
+                try:
+                    probabilities[stock_id], num_of_retrains[stock_id] = future.result()
+                except Exception:
+                    logging.exception(f"backtest of stock {stock_id} failed")
+
+        result = self.create_result(stock_frames, probabilities, num_of_retrains)
+        logging.info(f"walk-forward backtest ({self.config.mode}) of {len(probabilities)} stocks: "
+                     f"{sum(num_of_retrains.values())} models trained, {int(result.stock_curves['prediction'].sum())} "
+                     f"trades ({time.perf_counter() - start_time:.2f} seconds)")
+        return result
+
+    def create_result(self, stock_frames: dict[int, pd.DataFrame], probabilities: dict[int, np.ndarray],
+                      num_of_retrains: dict[int, int]) -> BacktestResult:
+        stock_curves = []
+        for stock_id in sorted(probabilities):
+            stock_frame = stock_frames[stock_id]
+            traded = ~np.isnan(probabilities[stock_id])
+            stock_curve = pd.DataFrame({'stock_id': stock_id,
+                                        'date': stock_frame['date'].to_numpy()[traded],
+                                        PROFIT_COLUMN: stock_frame[PROFIT_COLUMN].to_numpy()[traded],
+                                        'probability': probabilities[stock_id][traded]})
+            stock_curves.append(stock_curve)
+
+        columns = ['stock_id', 'date', PROFIT_COLUMN, 'probability']
+        stock_curves = pd.concat(stock_curves, ignore_index=True) if stock_curves else \
+            pd.DataFrame({column: pd.Series(dtype='float64') for column in columns})
+        stock_curves['prediction'] = (stock_curves['probability'] > self.config.model_threshold).astype(int)
+        stock_curves['profit_percentage'] = stock_curves[PROFIT_COLUMN] * stock_curves['prediction']
+        grouped_curves = stock_curves.groupby('stock_id')
+        stock_curves['cumulative_profit_perc'] = grouped_curves['profit_percentage'].cumsum()
+        stock_curves['num_of_trades'] = grouped_curves['prediction'].cumsum()
+        stock_curves['mean_profit_perc'] = stock_curves['cumulative_profit_perc'] / \
+            stock_curves['num_of_trades'].replace(0, np.nan)
+
+        portfolio_curve = stock_curves.groupby('date').agg(num_of_positions=('prediction', 'sum'),
+                                                           profit_percentage=('profit_percentage', 'sum')).reset_index()
+        portfolio_curve['cumulative_profit_perc'] = portfolio_curve['profit_percentage'].cumsum()
+        portfolio_curve['num_of_trades'] = portfolio_curve['num_of_positions'].cumsum()
+        portfolio_curve['mean_profit_perc'] = portfolio_curve['cumulative_profit_perc'] / \
+            portfolio_curve['num_of_trades'].replace(0, np.nan)
+
+        stock_summary = stock_curves.groupby('stock_id').agg(num_of_days=('date', 'size'),
+                                                             num_of_trades=('prediction', 'sum'),
+                                                             total_profit_perc=('profit_percentage', 'sum')).reset_index()
+        stock_summary['num_of_retrains'] = stock_summary['stock_id'].map(num_of_retrains)
+        stock_summary['mean_profit_perc'] = stock_summary['total_profit_perc'] / \
+            stock_summary['num_of_trades'].replace(0, np.nan)
+
+        return BacktestResult(stock_curves, portfolio_curve, stock_summary)